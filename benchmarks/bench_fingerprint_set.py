@@ -0,0 +1,65 @@
+"""
+Memory and insert throughput of FingerprintSet, compared with a python set of the lines.
+
+Run in the root directory of REPO:
+    export PYTHONPATH=. && python benchmarks/bench_fingerprint_set.py
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+from core.dedup import FingerprintSet
+
+
+def make_lines(n):
+    return ["phrase number %d in the source language |||| phrase %d in the target\n" % (i, i) for i in range(n)]
+
+
+def measure(build, lines):
+    """
+    :return: inserts/s, bytes/entry
+    """
+    t = time.time()
+    build(lines)
+    elapsed = time.time() - t
+    # measure the memory in another run, tracemalloc slows down the inserts
+    tracemalloc.start()
+    seen = build(lines)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    if isinstance(seen, FingerprintSet) and seen.path is not None:
+        memory = os.path.getsize(seen.path)
+        seen.close()
+    return len(lines) / elapsed, memory / len(lines)
+
+
+def build_set(lines):
+    seen = set()
+    for line in lines:
+        # the set keeps a copy of the line, like `collect_results` keeping the formatted line
+        seen.add(line.strip() + '\n')
+    return seen
+
+
+def builder(path=None, fingerprint_size=8):
+    def build(lines):
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+        seen = FingerprintSet(path, fingerprint_size, capacity=1 << 16)
+        for line in lines:
+            seen.add(line)
+        return seen
+    return build
+
+
+if __name__ == "__main__":
+    print("n\tstructure\tinserts/s\tbytes/entry")
+    for n in [100000, 1000000]:
+        lines = make_lines(n)
+        print("%d\tset of lines\t%.0f\t%.1f" % ((n,) + measure(build_set, lines)))
+        print("%d\tFingerprintSet 64-bit\t%.0f\t%.1f" % ((n,) + measure(builder(), lines)))
+        print("%d\tFingerprintSet 128-bit\t%.0f\t%.1f" % ((n,) + measure(builder(fingerprint_size=16), lines)))
+        with tempfile.TemporaryDirectory() as d:
+            print("%d\tFingerprintSet 64-bit mmap\t%.0f\t%.1f" %
+                  ((n,) + measure(builder(os.path.join(d, 'seen')), lines)))
@@ -0,0 +1,48 @@
+"""
+Micro benchmark of haipproxy ProxyFetcher strategies.
+
+Run in the root directory of REPO:
+    export PYTHONPATH=. && python benchmarks/bench_proxy_ring.py
+"""
+import random
+import time
+
+from proxy_pools.haipproxy.client.py_cli import GreedyStrategy, ProxyRing, RobinStrategy
+
+
+def make_proxies(n):
+    return ["http://10.%d.%d.%d:8080" % (i >> 16 & 255, i >> 8 & 255, i & 255) for i in range(n)]
+
+
+def bench(strategy, pool_size, ops=200000):
+    proxies = make_proxies(pool_size)
+    pool = ProxyRing(pool_size)
+    pool.extend(proxies)
+
+    t = time.time()
+    for _ in range(ops):
+        strategy.get_proxies_by_stragery(pool)
+    get_ops = ops / (time.time() - t)
+
+    t = time.time()
+    for i in range(ops):
+        proxy = strategy.get_proxies_by_stragery(pool)
+        if random.random() < 0.1:
+            strategy.process_feedback(pool, 'failure', proxy)
+            pool.add(proxies[i % pool_size])
+        else:
+            strategy.process_feedback(pool, 'success', proxy, real=random.randint(0, 10000), expected=5)
+    feedback_ops = ops / (time.time() - t)
+
+    t = time.time()
+    for _ in range(100):
+        pool.extend(proxies)
+    extend_ops = 100 * pool_size / (time.time() - t)
+    return get_ops, feedback_ops, extend_ops
+
+
+if __name__ == "__main__":
+    print("strategy\tpool_size\tget (ops/s)\tget+feedback (ops/s)\tdedup extend (proxies/s)")
+    for s in [RobinStrategy(), GreedyStrategy()]:
+        for n in [10000, 30000, 100000]:
+            print("%s\t%d\t%.0f\t%.0f\t%.0f" % ((s.strategy, n) + bench(s, n)))
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import deque
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one host.
+
+    closed: requests go through. It opens once `failure_ratio` of the last `window` responses are failures.
+    open: requests are short-circuited for `open_seconds`, doubled on every trip in a row.
+    half_open: one probe is let through every `probe_interval` seconds. A successful probe closes it,
+    a failed one opens it again.
+    """
+
+    def __init__(self, window=50, min_samples=20, failure_ratio=0.5, open_seconds=10, max_open_seconds=300,
+                 probe_interval=5):
+        self.window = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.failure_ratio = failure_ratio
+        self.base_open_seconds = open_seconds
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.probe_interval = probe_interval
+        self.state = CLOSED
+        self.next_try = 0
+
+    def wait_time(self, now=None):
+        """
+        :return: 0 if a request may be sent now, otherwise seconds to wait
+        """
+        now = now or time.time()
+        if self.state == CLOSED:
+            return 0
+        if now < self.next_try:
+            return self.next_try - now
+        # let one probe through
+        self.state = HALF_OPEN
+        self.next_try = now + self.probe_interval
+        return 0
+
+    def record(self, ok, now=None):
+        """
+        :return: True if this failure trips the breaker
+        """
+        now = now or time.time()
+        if self.state == HALF_OPEN:
+            if ok:
+                self.state = CLOSED
+                self.window.clear()
+                self.open_seconds = self.base_open_seconds
+                return False
+            self.open_seconds = min(self.open_seconds * 2, self.max_open_seconds)
+            self._open(now)
+            return True
+        if self.state == OPEN:
+            # responses of requests sent before the breaker opened
+            return False
+        self.window.append(ok)
+        if not ok and len(self.window) >= self.min_samples and \
+                self.window.count(False) >= self.failure_ratio * len(self.window):
+            self._open(now)
+            return True
+        return False
+
+    def _open(self, now):
+        self.state = OPEN
+        self.next_try = now + self.open_seconds
+
+
+class HostCircuitBreakers:
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: args of `CircuitBreaker`
+        """
+        self.kwargs = kwargs
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def _get(self, host):
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(**self.kwargs)
+        return self.breakers[host]
+
+    def wait_time(self, host):
+        with self.lock:
+            return self._get(host).wait_time()
+
+    def record(self, host, ok):
+        with self.lock:
+            return self._get(host).record(ok)
+
+    def is_closed(self, host):
+        with self.lock:
+            return self._get(host).state == CLOSED
+
+    def states(self):
+        with self.lock:
+            return {host: b.state for host, b in self.breakers.items()}
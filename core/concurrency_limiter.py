@@ -0,0 +1,82 @@
+import threading
+import time
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Gate the in-flight requests of one process with a limit adapted to the observed latency,
+    like TCP Vegas / gradient based congestion control.
+
+    The limit shrinks when the short-term latency rises above the long-term one or when requests are
+    dropped (timeouts, 429/503), and grows by `queue_size` while the latency is stable.
+    """
+
+    def __init__(self, max_limit, min_limit=1, initial_limit=None, smoothing=0.2, tolerance=1.5,
+                 backoff=0.9, queue_size=4, short_window=10, long_window=600):
+        """
+        :param max_limit: max in-flight requests, usually the thread num
+        :param tolerance: short-term latency up to `tolerance` times the long-term one is not a congestion
+        :param backoff: multiplicative decrease of the limit on drops
+        :param queue_size: headroom added to the limit, which lets it grow while the latency is stable
+        :param short_window: samples of the short-term latency average
+        :param long_window: samples of the long-term latency average
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(initial_limit or max(min_limit, max_limit / 2))
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.queue_size = queue_size
+        self.short_alpha = 2 / (short_window + 1)
+        self.long_alpha = 2 / (long_window + 1)
+        self.short_rtt = None
+        self.long_rtt = None
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Block until the in-flight requests are under the limit.
+        :return: start time, pass it to `release`
+        """
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+        return time.time()
+
+    def release(self, start, dropped=False, sample=True):
+        """
+        :param start: returned by `acquire`
+        :param dropped: the request failed in a way that indicates congestion
+        :param sample: use the latency of this request, False for failures unrelated to the target host
+        """
+        rtt = time.time() - start
+        with self.cond:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            if dropped:
+                self._set_limit(self.limit * self.backoff)
+            elif sample:
+                self._update(rtt, in_flight)
+            self.cond.notify(max(1, int(self.limit) - self.in_flight))
+
+    def _update(self, rtt, in_flight):
+        if self.short_rtt is None:
+            self.short_rtt = self.long_rtt = rtt
+            return
+        self.short_rtt += self.short_alpha * (rtt - self.short_rtt)
+        self.long_rtt += self.long_alpha * (rtt - self.long_rtt)
+        # let the long-term average recover quickly after a congestion is gone
+        if self.long_rtt > 2 * self.short_rtt:
+            self.long_rtt *= 0.95
+        if in_flight < self.limit / 2:
+            # app limited, the latency says nothing about a larger limit
+            return
+        gradient = max(0.5, min(1., self.tolerance * self.long_rtt / self.short_rtt))
+        self._set_limit(self.limit * gradient + self.queue_size)
+
+    def _set_limit(self, new_limit):
+        new_limit = self.limit * (1 - self.smoothing) + new_limit * self.smoothing
+        self.limit = max(self.min_limit, min(self.max_limit, new_limit))
@@ -1,7 +1,11 @@
+import collections
+import os
 import random
 import threading
 import time
+import zlib
 from queue import Empty, Queue
+from urllib.parse import urlparse
 
 import OpenSSL
 import redis
@@ -11,12 +15,38 @@ from bs4 import BeautifulSoup
 from requests.exceptions import ProxyError, SSLError
 from urllib3.exceptions import ProtocolError
 
+from .circuit_breaker import HostCircuitBreakers
+from .concurrency_limiter import AdaptiveConcurrencyLimiter
 from .config import Config
 from .crawler_scheduler import CrawlerScheduler
+from .hedging import HedgedFetcher
+from .host_scheduler import HostScheduler
+from .latency import AdaptiveTimeouts
+from .page import DEFAULT_CONTENT_TYPES, CharsetDetector, Page, PageAborted, read_page
+from .proxy_session import ProxySessions, StickyProxySessions
+from .parse_memo import ParseMemo
+from .rate_limiter import DistributedRateLimiter
+from .reparser import Reparser
+from .response_store import ResponseStore, digest
+from .result_stream import ResultStream
+from .simhash import NearDuplicates
 from .utils import start_thread
+from .warc import AsyncWarcWriter, WarcWriter
 
 requests.packages.urllib3.disable_warnings()
 
+# Move due jobs from the delayed zset to the tail of the todo list.
+# KEYS: delayed, todo
+# ARGV: now, batch size
+PROMOTE_SCRIPT = """
+local jobs = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #jobs > 0 then
+    redis.call('ZREM', KEYS[1], unpack(jobs))
+    redis.call('LPUSH', KEYS[2], unpack(jobs))
+end
+return #jobs
+"""
+
 
 class Crawler:
     """
@@ -44,14 +74,30 @@ class Crawler:
         self.todo_key = self.task_name + "_todo"
         self.doing_key = self.task_name + "_doing"
         self.done_key = self.task_name + "_done"
+        self.delayed_key = self.task_name + "_delayed"
+
+        # retry with exponential backoff
+        self.max_retry = self.args.get('max_retry', 3)
+        self.retry_base_delay = self.args.get('retry_base_delay', 10)
+        self.retry_max_delay = self.args.get('retry_max_delay', 600)
+        self._promote = self.redis.register_script(PROMOTE_SCRIPT)
 
         # multiprocess and multithreads
         self.max_thread_num = int(thread_num)
         self.current_thread_num = 0
         self.threads_status = [(-1, None)] * self.max_thread_num  # -1: available
         self.thread_locks = [threading.Lock() for _ in range(self.max_thread_num)]
+        self.concurrency = AdaptiveConcurrencyLimiter(self.max_thread_num)
         self.crawled = set()
         self.q_results = q_results
+        # with durable_results, results go to redis streams, and a url is done with its results only
+        self.durable_results = self.args.get('durable_results', False)
+        if self.durable_results:
+            self.result_stream = ResultStream(self.redis, self.task_name, len(q_results))
+            self.result_batch = collections.defaultdict(list)
+            self.result_urls = []
+            self.result_batch_size = self.args.get('result_batch_size', 50)
+            self.last_result_flush = time.time()
 
         # requests
         self.user_agents = [
@@ -60,14 +106,78 @@ class Crawler:
         ]
         self.q_proxy = q_proxy
         self.q_proxy_feedback = q_proxy_feedback
+        if self.args.get('sticky', False):
+            self.sessions = StickyProxySessions(q_proxy, q_proxy_feedback, self.user_agents,
+                                                self.args.get('sticky_requests', 100),
+                                                self.args.get('sticky_seconds', 300))
+        else:
+            self.sessions = ProxySessions(q_proxy, q_proxy_feedback, self.user_agents)
 
         # stats and logs
         self.q_stats = q_stats
         self.q_log = q_log
 
-        # local job
-        self.local_jobs = Queue(self.max_thread_num)
+        # local job, parked per host until its politeness rule allows fetching
+        self.local_jobs = HostScheduler(self.args.get('host_rates'), max_parked=self.max_thread_num,
+                                        scale=1 / self.args.get('process_num', 1))
+        self.max_parked = self.max_thread_num * 4
+        self.breakers = HostCircuitBreakers(**self.args.get('circuit_breaker', {}))
+        self.breaker_statuses = self.args.get('breaker_statuses', [429, 500, 502, 503, 504])
+        self.timeouts = AdaptiveTimeouts(self.args.get('timeout_percentile', 0.99),
+                                         self.args.get('timeout_floor', 3),
+                                         self.args.get('timeout_ceiling', 30))
+        if self.args.get('hedge', False):
+            if self.args.get('sticky', False):
+                # the slow request may outlive the thread's use of its sticky session and proxy binding
+                raise ValueError('hedge is not supported with sticky sessions')
+            self.hedger = HedgedFetcher(self.sessions, ProxySessions(q_proxy, q_proxy_feedback, self.user_agents),
+                                        self.timeouts, self.add_stats,
+                                        self.args.get('hedge_ratio', 0.05), self.args.get('hedge_percentile', 0.95),
+                                        max_workers=2 * self.max_thread_num)
+        else:
+            self.hedger = None
+        self.charsets = CharsetDetector()
+        if self.args.get('warc_dir'):
+            self.warc = AsyncWarcWriter(WarcWriter(self.args['warc_dir'], '{}-{}'.format(self.task_name, self.rank),
+                                                   self.args.get('warc_max_size', 1024 * 1024 * 1024)))
+        else:
+            self.warc = None
+        if self.args.get('response_store'):
+            # every process writes its own store, read them all with `ResponseArchive`
+            self.store = ResponseStore(os.path.join(self.args['response_store'], str(self.rank)))
+        else:
+            self.store = None
+        # with parse_bytes, the body is given to BeautifulSoup undecoded with the detected encoding
+        self.parse_bytes = self.args.get('parse_bytes', False)
+        self.html_parser = self.args.get('html_parser', 'html.parser')
+        if self.args.get('near_duplicates') is not None:
+            self.near_duplicates = NearDuplicates(**self.args['near_duplicates'])
+        else:
+            self.near_duplicates = None
+        # set while parsing a near duplicate with `skip='links'`
+        self.skip_links = False
+        # moving average of the seconds to decode and parse a page, i.e. saved by skipping one
+        self.parse_cost = 0
+        if self.args.get('parse_memo', 0) > 0:
+            self.parse_memo = ParseMemo(self.args['parse_memo'],
+                                        self.redis if self.args.get('parse_memo_redis', False) else None,
+                                        self.task_name + '_memo:', self.args.get('parse_memo_ttl', 86400))
+        else:
+            self.parse_memo = None
+        # results and links added by the page being parsed, to be memoized
+        self.memo_record = None
+        self.page_limits = {
+            'max_size': self.args.get('max_body_size', 10 * 1024 * 1024),
+            'min_throughput': self.args.get('min_throughput', 1024),
+            'content_types': self.args.get('content_types', DEFAULT_CONTENT_TYPES),
+        }
+        if self.args.get('qps') is not None:
+            self.rate_limiter = DistributedRateLimiter(self.redis, self.task_name + "@rate", self.args['qps'])
+        else:
+            self.rate_limiter = None
         self.local_response = Queue(1000000)
+        self.add_stats({'concurrency_limit': int(self.concurrency.limit)})
+        self.concurrency_limit = int(self.concurrency.limit)
 
     @property
     def base_url(self):
@@ -110,6 +220,44 @@ class Crawler:
         """
         raise NotImplementedError
 
+    @staticmethod
+    def shard_key(result):
+        """
+        With the `collectors` option, results of the same shard key go to the same collector process,
+        e.g. results written to the same file. An int key is taken modulo the number of collectors.
+        :return: shard key, None to send the result to any collector
+        """
+        return None
+
+    @staticmethod
+    def prepare_collector(context, args, shard, shards):
+        """
+        With the `collectors` option, set up the context of a collector process here, e.g. open the
+        outputs of its shard. `prepare` still runs once in the scheduler.
+        :param context: context of `collect_results` in this collector
+        :param shard: index of this collector
+        :param shards: number of collectors
+        """
+        pass
+
+    @staticmethod
+    def collector_stats(context):
+        """
+        :return: stats of a collector process, shown by the monitor and given to `monitor` as
+            `context['collectors']`
+        """
+        return {}
+
+    @staticmethod
+    def checkpoint(context):
+        """
+        Make the results collected so far durable. With `durable_results`, results are acknowledged
+        after this, and delivered again after a crash otherwise.
+        :param context: some variables saved in `collect_results`
+        """
+        for sink in context.get('sinks', {}).values():
+            sink.checkpoint()
+
     @staticmethod
     def monitor(context, time_escape, last_stats):
         """
@@ -124,6 +272,39 @@ class Crawler:
     def handle_error(self, res):
         return 1
 
+    @classmethod
+    def offline(cls, rank, shared_context, q_results, q_stats, args=None):
+        """
+        Create a crawler without redis, proxies or network, which only parses pages given to
+        `make_soup` and `parse`. The urls added by `parse` are ignored.
+        """
+        crawler = cls.__new__(cls)
+        crawler.rank = rank
+        crawler.task_name = None
+        crawler.args = args or {}
+        crawler.shared_context = shared_context
+        crawler.q_results = q_results
+        crawler.q_stats = q_stats
+        crawler.redis = None
+        crawler.durable_results = False
+        crawler.skip_links = False
+        crawler.memo_record = None
+        crawler.charsets = CharsetDetector()
+        crawler.parse_bytes = crawler.args.get('parse_bytes', False)
+        crawler.html_parser = crawler.args.get('html_parser', 'html.parser')
+        return crawler
+
+    @classmethod
+    def reparse(cls, response_store, processes=None, **kwargs):
+        """
+        Run `parse` again over the pages saved in `response_store`, with a process pool and without
+        redis, proxies or network. The results go through `prepare` and `collect_results` as usual.
+        :param response_store: directory given to `start` as `response_store`
+        :param processes: number of parsing processes, the number of cores by default
+        :param kwargs: args of `prepare`, with `reparse=True`
+        """
+        return Reparser(cls, response_store, processes, kwargs).run()
+
     @classmethod
     def start(cls, task_name, proxy_pool, thread_num, qps=None, restart=False, **kwargs):
         kwargs.update({
@@ -178,92 +359,291 @@ class Crawler:
             start_thread(self.scrape_thread)
 
         start_thread(self.schedule_job)
+        if self.is_master():
+            start_thread(self.promote_delayed_jobs)
 
+        last_report = time.time()
         while True:
             self.shared_context['working'] = self.local_jobs.qsize()
+            if time.time() - last_report > 5:
+                if self.hedger is not None:
+                    self.shared_context['hedge@%d' % self.rank] = self.hedger.report()
+                if self.parse_memo is not None:
+                    self.shared_context['parse_memo@%d' % self.rank] = self.parse_memo.report()
+                last_report = time.time()
             if not self.local_response.empty():
                 self.scrap_done(*self.local_response.get())
             else:
                 time.sleep(0.5)
+            if self.durable_results and len(self.result_urls) > 0 and \
+                    (len(self.result_urls) >= self.result_batch_size or time.time() - self.last_result_flush > 1):
+                self.flush_results()
 
     def schedule_job(self):
+        # jobs of hosts with too many parked jobs, held in order until their host queue has room,
+        # instead of pushing them back to the todo list over and over
+        held = collections.OrderedDict()
         while True:
+            for host in list(held):
+                jobs = held[host]
+                while len(jobs) > 0 and self.local_jobs.put(host, jobs[0]):
+                    jobs.popleft()
+                if len(jobs) == 0:
+                    del held[host]
+            if self.local_jobs.qsize() + sum(len(jobs) for jobs in held.values()) >= self.max_parked:
+                time.sleep(0.5)
+                continue
             job = self.pop_job()
             if job is None:
                 time.sleep(3)
                 continue
-            self.local_jobs.put(job)
+            host = self.get_host(job[0])
+            if host in held or not self.local_jobs.put(host, job):
+                held.setdefault(host, collections.deque()).append(job)
+
+    def promote_delayed_jobs(self, batch_size=1000):
+        while True:
+            if self._promote(keys=[self.delayed_key, self.todo_key], args=[time.time(), batch_size]) < batch_size:
+                time.sleep(1)
 
     def scrape_thread(self):
         while True:
-            if not self.local_jobs.empty():
-                url_and_retry = self.local_jobs.get()
-                self.scrape(url_and_retry)
-            else:
-                time.sleep(0.5)
+            host, url_and_retry, delay = self.local_jobs.get()
+            self.add_stats({'host@{}/fetched'.format(host): 1, 'host@{}/delay'.format(host): delay})
+            self.scrape(url_and_retry)
+
+    def get_host(self, url):
+        return urlparse(self.base_url + url).netloc
 
     def scrape(self, url_and_retry):
         res = None
         retry = 10
+        url = self.base_url + url_and_retry[0]
+        host = self.get_host(url_and_retry[0])
         while retry > 0:
-            proxy = self.q_proxy.get()
+            wait = self.breakers.wait_time(host)
+            if wait > 0:
+                # the host is failing, park the job instead of firing more requests at it
+                self.local_jobs.put(host, url_and_retry, front=True)
+                self.local_jobs.pause(host, time.time() + wait)
+                self.add_stats({'circuit_parked_jobs': 1})
+                return
+            if self.rate_limiter is not None:
+                self.add_stats({'rate_wait(s)': self.rate_limiter.acquire()})
+            session, proxy, headers = self.sessions.acquire(host)
             if proxy is not None:
                 proxies = {'https': proxy, 'http': proxy}
             else:
                 proxies = None
+            timeout = self.timeouts.timeout(host, proxy, url_and_retry[1])
+            self.add_stats({self.timeout_bucket(timeout): 1})
+            start = self.concurrency.acquire()
             try:
-                headers = {'User-Agent': random.choice(self.user_agents)}
-                res = requests.get(
-                    self.base_url + url_and_retry[0],
-                    proxies=proxies, headers=headers, timeout=5 + 2 ** url_and_retry[1]
-                )
+                if self.hedger is not None:
+                    res, proxy, sessions = self.hedger.fetch(host, session, proxy, headers, url, timeout)
+                else:
+                    res = session.get(
+                        url, proxies=proxies, headers=headers, timeout=timeout, stream=True
+                    )
+                    sessions = self.sessions
+                self.timeouts.record(host, proxy, res.elapsed.total_seconds())
+                server_error = res.status_code in self.breaker_statuses
+                if self.breakers.record(host, not server_error):
+                    self.add_stats({'circuit_trips': 1})
+                    self.log("Too many errors from {}, open its circuit breaker.".format(host), 'WARN')
                 if res.status_code == 200:
-                    self.q_proxy_feedback.put((proxy, 0))
+                    # the slot is held while the body downloads, which is most of the load of large pages
+                    try:
+                        res = read_page(res, **self.page_limits)
+                        self.release_concurrency(start)
+                    except PageAborted as e:
+                        # too slow is a sign of overload, the latency of other aborts is real
+                        self.release_concurrency(start, dropped=e.retry, sample=not e.retry)
+                        self.add_stats({'aborted_pages': 1})
+                        self.q_log.put('Aborted: url={} reason={}'.format(url_and_retry[0], e.reason))
+                        if e.retry:
+                            # too slow, another proxy may do better
+                            sessions.feedback(host, proxy, 1)
+                            retry -= 1
+                            res = None
+                            continue
+                        res = Page(res.url, res.status_code, res.headers, b'', aborted=e.reason)
+                    except (requests.exceptions.RequestException,
+                            SSLError, OpenSSL.SSL.Error, WantReadError, ProtocolError) as e:
+                        self.release_concurrency(start, dropped=isinstance(e, requests.exceptions.Timeout),
+                                                 sample=False)
+                        sessions.feedback(host, proxy, 1)
+                        retry -= 1
+                        res = None
+                        self.q_log.put('Download Error: url={} error={}'.format(url_and_retry[0], e.__class__.__name__))
+                        continue
+                    sessions.feedback(host, proxy, 0)
+                    self.add_bandwidth(host, proxy, res)
                     break
                 else:
-                    self.q_proxy_feedback.put((proxy, 1))
+                    self.release_concurrency(start, dropped=res.status_code in [429, 503])
+                    # the proxy works if the server itself fails, don't blame the proxy
+                    sessions.feedback(host, proxy, -1 if server_error else 1)
                     self.q_log.put('Status_code Error: url={}, code={}'.format(url_and_retry[0], res.status_code))
                     retry -= self.handle_error(res)
+                    res.close()
                     res = None
             except ProxyError:
-                self.q_proxy_feedback.put((proxy, 2))
+                self.release_concurrency(start, sample=False)
+                self.sessions.feedback(host, proxy, 2)
                 retry -= 1
                 self.q_log.put('Proxy Error: url={}'.format(url_and_retry[0]))
             except (requests.exceptions.RequestException,
                     SSLError, OpenSSL.SSL.Error, WantReadError, ProtocolError) as e:
-                self.q_proxy_feedback.put((proxy, 1))
+                if isinstance(e, requests.exceptions.Timeout):
+                    # the latency is unknown, only more than the timeout
+                    self.timeouts.record_timeout(host, proxy)
+                    self.add_stats({'timeouts': 1, 'timeout_wasted(s)': time.time() - start})
+                self.release_concurrency(start, dropped=isinstance(e, requests.exceptions.Timeout), sample=False)
+                self.sessions.feedback(host, proxy, 1)
                 retry -= 1
                 self.q_log.put('Connection Error: url={} error={}'.format(url_and_retry[0], e.__class__.__name__))
 
         self.local_response.put((res, url_and_retry))
 
+    def add_bandwidth(self, host, proxy, page):
+        compressed = int('Content-Encoding' in page.headers)
+        self.add_stats({
+            'host@{}/wire'.format(host): page.wire_size,
+            'host@{}/bytes'.format(host): len(page.content),
+            'proxy@{}/wire'.format(proxy): page.wire_size,
+            'proxy@{}/bytes'.format(proxy): len(page.content),
+            'proxy@{}/pages'.format(proxy): 1,
+            'proxy@{}/compressed'.format(proxy): compressed,
+            'wire_bytes': page.wire_size,
+            'decoded_bytes': len(page.content),
+            'compressed_pages': compressed,
+        })
+
+    @staticmethod
+    def timeout_bucket(timeout):
+        for bound in [3, 5, 10, 20]:
+            if timeout <= bound:
+                return 'timeout@<={}s'.format(bound)
+        return 'timeout@>20s'
+
+    def release_concurrency(self, start, dropped=False, sample=True):
+        self.concurrency.release(start, dropped, sample)
+        limit = int(self.concurrency.limit)
+        if limit != self.concurrency_limit:
+            # the scheduler sums the changes of all processes up
+            self.add_stats({'concurrency_limit': limit - self.concurrency_limit})
+            self.concurrency_limit = limit
+
     def scrap_done(self, res, url_and_retry):
         url = url_and_retry[0]
         if res is None:
             self.redis.srem(self.doing_key, url)
-            if url in self.crawled:
-                self.crawled.remove(url)
-            if url_and_retry[1] < 3:
-                self.add_job(url, url_and_retry[1] + 1)
+            if url_and_retry[1] < self.max_retry:
+                self.delay_job(url, url_and_retry[1] + 1)
             else:
+                if url in self.crawled:
+                    self.crawled.remove(url)
                 self.add_stats({'discarded_jobs': 1})
                 self.q_log.put('Discard url: {}'.format(url))
             self.add_stats({'error': 1})
-        else:
+        elif res.aborted is not None:
+            # e.g. a binary file, retrying won't help
             self.finish_job(url)
-            soup = BeautifulSoup(res.text, 'html.parser')
-            try:
-                self.parse(self.shared_context, soup, url)
-                self.q_stats.put({'success': 1})
-                self.q_log.put("success: {}".format(url))
-            except KeyboardInterrupt:
-                return
-            except Exception as e:
-                self.log("Error occurs when parsing the content: {} ({})".format(str(e), url), 'ERR')
-                self.q_log.put('Parsing Error: url={}'.format(url))
-                self.q_stats.put({'error': 1})
+            self.q_log.put('Skip url: {} ({})'.format(url, res.aborted))
+        else:
+            if not self.durable_results:
+                self.finish_job(url)
+            if self.store is not None:
+                start = time.time()
+                self.store.put(url, res)
+                self.add_stats({'store_time(s)': time.time() - start})
+            if self.warc is not None:
+                self.warc.write(res)
+            memo_key = self.memo_key(url, res) if self.parse_memo is not None else None
+            memo = self.parse_memo.get(memo_key) if memo_key is not None else None
+            if memo is not None:
+                # the same body was parsed before, replay what it added
+                results, links = memo
+                for result in results:
+                    self.add_result(result)
+                for link in links:
+                    self.add_job(*link)
+                self.add_stats({'parse_memo_saved(s)': self.parse_cost, 'success': 1})
+                self.q_log.put("success (memoized): {}".format(url))
+            elif self.is_near_duplicate(res) and self.near_duplicates.skip == 'parse':
+                self.add_stats({'near_duplicates': 1, 'near_duplicate_saved(s)': self.parse_cost, 'success': 1})
+                self.q_log.put('Near duplicate: url={}'.format(url))
+            else:
+                start = time.time()
+                if memo_key is not None:
+                    self.memo_record = ([], [])
+                try:
+                    soup = self.make_soup(url, res)
+                    decoded = time.time()
+                    self.parse(self.shared_context, soup, url)
+                    self.add_stats({'parse_time(s)': time.time() - decoded})
+                    self.parse_cost = 0.9 * self.parse_cost + 0.1 * (time.time() - start)
+                    if memo_key is not None:
+                        self.parse_memo.put(memo_key, *self.memo_record)
+                    self.q_stats.put({'success': 1})
+                    self.q_log.put("success: {}".format(url))
+                except KeyboardInterrupt:
+                    return
+                except Exception as e:
+                    self.log("Error occurs when parsing the content: {} ({})".format(str(e), url), 'ERR')
+                    self.q_log.put('Parsing Error: url={}'.format(url))
+                    self.q_stats.put({'error': 1})
+                finally:
+                    self.skip_links = False
+                    self.memo_record = None
+            if self.durable_results:
+                # done by `flush_results`, together with its results
+                self.result_urls.append(url)
+
+    def memo_key(self, url, page):
+        """
+        Key of the memoized `parse` of a page, with `parse_memo`. Pages of the same key must give the
+        same results and links, so include the parts of the url `parse` depends on, if any.
+        :return: bytes, None to always parse the page
+        """
+        return digest(page.content)
+
+    def is_near_duplicate(self, page):
+        """
+        With `near_duplicates`, check whether the page is nearly the same as a page seen before.
+        """
+        if self.near_duplicates is None:
+            return False
+        start = time.time()
+        near = self.near_duplicates.seen(page.content)
+        self.add_stats({'simhash_time(s)': time.time() - start})
+        if near and self.near_duplicates.skip == 'links':
+            self.add_stats({'near_duplicates': 1})
+            self.skip_links = True
+        return near
+
+    def make_soup(self, url, page):
+        start = time.time()
+        encoding, source = self.charsets.encoding(self.get_host(url), page)
+        if self.parse_bytes:
+            # let the parser decode, e.g. lxml does it much faster than python
+            soup = BeautifulSoup(page.content, self.html_parser, from_encoding=encoding)
+        else:
+            soup = BeautifulSoup(page.content.decode(encoding, errors='replace'), self.html_parser)
+        self.add_stats({'decode_time(s)': time.time() - start, 'charset@' + source: 1})
+        return soup
 
     def add_job(self, url, retry_cnt=0, front=False):
+        if self.redis is None:
+            # offline, see `offline`
+            return
+        if self.memo_record is not None:
+            self.memo_record[1].append((url, retry_cnt, front))
+        if self.skip_links:
+            # the links of a near duplicate were most likely added with the original page
+            self.add_stats({'near_duplicate_links': 1})
+            return
         url = self.clean_url(url)
         if url not in self.crawled and \
                 not self.redis.sismember(self.done_key, url) and \
@@ -275,6 +655,14 @@ class Crawler:
                 self.redis.lpush(self.todo_key, (url, retry_cnt))
             self.q_stats.put({'pushed_urls': 1})
 
+    def delay_job(self, url, retry_cnt):
+        """
+        Retry the url later, with exponential backoff and jitter. No thread waits for it.
+        """
+        delay = min(self.retry_base_delay * 2 ** (retry_cnt - 1), self.retry_max_delay) * random.uniform(0.5, 1.5)
+        self.redis.zadd(self.delayed_key, {str((url, retry_cnt)): time.time() + delay})
+        self.q_stats.put({'delayed_jobs': 1})
+
     def pop_job(self):
         try:
             url_and_retry = self.redis.brpop(self.todo_key, timeout=10)
@@ -295,11 +683,42 @@ class Crawler:
         self.redis.sadd(self.done_key, url)
         self.redis.srem(self.doing_key, url)
 
+    def flush_results(self):
+        """
+        Append the buffered results to the result streams and mark their urls done, in one transaction.
+        """
+        pipe = self.redis.pipeline()
+        for shard, results in self.result_batch.items():
+            self.result_stream.append(pipe, shard, results)
+        pipe.sadd(self.done_key, *self.result_urls)
+        pipe.srem(self.doing_key, *self.result_urls)
+        pipe.execute()
+        self.result_batch.clear()
+        self.result_urls = []
+        self.last_result_flush = time.time()
+
     def reset_task(self):
-        self.redis.delete(self.done_key, self.doing_key, self.todo_key)
+        self.redis.delete(self.done_key, self.doing_key, self.todo_key, self.delayed_key)
 
     def add_result(self, result):
-        self.q_results.put(result)
+        if self.memo_record is not None:
+            self.memo_record[0].append(result)
+        if self.durable_results:
+            self.result_batch[self.result_shard(result)].append(result)
+        else:
+            self.q_results[self.result_shard(result)].put(result)
+
+    def result_shard(self, result):
+        shards = len(self.q_results)
+        if shards == 1:
+            return 0
+        key = self.shard_key(result)
+        if key is None:
+            return random.randrange(shards)
+        if isinstance(key, int):
+            return key % shards
+        # stable across processes, unlike `hash`
+        return zlib.crc32(str(key).encode('utf-8')) % shards
 
     def add_stats(self, stats):
         self.q_stats.put(stats)
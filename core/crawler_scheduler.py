@@ -2,6 +2,7 @@ import collections
 import datetime
 import json
 import os
+import signal
 import time
 from copy import deepcopy
 from multiprocessing import Process, Queue, Manager, Lock
@@ -12,6 +13,7 @@ import requests
 from core.utils import start_thread
 from .config import Config
 from .proxy_pool import PROXY_POOL_REGISTRY, ProxyPool
+from .result_stream import ResultStream, ResultStreamReader
 import proxy_pools  # donnot move
 
 requests.packages.urllib3.disable_warnings()
@@ -21,7 +23,11 @@ class CrawlerScheduler:
     def __init__(self, crawler_cls, task_name, qps=80,
                  proxy_pool=None, process_num=None, thread_num=None, **kwargs):
         MAX_QUEUE_SIZE = self.MAX_QUEUE_SIZE = 100000
-        self.q_results = Queue(MAX_QUEUE_SIZE)
+        # results are collected by a thread of the scheduler, or by `collectors` processes with a queue each
+        self.collectors = int(kwargs.get('collectors', 0))
+        self.q_results = [Queue(MAX_QUEUE_SIZE) for _ in range(max(self.collectors, 1))]
+        self.collector_procs = []
+        self.collector_thread = None
         self.q_stats = Queue(MAX_QUEUE_SIZE)
         self.q_log = Queue(MAX_QUEUE_SIZE)
         self.q_proxy_feedback = Queue(MAX_QUEUE_SIZE)
@@ -47,12 +53,14 @@ class CrawlerScheduler:
         self.terminate = False
         self.crawler_cls = crawler_cls
         self.args = kwargs
+        self.args['process_num'] = self.process_num
+        # enforced by a rate limiter in redis shared by all workers of this task
+        self.args['qps'] = qps
         self.stats = collections.defaultdict(lambda: 0)
         manager = Manager()
         self.context = {}
 
         self.runtime_context = manager.dict()
-        self.runtime_context['cur_max_threads_num'] = self.thread_num / 2
         self.runtime_context['terminate'] = False
         self.runtime_context['working'] = 0
 
@@ -64,7 +72,11 @@ class CrawlerScheduler:
         self.todo_key = self.task_name + "_todo"
         self.doing_key = self.task_name + "_doing"
         self.done_key = self.task_name + "_done"
-        self.RESET_FREEZE_SPEED_SEC = 30
+        self.delayed_key = self.task_name + "_delayed"
+        if kwargs.get('durable_results', False):
+            self.result_stream = ResultStream(self.redis, self.task_name, len(self.q_results))
+        else:
+            self.result_stream = None
 
         # proxy pool
         kwargs['task_name'] = task_name
@@ -82,7 +94,19 @@ class CrawlerScheduler:
         start_thread(self.collect_proxies)
         start_thread(self.feedback_proxy)
         start_thread(self.monitor)
-        start_thread(self.collect_results)
+        if self.result_stream is not None and self.restart:
+            self.result_stream.delete()
+        if self.collectors > 0:
+            for i in range(self.collectors):
+                self.collector_procs.append(Process(
+                    target=CrawlerScheduler.run_collector,
+                    args=(self.crawler_cls, self.q_results[i], self.runtime_context, self.args, i, self.collectors)))
+                self.collector_procs[i].start()
+        elif self.result_stream is not None:
+            self.collector_thread = start_thread(CrawlerScheduler.consume_results,
+                                                 (self.crawler_cls, self.context, self.runtime_context, self.args, 0, 1))
+        else:
+            self.collector_thread = start_thread(self.collect_results)
         start_thread(self.collect_stats)
         start_thread(self.write_log)
 
@@ -112,8 +136,11 @@ class CrawlerScheduler:
             self.terminate = True
             for proc in self.procs:
                 proc.terminate()
-            self.runtime_context['terminate'] = True
+            self.stop_collectors()
+            self.proxy_pool.close()
             raise KeyboardInterrupt
+        self.stop_collectors()
+        self.proxy_pool.close()
 
     @staticmethod
     def run_single_process(task_name, start_urls,
@@ -127,9 +154,14 @@ class CrawlerScheduler:
         crawler.run()
 
     def collect_proxies(self):
+        prefetch = self.proxy_pool.prefetch or self.PROXY_QUEUE_SIZE - 50
         while not self.terminate:
-            if self.q_proxy.qsize() < self.PROXY_QUEUE_SIZE - 50:
-                self.q_proxy.put(self.proxy_pool.get_proxy())
+            if self.q_proxy.qsize() < prefetch:
+                try:
+                    self.q_proxy.put(self.proxy_pool.get_proxy())
+                except Empty:
+                    # e.g. the proxy broker has nothing to lend now
+                    time.sleep(0.5)
             else:
                 time.sleep(0.5)
 
@@ -152,23 +184,113 @@ class CrawlerScheduler:
                 time.sleep(0.5)
 
     def collect_results(self):
-        while not self.terminate:
-            if not self.q_results.empty():
-                result = self.q_results.get(timeout=5)
-                self.crawler_cls.collect_results(self.context, result)
-            else:
-                time.sleep(0.5)
+        while True:
+            try:
+                result = self.q_results[0].get(timeout=0.5)
+            except Empty:
+                # the crawlers are stopped, and their results are drained
+                if self.runtime_context['terminate']:
+                    break
+                for sink in self.context.get('sinks', {}).values():
+                    sink.tick()
+                continue
+            self.crawler_cls.collect_results(self.context, result)
+
+    @staticmethod
+    def run_collector(crawler_cls, q_results, runtime_context, args, shard, shards):
+        """
+        Collect the results of one shard in a process, with its own context set up by `prepare_collector`.
+        """
+        # Ctrl-C reaches the whole process group, the collector drains and closes its sinks once
+        # `stop_collectors` terminates it instead
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        context = {}
+        crawler_cls.prepare_collector(context, args, shard, shards)
+        if args.get('durable_results', False):
+            CrawlerScheduler.consume_results(crawler_cls, context, runtime_context, args, shard, shards)
+            return
+        collected = 0
+        last_report = 0
+        while True:
+            try:
+                crawler_cls.collect_results(context, q_results.get(timeout=0.5))
+                collected += 1
+            except Empty:
+                if runtime_context['terminate']:
+                    break
+                for sink in context.get('sinks', {}).values():
+                    sink.tick()
+            if time.time() - last_report > 5:
+                report = {'backlog': q_results.qsize(), 'collected': collected}
+                report.update(crawler_cls.collector_stats(context))
+                runtime_context['collector@%d' % shard] = report
+                last_report = time.time()
+        for sink in context.get('sinks', {}).values():
+            sink.close()
+
+    @staticmethod
+    def consume_results(crawler_cls, context, runtime_context, args, shard, shards):
+        """
+        Collect the results of one shard from the result streams of `durable_results`. They are
+        acknowledged after `checkpoint`, every `ack_interval` seconds, and the sinks are closed once
+        the crawlers are terminated and the stream is drained.
+        """
+        stream = ResultStream(redis.StrictRedis(host=Config.REDIS_HOST, port=Config.REDIS_PORT, db=0),
+                              args['task_name'], shards)
+        reader = ResultStreamReader(stream, shard)
+        ack_interval = args.get('ack_interval', 5)
+        pending = []
+        collected = 0
+        last_ack = last_report = time.time()
+        while True:
+            entries = reader.read()
+            for entry_id, results in entries:
+                for result in results:
+                    crawler_cls.collect_results(context, result)
+                collected += len(results)
+                pending.append(entry_id)
+            if len(entries) == 0:
+                if runtime_context['terminate']:
+                    break
+                for sink in context.get('sinks', {}).values():
+                    sink.tick()
+            if len(pending) > 0 and time.time() - last_ack > ack_interval:
+                crawler_cls.checkpoint(context)
+                reader.ack(pending)
+                pending = []
+                last_ack = time.time()
+            if time.time() - last_report > 5:
+                report = {'backlog': stream.backlog(shard), 'collected': collected}
+                report.update(crawler_cls.collector_stats(context))
+                runtime_context['collector@%d' % shard] = report
+                last_report = time.time()
+        crawler_cls.checkpoint(context)
+        reader.ack(pending)
+        for sink in context.get('sinks', {}).values():
+            sink.close()
+
+    def stop_collectors(self):
+        """
+        Let the collectors drain their results and close the sinks, once the crawlers are terminated.
+        """
+        self.runtime_context['terminate'] = True
+        if self.collector_thread is not None:
+            self.collector_thread.join()
+        self.close_sinks()
+        for proc in self.collector_procs:
+            proc.join()
+
+    def close_sinks(self):
+        for sink in self.context.get('sinks', {}).values():
+            sink.close()
 
     def monitor(self):
         last_t = t = time.time()
         last_scraped = 0
         last_custom_monitor = {}
+        last_hosts = {}
+        last_wire = 0
         dead = 0
-        avg_speed = 0
-        cnt = 0
-        accmu_step = 5
-
-        freeze_speed_sec = 100
 
         while not self.terminate:
             time.sleep(5)
@@ -181,38 +303,52 @@ class CrawlerScheduler:
                 'new_total': stats['success'] - last_scraped,
                 'speed (pages/sec)': round(stats['success'] / time_escape, 2),
                 'todo_queue_size': self.redis.llen(self.todo_key),
-                'cur_threads': self.runtime_context['cur_max_threads_num'],
+                'delayed_queue_size': self.redis.zcard(self.delayed_key),
+                # sum of the adaptive concurrency limits of all processes
+                'concurrency_limit': stats['concurrency_limit'],
                 'bad_proxies': self.redis.scard(self.proxy_pool.bad_proxies_name),
                 'proxies_queue_size': self.q_proxy.qsize(),
                 'working': self.runtime_context['working'],
             })
             if dead > 5:
                 stats.update({"dead": str(dead) + "/20"})
+            if self.collectors > 0:
+                # results waiting in the queue of each collector, and what the collectors report
+                stats['collectors'] = self.context['collectors'] = {
+                    k[10:]: v for k, v in self.runtime_context.items() if k.startswith('collector@')}
+            elif self.result_stream is not None:
+                # entries appended but not acknowledged yet
+                stats['results_backlog'] = self.result_stream.backlog(0)
+            else:
+                stats['results_backlog'] = self.q_results[0].qsize()
+            stats['hosts'], last_hosts = self.host_stats(stats, last_hosts, last_time_escape)
+            stats['uncompressed_proxies'] = self.proxy_stats(stats)
+            stats.update({
+                'bandwidth (KB/s)': round((stats['wire_bytes'] - last_wire) / 1024 / last_time_escape, 1),
+                'compression_ratio': round(stats['decoded_bytes'] / max(stats['wire_bytes'], 1), 2),
+            })
+            last_wire = stats['wire_bytes']
+            if 'near_duplicates' in stats:
+                stats['near_duplicate_rate'] = round(stats['near_duplicates'] / max(stats['success'], 1), 3)
+            memo = {k[11:]: v for k, v in self.runtime_context.items() if k.startswith('parse_memo@')}
+            if len(memo) > 0:
+                # hit rates of the parse memo of each process
+                stats['parse_memo'] = memo
+            hedging = [v for k, v in self.runtime_context.items() if k.startswith('hedge@')]
+            if len(hedging) > 0:
+                # worst process, an average of percentiles isn't a percentile
+                stats['hedging'] = {k: max(h[k] for h in hedging) for k in hedging[0]}
+                stats['hedge_win_rate'] = round(stats['hedge_wins'] / max(stats['hedges'], 1), 3)
+            # number of requests sent with each timeout
+            stats['timeout_distribution'] = {k[8:]: stats.pop(k) for k in sorted(stats) if k.startswith('timeout@')}
+            # how the encoding of the pages was found
+            stats['charsets'] = {k[8:]: stats.pop(k) for k in sorted(stats) if k.startswith('charset@')}
 
             real_speed = stats['real time speed (pages/sec)'] = round(stats['new_total'] / last_time_escape, 2)
             custom_monitor, terminate = self.crawler_cls.monitor(self.context, last_time_escape, last_custom_monitor)
             stats.update(custom_monitor)
             last_custom_monitor = custom_monitor
 
-            if self.qps is None:
-                self.runtime_context['cur_max_threads_num'] = self.thread_num
-            else:
-                freeze_speed_sec -= last_time_escape
-                if cnt < accmu_step:
-                    cnt += 1
-                    avg_speed += real_speed
-                else:
-                    cnt = 0
-                    avg_speed += real_speed
-                    avg_speed /= accmu_step
-                    if freeze_speed_sec < 0:
-                        if avg_speed > self.qps + 15:
-                            self.adjust_speed(increase=False)
-                        elif avg_speed < self.qps - 15:
-                            self.adjust_speed(increase=True)
-                        freeze_speed_sec = self.RESET_FREEZE_SPEED_SEC
-                    avg_speed = 0
-
             last_scraped = stats['success']
 
             # terminate when no task comes in.
@@ -227,14 +363,48 @@ class CrawlerScheduler:
                 dead = 0
             print(json.dumps(stats))
 
-    def adjust_speed(self, increase=True):
-        if increase:
-            self.runtime_context['cur_max_threads_num'] = min(self.runtime_context['cur_max_threads_num'] * 1.1,
-                                                              self.thread_num)
-            self.log("Increase crawling speed.")
-        else:
-            self.runtime_context['cur_max_threads_num'] = max(self.runtime_context['cur_max_threads_num'] * 0.9, 10)
-            self.log("Decrease crawling speed.")
+    @staticmethod
+    def host_stats(stats, last_hosts, time_escape):
+        """
+        Pop the `host@<host>/<key>` counters from stats and summarize them per host.
+        :return: per host qps and avg queueing delay since last monitor, current counters
+        """
+        hosts = collections.defaultdict(dict)
+        for k in [k for k in stats if k.startswith('host@')]:
+            host, key = k[5:].rsplit('/', 1)
+            hosts[host][key] = stats.pop(k)
+        summary = {}
+        for host, counters in hosts.items():
+            last = last_hosts.get(host, {})
+            fetched = counters.get('fetched', 0) - last.get('fetched', 0)
+            delay = counters.get('delay', 0) - last.get('delay', 0)
+            wire = counters.get('wire', 0) - last.get('wire', 0)
+            decoded = counters.get('bytes', 0) - last.get('bytes', 0)
+            summary[host] = {
+                'qps': round(fetched / time_escape, 2),
+                'queueing_delay(ms)': round(1000 * delay / fetched, 1) if fetched > 0 else 0,
+                'bandwidth (KB/s)': round(wire / 1024 / time_escape, 1),
+                'compression_ratio': round(decoded / wire, 2) if wire > 0 else None,
+            }
+        return summary, hosts
+
+    @staticmethod
+    def proxy_stats(stats, min_pages=20):
+        """
+        Pop the `proxy@<proxy>/<key>` counters from stats.
+        :return: proxies which return much fewer compressed pages than the others, e.g. proxies
+            stripping `Accept-Encoding`, with their compression ratio
+        """
+        proxies = collections.defaultdict(dict)
+        for k in [k for k in stats if k.startswith('proxy@')]:
+            proxy, key = k[6:].rsplit('/', 1)
+            proxies[proxy][key] = stats.pop(k)
+        compressed_rate = stats['compressed_pages'] / max(stats['success'], 1)
+        suspects = {}
+        for proxy, counters in proxies.items():
+            if counters['pages'] >= min_pages and counters['compressed'] / counters['pages'] < compressed_rate / 2:
+                suspects[proxy] = round(counters['bytes'] / max(counters['wire'], 1), 2)
+        return suspects
 
     def write_log(self):
         os.makedirs("logs", exist_ok=True)
@@ -0,0 +1,165 @@
+import hashlib
+import mmap
+import os
+import struct
+
+
+class FingerprintSet:
+    """
+    Set of 64 or 128-bit fingerprints of keys, in an open addressing table of fixed size slots.
+
+    An entry takes `fingerprint_size / max_load` bytes (about 11 bytes for 64-bit fingerprints),
+    instead of the whole key plus ~70 bytes of a python set. With a `path`, the table lives in a
+    mmap-ed file and survives restarts. Two different keys are taken as the same with a probability
+    of n^2 / 2^(bits + 1), e.g. 3e-4 for 100M 64-bit fingerprints.
+
+    With `undo_log`, fingerprints added since the last `checkpoint` are also written to an undo log,
+    and removed when the file is opened again. So after a crash, the set matches the outputs
+    checkpointed with it, and results delivered again aren't taken as duplicates.
+    """
+    HEADER = struct.Struct('<4sIQQ')  # magic, fingerprint size, capacity, count
+    MAGIC = b'FPS1'
+
+    def __init__(self, path=None, fingerprint_size=8, capacity=1 << 20, max_load=0.7, undo_log=False):
+        """
+        :param path: file of the table, None to keep it in memory
+        :param fingerprint_size: 8 or 16 bytes
+        :param capacity: initial number of slots, a power of 2
+        :param max_load: the table doubles when it is fuller than this
+        :param undo_log: keep the fingerprints added since the last checkpoint in `<path>.undo`
+        """
+        self.path = path
+        self.size = fingerprint_size
+        self.empty = bytes(fingerprint_size)
+        self.max_load = max_load
+        if path is not None and os.path.exists(path):
+            self.file, self.buf = self._map(path)
+            magic, size, self.capacity, self.count = self.HEADER.unpack_from(self.buf, 0)
+            if magic != self.MAGIC or size != self.size:
+                raise ValueError('{} is not a set of {} byte fingerprints'.format(path, self.size))
+            self._rollback()
+        else:
+            self.file, self.buf = self._create(path, capacity)
+            self.capacity, self.count = capacity, 0
+        # unbuffered, so every fingerprint in the table is in the undo log first
+        self.undo = open(path + '.undo', 'ab', buffering=0) if path is not None and undo_log else None
+
+    def _create(self, path, capacity):
+        """
+        :return: file, buffer of an empty table
+        """
+        header = self.HEADER.pack(self.MAGIC, self.size, capacity, 0)
+        if path is None:
+            return None, bytearray(header) + bytearray(capacity * self.size)
+        with open(path, 'wb') as f:
+            f.write(header)
+            f.truncate(self.HEADER.size + capacity * self.size)
+        return self._map(path)
+
+    @staticmethod
+    def _map(path):
+        f = open(path, 'r+b')
+        return f, mmap.mmap(f.fileno(), 0)
+
+    def _rollback(self):
+        """
+        Remove the fingerprints added after the last checkpoint.
+        """
+        undo_path = self.path + '.undo'
+        if not os.path.exists(undo_path) or os.path.getsize(undo_path) == 0:
+            return
+        with open(undo_path, 'rb') as f:
+            data = f.read()
+        # removing slots in place would break the probe sequences of the others, so rebuild the table
+        self._grow(1, {data[i:i + self.size] for i in range(0, len(data) - self.size + 1, self.size)})
+        self.buf.flush()
+        os.remove(undo_path)
+
+    def fingerprint(self, key):
+        """
+        :param key: str or bytes
+        """
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        fp = hashlib.blake2b(key, digest_size=self.size).digest()
+        # the zero fingerprint marks empty slots
+        return fp if fp != self.empty else b'\x01' + fp[1:]
+
+    def _find(self, fp):
+        """
+        :return: offset of the slot of the fingerprint or of the empty slot where it would be, found
+        """
+        buf, size, empty = self.buf, self.size, self.empty
+        mask = self.capacity - 1
+        i = int.from_bytes(fp[:8], 'little') & mask
+        while True:
+            offset = self.HEADER.size + i * size
+            slot = buf[offset:offset + size]
+            if slot == fp:
+                return offset, True
+            if slot == empty:
+                return offset, False
+            i = (i + 1) & mask
+
+    def add(self, key):
+        """
+        :return: True if the key is new
+        """
+        fp = self.fingerprint(key)
+        offset, found = self._find(fp)
+        if found:
+            return False
+        if self.undo is not None:
+            self.undo.write(fp)
+        self.buf[offset:offset + self.size] = fp
+        self.count += 1
+        self.HEADER.pack_into(self.buf, 0, self.MAGIC, self.size, self.capacity, self.count)
+        if self.count > self.capacity * self.max_load:
+            self._grow()
+        return True
+
+    def __contains__(self, key):
+        return self._find(self.fingerprint(key))[1]
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self, factor=2, drop=()):
+        """
+        Copy the table into one `factor` times larger, without the fingerprints in `drop`.
+        """
+        old_file, old_buf, old_capacity = self.file, self.buf, self.capacity
+        tmp = None if self.path is None else self.path + '.tmp'
+        self.file, self.buf = self._create(tmp, old_capacity * factor)
+        self.capacity = old_capacity * factor
+        self.count = 0
+        for offset in range(self.HEADER.size, self.HEADER.size + old_capacity * self.size, self.size):
+            fp = old_buf[offset:offset + self.size]
+            if fp != self.empty and fp not in drop:
+                new_offset, _ = self._find(fp)
+                self.buf[new_offset:new_offset + self.size] = fp
+                self.count += 1
+        self.HEADER.pack_into(self.buf, 0, self.MAGIC, self.size, self.capacity, self.count)
+        if old_file is not None:
+            old_buf.close()
+            old_file.close()
+            self.buf.flush()
+            os.replace(tmp, self.path)
+
+    def checkpoint(self):
+        """
+        Make the fingerprints added so far permanent, call it after the outputs are checkpointed.
+        """
+        if self.file is not None:
+            self.buf.flush()
+        if self.undo is not None:
+            self.undo.truncate(0)
+
+    def close(self):
+        if self.file is not None:
+            self.checkpoint()
+            if self.undo is not None:
+                self.undo.close()
+            self.buf.close()
+            self.file.close()
+            self.file = None
@@ -0,0 +1,135 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, wait
+
+from requests.exceptions import ProxyError
+
+from .latency import LatencyHistogram
+
+
+class HedgeBudget:
+    """
+    Every request earns `ratio` of a hedge, so hedges are at most `ratio` extra requests.
+    """
+
+    def __init__(self, ratio=0.05, burst=10):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = 0.
+        self.lock = threading.Lock()
+
+    def earn(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class HedgedFetcher:
+    """
+    Send a duplicate request through another proxy when the first one hasn't finished by the
+    `percentile` latency of the host. The first successful response wins. The loser can't be
+    interrupted, it runs until its timeout in the background and only gives its proxy back.
+    """
+
+    def __init__(self, sessions, hedge_sessions, timeouts, add_stats, ratio=0.05, percentile=0.95,
+                 max_workers=200):
+        """
+        :param sessions: `ProxySessions` of the first requests, must not be sticky
+        :param hedge_sessions: `ProxySessions` of the hedges, must not be sticky
+        :param timeouts: `AdaptiveTimeouts` providing the latency percentiles
+        :param add_stats: function to report stats
+        :param ratio: max ratio of extra requests
+        :param percentile: latency percentile of the host after which a hedge is sent
+        """
+        self.sessions = sessions
+        self.hedge_sessions = hedge_sessions
+        self.timeouts = timeouts
+        self.add_stats = add_stats
+        self.budget = HedgeBudget(ratio)
+        self.percentile = percentile
+        self.executor = ThreadPoolExecutor(max_workers)
+        # latency with hedging, and the latency it would have been without
+        self.hedged_latency = LatencyHistogram(half_life=5000)
+        self.unhedged_latency = LatencyHistogram(half_life=5000)
+        self.lock = threading.Lock()
+
+    def fetch(self, host, session, proxy, headers, url, timeout):
+        """
+        :return: response, proxy of the response, sessions of the proxy. The caller gives the feedback of
+            this proxy, or of `proxy` if an exception is raised.
+        """
+        start = time.time()
+        self.budget.earn()
+        primary = self.executor.submit(session.get, url, proxies=self.proxies(proxy), headers=headers,
+                                       timeout=timeout, stream=True)
+        primary.add_done_callback(lambda f: self.record(self.unhedged_latency, time.time() - start))
+        delay = self.timeouts.latency(host, self.percentile)
+        try:
+            if delay is None or delay >= timeout:
+                return self.won(primary.result(), start), proxy, self.sessions
+            return self.won(primary.result(timeout=delay), start), proxy, self.sessions
+        except TimeoutError:
+            if not self.budget.spend():
+                return self.won(primary.result(), start), proxy, self.sessions
+
+        hedge_session, hedge_proxy, hedge_headers = self.hedge_sessions.acquire(host)
+        hedge = self.executor.submit(hedge_session.get, url,
+                                     proxies=self.proxies(hedge_proxy), headers=hedge_headers,
+                                     timeout=max(timeout - delay, 1), stream=True)
+        self.add_stats({'hedges': 1})
+        done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        first = primary if primary in done else hedge
+        if first.exception() is not None:
+            wait([primary, hedge])
+        if primary.done() and primary.exception() is None and (first is primary or hedge.exception() is not None):
+            hedge.add_done_callback(lambda f: self.lost(f, self.hedge_sessions, host, hedge_proxy))
+            return self.won(primary.result(), start), proxy, self.sessions
+        if hedge.exception() is None:
+            # the proxy of the primary request is still in use until it finishes
+            primary.add_done_callback(lambda f: self.lost(f, self.sessions, host, proxy))
+            self.add_stats({'hedge_wins': 1})
+            return self.won(hedge.result(), start), hedge_proxy, self.hedge_sessions
+        self.hedge_sessions.feedback(host, hedge_proxy, self.level(hedge))
+        return primary.result(), proxy, self.sessions
+
+    def lost(self, future, sessions, host, proxy):
+        sessions.feedback(host, proxy, self.level(future))
+        self.close(future)
+
+    @staticmethod
+    def close(future):
+        # release the connection of a streamed response which is never read
+        if future.exception() is None:
+            future.result().close()
+
+    def won(self, res, start):
+        self.record(self.hedged_latency, time.time() - start)
+        return res
+
+    def record(self, hist, latency):
+        with self.lock:
+            hist.record(latency)
+
+    def report(self):
+        with self.lock:
+            return {
+                'p99 (s)': round(self.hedged_latency.percentile(0.99) or 0, 3),
+                'p99 without hedging (s)': round(self.unhedged_latency.percentile(0.99) or 0, 3),
+            }
+
+    @staticmethod
+    def proxies(proxy):
+        return {'https': proxy, 'http': proxy} if proxy is not None else None
+
+    @staticmethod
+    def level(future):
+        e = future.exception()
+        if e is None:
+            return 0 if future.result().status_code == 200 else -1
+        return 2 if isinstance(e, ProxyError) else 1
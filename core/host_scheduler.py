@@ -0,0 +1,132 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from fnmatch import fnmatch
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        """
+        :param rate: tokens per second
+        :param burst: max tokens
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.time()
+
+    def wait_time(self, now=None):
+        """seconds to wait until a token is available"""
+        now = now or time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+class HostScheduler:
+    """
+    Per-host politeness in front of the fetch stage.
+
+    Jobs are parked in per-host queues. `get` hands out jobs round-robin among the hosts whose
+    token bucket has a token, so a throttled host never holds a fetch thread while it waits.
+    """
+
+    def __init__(self, host_rates=None, max_parked=1000, scale=1.):
+        """
+        :param host_rates: {host pattern: {'rate': requests/sec, 'burst': n} or {'delay': seconds}},
+            patterns are matched by `fnmatch` in order, hosts matching no pattern are unlimited.
+        :param max_parked: max parked jobs per host
+        :param scale: rates are multiplied by it, e.g. 1 / process_num
+        """
+        self.rules = []
+        for pattern, rule in (host_rates or {}).items():
+            if 'delay' in rule:
+                self.rules.append((pattern, scale / rule['delay'], 1))
+            else:
+                self.rules.append((pattern, rule['rate'] * scale, max(rule.get('burst', 1) * scale, 1)))
+        self.max_parked = max_parked
+        self.queues = {}  # host -> deque of (job, parked at)
+        self.buckets = {}
+        self.ready = []  # heap of (ready at, seq, host), one entry for each host with parked jobs
+        self.seq = itertools.count()
+        self.parked = 0
+        self.paused = {}  # host -> paused until
+        self.cond = threading.Condition()
+
+    def bucket(self, host):
+        if host not in self.buckets:
+            self.buckets[host] = None
+            for pattern, rate, burst in self.rules:
+                if fnmatch(host, pattern):
+                    self.buckets[host] = TokenBucket(rate, burst)
+                    break
+        return self.buckets[host]
+
+    def put(self, host, job, front=False):
+        """
+        :param front: put the job back to the head of its host queue, regardless of `max_parked`
+        :return: False if too many jobs of this host are parked
+        """
+        with self.cond:
+            queue = self.queues.setdefault(host, deque())
+            if len(queue) >= self.max_parked and not front:
+                return False
+            if front:
+                queue.appendleft((job, time.time()))
+            else:
+                queue.append((job, time.time()))
+            self.parked += 1
+            if len(queue) == 1:
+                heapq.heappush(self.ready, (max(time.time(), self.paused.get(host, 0)), next(self.seq), host))
+            self.cond.notify()
+            return True
+
+    def pause(self, host, until):
+        """don't hand out jobs of this host until `until`"""
+        with self.cond:
+            self.paused[host] = until
+
+    def get(self):
+        """
+        Block until a job is allowed to be fetched.
+        :return: host, job, seconds the job was parked
+        """
+        with self.cond:
+            while True:
+                now = time.time()
+                if len(self.ready) == 0:
+                    self.cond.wait()
+                    continue
+                ready_at, _, host = self.ready[0]
+                if ready_at > now:
+                    self.cond.wait(ready_at - now)
+                    continue
+                heapq.heappop(self.ready)
+                if self.paused.get(host, 0) > now:
+                    heapq.heappush(self.ready, (self.paused[host], next(self.seq), host))
+                    continue
+                bucket = self.bucket(host)
+                wait = 0 if bucket is None else bucket.wait_time(now)
+                if wait > 0:
+                    heapq.heappush(self.ready, (now + wait, next(self.seq), host))
+                    continue
+                if bucket is not None:
+                    bucket.consume()
+                queue = self.queues[host]
+                job, parked_at = queue.popleft()
+                self.parked -= 1
+                if len(queue) > 0:
+                    heapq.heappush(self.ready, (now, next(self.seq), host))
+                else:
+                    del self.queues[host]
+                if len(self.ready) > 0:
+                    self.cond.notify()
+                return host, job, now - parked_at
+
+    def qsize(self):
+        return self.parked
@@ -0,0 +1,140 @@
+import math
+import threading
+from collections import Counter, OrderedDict
+
+
+class LatencyHistogram:
+    """
+    Streaming log-bucketed histogram, like HDR histogram.
+
+    Recording is O(1), percentiles have a relative error of `precision`. Counts are halved every
+    `half_life` samples, so the percentiles follow the recent latency. Censored samples, e.g.
+    requests which timed out, are only counted: their latency is unknown, and they don't move the
+    percentiles.
+    """
+
+    def __init__(self, precision=0.05, min_value=0.001, half_life=500):
+        self.log_base = math.log(1 + precision)
+        self.precision = precision
+        self.min_value = min_value
+        self.half_life = half_life
+        self.counts = Counter()
+        self.total = 0
+        self.censored = 0
+        self.samples = 0
+
+    def record(self, value):
+        self.counts[int(math.log(max(value, self.min_value) / self.min_value) / self.log_base)] += 1
+        self.total += 1
+        self.samples += 1
+        self.decay()
+
+    def record_censored(self):
+        self.censored += 1
+        self.decay()
+
+    def decay(self):
+        if self.total + self.censored >= 2 * self.half_life:
+            for i in list(self.counts):
+                self.counts[i] /= 2
+            self.total /= 2
+            self.censored /= 2
+
+    def censored_rate(self):
+        return self.censored / max(self.total + self.censored, 1)
+
+    def percentile(self, q):
+        target = q * self.total
+        acc = 0
+        for i in sorted(self.counts):
+            acc += self.counts[i]
+            if acc >= target:
+                return self.min_value * (1 + self.precision) ** (i + 1)
+        return None
+
+
+class AdaptiveTimeouts:
+    """
+    Request timeouts learned from the latency percentile of each (host, proxy), falling back to the
+    host's percentile while the pair has too few samples.
+
+    Timed out requests are not latency samples, otherwise every timeout would raise the percentile
+    it was derived from, up to the ceiling. A few dead proxies don't move the timeout of a host, but
+    while more than `max_timeout_rate` of its requests time out, the host is slower than learned and
+    the timeout is doubled.
+    """
+
+    def __init__(self, percentile=0.99, floor=3, ceiling=30, default=10, margin=1.2, min_samples=20,
+                 max_pairs=10000, max_timeout_rate=0.5):
+        """
+        :param percentile: timeouts sit near this latency percentile
+        :param floor: min timeout
+        :param ceiling: max timeout
+        :param default: timeout of hosts without enough samples
+        :param margin: timeout = margin * percentile
+        :param min_samples: min samples before a histogram is trusted
+        :param max_pairs: max (host, proxy) histograms, the least recently used ones are dropped
+        :param max_timeout_rate: timeouts are doubled while the timeout rate of the host is higher
+        """
+        self.percentile = percentile
+        self.floor = floor
+        self.ceiling = ceiling
+        self.default = default
+        self.margin = margin
+        self.min_samples = min_samples
+        self.max_pairs = max_pairs
+        self.max_timeout_rate = max_timeout_rate
+        self.hosts = {}
+        self.pairs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def timeout(self, host, proxy, retry=0):
+        """
+        :param retry: the timeout doubles on every retry, up to the ceiling
+        """
+        with self.lock:
+            hist = self.pairs.get((host, proxy))
+            if hist is None or hist.samples < self.min_samples:
+                hist = self.hosts.get(host)
+            if hist is None or hist.samples < self.min_samples:
+                t = self.default
+            else:
+                t = hist.percentile(self.percentile) * self.margin
+                if self.hosts[host].censored_rate() > self.max_timeout_rate:
+                    t *= 2
+        return max(self.floor, min(self.ceiling, t * 2 ** retry))
+
+    def latency(self, host, q):
+        """
+        :return: the q-th latency percentile of the host, None if it has too few samples
+        """
+        with self.lock:
+            hist = self.hosts.get(host)
+            if hist is None or hist.samples < self.min_samples:
+                return None
+            return hist.percentile(q)
+
+    def record(self, host, proxy, latency):
+        """
+        :param latency: seconds until the response headers arrived
+        """
+        with self.lock:
+            for hist in self.histograms(host, proxy):
+                hist.record(latency)
+
+    def record_timeout(self, host, proxy):
+        with self.lock:
+            for hist in self.histograms(host, proxy):
+                hist.record_censored()
+
+    def histograms(self, host, proxy):
+        if host not in self.hosts:
+            self.hosts[host] = LatencyHistogram()
+        key = (host, proxy)
+        if key not in self.pairs:
+            self.pairs[key] = LatencyHistogram()
+            if len(self.pairs) > self.max_pairs:
+                self.pairs.popitem(last=False)
+        else:
+            self.pairs.move_to_end(key)
+        return self.hosts[host], self.pairs[key]
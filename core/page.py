@@ -0,0 +1,181 @@
+import codecs
+import re
+import time
+
+from requests.compat import chardet
+from urllib3.util import make_headers
+
+DEFAULT_CONTENT_TYPES = ['text/html', 'application/xhtml+xml', 'text/plain', 'text/xml', 'application/xml',
+                         'application/json']
+
+
+# gzip and deflate, plus br and zstd if brotli and zstandard are installed (urllib3 decodes them)
+ACCEPT_ENCODING = make_headers(accept_encoding=True)['accept-encoding']
+BOMS = [(codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF32_LE, 'utf-32-le'), (codecs.BOM_UTF32_BE, 'utf-32-be'),
+        (codecs.BOM_UTF16_LE, 'utf-16-le'), (codecs.BOM_UTF16_BE, 'utf-16-be')]
+HEADER_CHARSET = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.I)
+# <meta charset="...">, <meta http-equiv="Content-Type" content="...; charset=..."> and <?xml encoding="..."?>
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)|<\?xml[^>]+encoding\s*=\s*["\']([\w.:-]+)', re.I)
+
+
+def normalize_encoding(name):
+    """
+    :return: the python codec name of an encoding label, None if unknown
+    """
+    if isinstance(name, bytes):
+        name = name.decode('ascii', errors='ignore')
+    try:
+        return codecs.lookup(name).name
+    except (LookupError, TypeError):
+        return None
+
+
+def header_charset(headers):
+    match = HEADER_CHARSET.search(headers.get('Content-Type', ''))
+    return normalize_encoding(match.group(1)) if match else None
+
+
+def content_length(headers):
+    """
+    :return: the Content-Length header, None if it is missing or malformed. A repeated header is
+        joined by commas, e.g. '10, 10', and its first value is taken.
+    """
+    try:
+        return int(headers.get('Content-Length', '').split(',')[0])
+    except ValueError:
+        return None
+
+
+def sniff_charset(content, sniff_size=4096):
+    """
+    Find the encoding from the BOM or the <meta> tags in the first `sniff_size` bytes.
+    """
+    for bom, encoding in BOMS:
+        if content.startswith(bom):
+            return encoding
+    match = META_CHARSET.search(content, 0, sniff_size)
+    if match is None:
+        return None
+    return normalize_encoding(match.group(1) or match.group(2))
+
+
+class CharsetDetector:
+    """
+    Find the encoding of a page by the cheapest way that works: the Content-Type charset, the BOM
+    or <meta> charset of the first bytes, the encoding detected before on the same host, and only
+    then a full detection of the body (which is cached for the host).
+    """
+
+    def __init__(self, sniff_size=4096, detect_size=64 * 1024, default='utf-8'):
+        """
+        :param sniff_size: bytes searched for a BOM or <meta> charset
+        :param detect_size: bytes given to the full detection
+        :param default: encoding if nothing is detected
+        """
+        self.sniff_size = sniff_size
+        self.detect_size = detect_size
+        self.default = default
+        self.hosts = {}
+
+    def encoding(self, host, page):
+        """
+        :return: encoding, how it was found (header, meta, cache or detect)
+        """
+        encoding = page.encoding
+        if encoding is not None:
+            return encoding, 'header'
+        encoding = sniff_charset(page.content, self.sniff_size)
+        if encoding is not None:
+            return encoding, 'meta'
+        encoding = self.hosts.get(host)
+        if encoding is not None:
+            return encoding, 'cache'
+        encoding = normalize_encoding(chardet.detect(page.content[:self.detect_size])['encoding']) or self.default
+        self.hosts[host] = encoding
+        return encoding, 'detect'
+
+    def decode(self, host, page):
+        encoding, _ = self.encoding(host, page)
+        return page.content.decode(encoding, errors='replace')
+
+
+class PageAborted(Exception):
+    def __init__(self, reason, retry=False):
+        """
+        :param reason: why the download was aborted
+        :param retry: whether another proxy may succeed
+        """
+        super().__init__(reason)
+        self.reason = reason
+        self.retry = retry
+
+
+class Page:
+    """
+    What the parse stage needs from a response: body bytes and a little metadata,
+    instead of the whole `requests.Response`.
+    """
+    __slots__ = ['url', 'status_code', 'headers', 'content', 'encoding', 'elapsed', 'aborted', 'wire_size',
+                 'reason', 'request_headers']
+
+    def __init__(self, url, status_code, headers, content, encoding=None, elapsed=0., aborted=None,
+                 wire_size=None, reason='', request_headers=None):
+        """
+        :param wire_size: body bytes received before decompression
+        :param request_headers: headers of the request, for archiving
+        """
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        self.elapsed = elapsed
+        self.aborted = aborted
+        self.wire_size = len(content) if wire_size is None else wire_size
+        self.reason = reason
+        self.request_headers = request_headers
+
+    @property
+    def text(self):
+        encoding = self.encoding or sniff_charset(self.content) or \
+            normalize_encoding(chardet.detect(self.content)['encoding']) or 'utf-8'
+        return self.content.decode(encoding, errors='replace')
+
+
+def read_page(res, max_size=10 * 1024 * 1024, min_throughput=1024, grace_sec=5, content_types=None,
+              chunk_size=64 * 1024):
+    """
+    Download the body of a streamed response, aborting it as early as possible.
+    :param res: response of `requests.get(..., stream=True)`
+    :param max_size: max body bytes
+    :param min_throughput: abort if the download is slower than this (bytes/sec) after `grace_sec` seconds
+    :param content_types: allowed content types, checked before the body is downloaded. None for all.
+    :return: Page
+    """
+    try:
+        content_type = res.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_types is not None and content_type != '' and content_type not in content_types:
+            raise PageAborted('content type {}'.format(content_type))
+        # a bad header is ignored, `max_size` is still enforced while streaming
+        length = content_length(res.headers)
+        if length is not None and length > max_size:
+            raise PageAborted('content length {}'.format(length))
+
+        chunks = []
+        size = 0
+        start = time.time()
+        for chunk in res.iter_content(chunk_size):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > max_size:
+                raise PageAborted('body larger than {}'.format(max_size))
+            escaped = time.time() - start
+            if escaped > grace_sec and size / escaped < min_throughput:
+                raise PageAborted('throughput {:.0f} B/s'.format(size / escaped), retry=True)
+        # bytes read from the socket, i.e. before `Content-Encoding` is decoded
+        wire_size = res.raw.tell() if hasattr(res.raw, 'tell') else size
+        return Page(res.url, res.status_code, res.headers, b''.join(chunks),
+                    header_charset(res.headers), res.elapsed.total_seconds(), wire_size=wire_size,
+                    reason=res.reason, request_headers=res.request.headers)
+    finally:
+        res.close()
@@ -0,0 +1,69 @@
+import collections
+import pickle
+
+
+class ParseMemo:
+    """
+    Bounded LRU of what `parse` extracted from a page body: the results given to `add_result` and
+    the args of `add_job`. A page whose body was parsed before is replayed instead of parsed again,
+    e.g. soft-404 pages or the same entry under different urls.
+
+    With `redis_db`, entries are also shared by all processes of the task for `ttl` seconds.
+    """
+
+    def __init__(self, max_size=10000, redis_db=None, prefix='', ttl=86400):
+        """
+        :param max_size: entries kept in memory
+        :param redis_db: redis client to share the entries with, None to keep them local
+        :param prefix: prefix of the redis keys
+        :param ttl: seconds an entry is kept in redis
+        """
+        self.max_size = max_size
+        self.redis = redis_db
+        self.prefix = prefix
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :param key: bytes, e.g. a hash of the body
+        :return: results, links of the body, None if it wasn't parsed before
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        if self.redis is not None:
+            data = self.redis.get(self.prefix + key.hex())
+            if data is not None:
+                entry = pickle.loads(data)
+                self.remember(key, entry)
+                self.redis_hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, results, links):
+        entry = (results, links)
+        self.remember(key, entry)
+        if self.redis is not None:
+            self.redis.set(self.prefix + key.hex(), pickle.dumps(entry, pickle.HIGHEST_PROTOCOL), ex=self.ttl)
+
+    def remember(self, key, entry):
+        self.entries[key] = entry
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def report(self):
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            'hits': self.hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.redis_hits) / max(lookups, 1), 3),
+            'size': len(self.entries),
+        }
@@ -0,0 +1,309 @@
+"""
+A standalone proxy broker shared by many crawler tasks.
+
+The broker owns proxy collection, validation and reputation, and lends proxies to any number of
+schedulers (`proxy_pool="broker"`) through redis. Each proxy has `max_concurrency` lease tokens,
+and each client may hold at most its fair share of all tokens.
+
+Run in the root directory of REPO:
+    export PYTHONPATH=. && python -m core.proxy_broker --proxy_pool mixed
+"""
+import argparse
+import json
+import math
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+import requests
+
+from .config import Config
+from .proxy_pool import PROXY_POOL_REGISTRY
+
+# KEYS: free tokens, leases, held leases per client, clients, capacity, leases per proxy
+# ARGV: client, now, lease ttl, client timeout, nonce
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[2])
+redis.call('ZADD', KEYS[4], now, ARGV[1])
+local active = redis.call('ZCOUNT', KEYS[4], now - tonumber(ARGV[4]), '+inf')
+local capacity = tonumber(redis.call('GET', KEYS[5]) or '0')
+local held = tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or '0')
+if held >= math.ceil(capacity / math.max(active, 1)) then
+    return false
+end
+local proxy = redis.call('RPOP', KEYS[1])
+if not proxy then
+    return false
+end
+redis.call('HINCRBY', KEYS[3], ARGV[1], 1)
+redis.call('HINCRBY', KEYS[6], proxy, 1)
+local lease = proxy .. '|' .. ARGV[1] .. '|' .. ARGV[5]
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[3]), lease)
+return lease
+"""
+
+# KEYS: free tokens, leases, held leases per client, proxies, feedback, leases per proxy
+# ARGV: lease, feedback level ('' for none)
+RELEASE_SCRIPT = """
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+local proxy, client = string.match(ARGV[1], '^([^|]*)|([^|]*)|')
+redis.call('HINCRBY', KEYS[3], client, -1)
+if redis.call('HINCRBY', KEYS[6], proxy, -1) <= 0 then
+    redis.call('HDEL', KEYS[6], proxy)
+end
+if redis.call('SISMEMBER', KEYS[4], proxy) == 1 then
+    redis.call('LPUSH', KEYS[1], proxy)
+end
+if ARGV[2] ~= '' then
+    redis.call('RPUSH', KEYS[5], proxy .. '|' .. ARGV[2])
+end
+return 1
+"""
+
+# Add proxies with the tokens of their leases not held anymore, a proxy retired and collected again
+# while leased doesn't get more than `max_concurrency` tokens.
+# KEYS: free tokens, proxies, leases per proxy
+# ARGV: max concurrency, proxies...
+ADD_SCRIPT = """
+local tokens = {}
+for i = 2, #ARGV do
+    if redis.call('SADD', KEYS[2], ARGV[i]) == 1 then
+        tokens[ARGV[i]] = tonumber(ARGV[1]) - tonumber(redis.call('HGET', KEYS[3], ARGV[i]) or '0')
+    end
+end
+-- push the tokens round by round, so a proxy's tokens aren't taken in a row
+for round = 1, tonumber(ARGV[1]) do
+    for i = 2, #ARGV do
+        if (tokens[ARGV[i]] or 0) >= round then
+            redis.call('LPUSH', KEYS[1], ARGV[i])
+        end
+    end
+end
+return 0
+"""
+
+
+class ProxyBrokerKeys:
+    def __init__(self, name):
+        self.free = name + ':free'
+        self.leases = name + ':leases'
+        self.held = name + ':held'
+        self.clients = name + ':clients'
+        self.capacity = name + ':capacity'
+        self.proxies = name + ':proxies'
+        self.feedback = name + ':feedback'
+        self.leased = name + ':leased'
+
+
+class ProxyBrokerClient:
+    """
+    Acquire and release proxy leases from a `ProxyBroker`.
+    """
+
+    def __init__(self, redis_db, name='proxy_broker', client_id=None, lease_ttl=600, client_timeout=60):
+        """
+        :param name: name of the broker, the prefix of its redis keys
+        :param client_id: unique id of this client, a random one by default
+        :param lease_ttl: seconds after which an unreleased lease is reclaimed by the broker
+        :param client_timeout: clients which haven't acquired for this long don't count in the fair share
+        """
+        self.redis = redis_db
+        self.keys = ProxyBrokerKeys(name)
+        self.client_id = (client_id or uuid.uuid4().hex).replace('|', '_')
+        self.lease_ttl = lease_ttl
+        self.client_timeout = client_timeout
+        self._acquire = self.redis.register_script(ACQUIRE_SCRIPT)
+        self._release = self.redis.register_script(RELEASE_SCRIPT)
+
+    def acquire(self):
+        """
+        :return: a lease `proxy|client|nonce`, or None if no proxy is available or this client exceeds its share
+        """
+        k = self.keys
+        lease = self._acquire(keys=[k.free, k.leases, k.held, k.clients, k.capacity, k.leased],
+                              args=[self.client_id, time.time(), self.lease_ttl, self.client_timeout,
+                                    uuid.uuid4().hex[:8]])
+        return lease.decode() if lease else None
+
+    def release(self, lease, level=None):
+        """
+        :param lease: lease returned by `acquire`
+        :param level: feedback level, same as `ProxyPool.feedback_proxy`. None for no feedback.
+        """
+        k = self.keys
+        return self._release(keys=[k.free, k.leases, k.held, k.proxies, k.feedback, k.leased],
+                             args=[lease, '' if level is None else level])
+
+    def renew(self, leases):
+        """
+        Extend leases still held by this client, so the broker doesn't reclaim them.
+        :return: number of leases renewed, the others were reclaimed already
+        """
+        if len(leases) == 0:
+            return 0
+        expire = time.time() + self.lease_ttl
+        pipe = self.redis.pipeline()
+        for lease in leases:
+            pipe.zadd(self.keys.leases, {lease: expire}, xx=True, ch=True)
+        return sum(pipe.execute())
+
+    @staticmethod
+    def proxy_of(lease):
+        return lease.split('|')[0]
+
+
+class ProxyBroker:
+    def __init__(self, proxy_pool, name='proxy_broker', max_concurrency=2, collect_interval=300,
+                 validate_url=None, validate_timeout=5, validate_threads=50, redis_db=None):
+        """
+        :param proxy_pool: name of a registered proxy pool used to collect proxies
+        :param name: name of the broker, the prefix of its redis keys
+        :param max_concurrency: max leases of one proxy at the same time
+        :param collect_interval: seconds between two collections
+        :param validate_url: if set, new proxies are validated by requesting this url
+        :param redis_db: redis connection, a new one to `Config.REDIS_HOST` by default
+        """
+        if redis_db is None:
+            rdp = redis.ConnectionPool(host=Config.REDIS_HOST,
+                                       port=Config.REDIS_PORT, db=0,
+                                       max_connections=100)
+            redis_db = redis.StrictRedis(connection_pool=rdp)
+        self.redis = redis_db
+        self.keys = ProxyBrokerKeys(name)
+        self.proxy_pool = PROXY_POOL_REGISTRY[proxy_pool](self.redis, {'task_name': name})
+        self.reputation = self.proxy_pool.reputation
+        self.max_concurrency = max_concurrency
+        self.collect_interval = collect_interval
+        self.validate_url = validate_url
+        self.validate_timeout = validate_timeout
+        self.validate_threads = validate_threads
+        # reclaiming expired leases is the same as releasing them without feedback
+        self.client = ProxyBrokerClient(self.redis, name, client_id='broker')
+        self._add = self.redis.register_script(ADD_SCRIPT)
+
+    def run(self):
+        last_collect = 0
+        last_monitor = time.time()
+        while True:
+            if time.time() - last_collect > self.collect_interval:
+                self.collect()
+                last_collect = time.time()
+            self.consume_feedback()
+            self.reclaim_leases()
+            if time.time() - last_monitor > 5:
+                self.monitor()
+                last_monitor = time.time()
+            time.sleep(0.5)
+
+    def collect(self):
+        self.proxy_pool.proxies_list = []
+        try:
+            self.proxy_pool.collect_proxies()
+        except Exception as e:
+            self.log("Collect proxies failed: {}".format(e), 'ERR')
+            return
+        collected = set(self.proxy_pool.proxies_list)
+        if len(collected) == 0:
+            self.log("No proxy collected.", 'WARN')
+            return
+        current = {p.decode() for p in self.redis.smembers(self.keys.proxies)}
+        self.remove_proxies(current - collected)
+        new_proxies = self.validate(collected - current)
+        self.add_proxies(new_proxies)
+        self.update_capacity()
+        self.log("Collect %d proxies, %d new, %d retired." % (
+            len(collected), len(new_proxies), len(current - collected)))
+
+    def validate(self, proxies):
+        if self.validate_url is None or len(proxies) == 0:
+            return list(proxies)
+
+        def check(proxy):
+            try:
+                res = requests.get(self.validate_url, proxies={'http': proxy, 'https': proxy},
+                                   timeout=self.validate_timeout)
+                return res.status_code == 200
+            except Exception:
+                return False
+
+        proxies = list(proxies)
+        with ThreadPoolExecutor(self.validate_threads) as executor:
+            valid = list(executor.map(check, proxies))
+        for p, ok in zip(proxies, valid):
+            self.reputation.feedback(p, 0 if ok else 2)
+        return [p for p, ok in zip(proxies, valid) if ok]
+
+    def add_proxies(self, proxies):
+        if len(proxies) > 0:
+            self._add(keys=[self.keys.free, self.keys.proxies, self.keys.leased],
+                      args=[self.max_concurrency] + list(proxies))
+
+    def remove_proxies(self, proxies):
+        if len(proxies) == 0:
+            return
+        pipe = self.redis.pipeline()
+        for p in proxies:
+            pipe.srem(self.keys.proxies, p)
+            pipe.lrem(self.keys.free, 0, p)
+        pipe.execute()
+        self.update_capacity()
+
+    def update_capacity(self):
+        self.redis.set(self.keys.capacity, self.redis.scard(self.keys.proxies) * self.max_concurrency)
+
+    def consume_feedback(self, batch_size=10000):
+        pipe = self.redis.pipeline()
+        pipe.lrange(self.keys.feedback, 0, batch_size - 1)
+        pipe.ltrim(self.keys.feedback, batch_size, -1)
+        feedback = pipe.execute()[0]
+        bad = set()
+        for item in feedback:
+            proxy, level = item.decode().rsplit('|', 1)
+            self.reputation.feedback(proxy, int(level))
+            if self.reputation.is_bad(proxy):
+                bad.add(proxy)
+        self.remove_proxies(bad)
+        self.reputation.flush()
+
+    def reclaim_leases(self):
+        expired = self.redis.zrangebyscore(self.keys.leases, '-inf', time.time(), start=0, num=10000)
+        for lease in expired:
+            self.client.release(lease.decode())
+        if len(expired) > 0:
+            self.log("Reclaim %d expired leases." % len(expired), 'WARN')
+
+    def monitor(self):
+        pipe = self.redis.pipeline()
+        pipe.scard(self.keys.proxies)
+        pipe.llen(self.keys.free)
+        pipe.zcard(self.keys.leases)
+        pipe.zcount(self.keys.clients, time.time() - self.client.client_timeout, '+inf')
+        pipe.get(self.keys.capacity)
+        proxies, free, leases, clients, capacity = pipe.execute()
+        capacity = int(capacity or 0)
+        print(json.dumps({
+            'proxies': proxies,
+            'free_tokens': free,
+            'leases': leases,
+            'active_clients': clients,
+            'fair_share': math.ceil(capacity / max(clients, 1)),
+        }))
+
+    def log(self, msg, level='INFO'):
+        print("| {} <ProxyBroker>: {}".format(level, msg))
+
+
+if __name__ == "__main__":
+    import proxy_pools  # donnot move
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--proxy_pool', default='mixed')
+    parser.add_argument('--name', default='proxy_broker')
+    parser.add_argument('--max_concurrency', type=int, default=2)
+    parser.add_argument('--collect_interval', type=int, default=300)
+    parser.add_argument('--validate_url', default=None)
+    args = parser.parse_args()
+    ProxyBroker(args.proxy_pool, args.name, args.max_concurrency, args.collect_interval, args.validate_url).run()
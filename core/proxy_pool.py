@@ -1,7 +1,8 @@
 import random
-from collections import Counter
 from queue import Queue
 
+from .proxy_reputation import ProxyReputation
+
 PROXY_POOL_REGISTRY = {}
 PROXY_POOL_CLASS_NAMES = set()
 
@@ -28,35 +29,42 @@ class ProxyPool:
         self.args = args or {}
         self.redis = redis_db
         self.proxies_list = []
-        self.proxy_retry = Counter()
         self.proxies = Queue(1000000)
         self.bad_proxies_name = args['task_name'] + "@bad_proxy"
         self.repeat = args.get('repeat', 1)
         self.collecting = False
+        # max proxies queued by the scheduler ahead of their use, None for the default
+        self.prefetch = None
         if args.get('restart', False):
             self.redis.delete(self.bad_proxies_name)
-        self.bad_proxies = self.redis.smembers(self.bad_proxies_name)
+        self.bad_proxies = {p.decode() for p in self.redis.smembers(self.bad_proxies_name)}
+        # shared by all tasks, and not wiped by `restart`
+        self.reputation = ProxyReputation(self.redis, args.get('reputation_key', 'proxy@reputation'))
+        self.log('Load reputation of %d proxies.' % self.reputation.load())
 
     def collect_proxies(self):
         raise NotImplementedError
 
     def shuffle_proxies(self):
-        self.bad_proxies = self.redis.smembers(self.bad_proxies_name)
-        self.proxies_list = [p for p in self.proxies_list if p not in self.bad_proxies]
+        self.bad_proxies = {p.decode() for p in self.redis.smembers(self.bad_proxies_name)}
+        self.proxies_list = [p for p in self.proxies_list
+                             if p not in self.bad_proxies and not self.reputation.is_bad(p)]
         for _ in range(self.repeat):
             random.shuffle(self.proxies_list)
             for p in self.proxies_list:
                 self.proxies.put(p)
 
     def feedback_proxy(self, proxy, level=0):
-        if level == 0:
-            self.proxies.put(proxy)
-            self.proxy_retry[proxy] = 0
-        elif level == 1:
+        """
+        :param proxy: proxy
+        :param level: 0: success, 1: request error, 2: proxy error, -1: the target host failed, not the proxy
+        """
+        if proxy is not None:
+            self.reputation.feedback(proxy, level)
+        if level <= 1:
             self.proxies.put(proxy)
         else:
-            self.proxy_retry.update({proxy: 1})
-            if self.proxy_retry[proxy] > 10:
+            if self.reputation.is_bad(proxy):
                 self.redis.sadd(self.bad_proxies_name, proxy)
             else:
                 self.proxies.put(proxy)
@@ -78,8 +86,12 @@ class ProxyPool:
         if not proxy.startswith("http"):
             assert isinstance(proxy, str), "Proxy <{}> is not a str".format(proxy)
             proxy = "http://" + proxy
-        if proxy not in self.bad_proxies:
+        if proxy not in self.bad_proxies and not self.reputation.is_bad(proxy):
             self.proxies_list.append(proxy)
 
+    def close(self):
+        """write back the reputation feedback not flushed yet"""
+        self.reputation.flush()
+
     def log(self, msg, level='INFO'):
         print("| {} <ProxyPool>: {}".format(level, msg))
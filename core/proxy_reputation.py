@@ -0,0 +1,107 @@
+import struct
+import threading
+import time
+
+# score (float32), updated at, last success at (uint32 epoch seconds), failure streak (uint16)
+RECORD = struct.Struct('<fIIH')
+
+
+class ProxyReputation:
+    """
+    Proxy reputation shared by all tasks and kept across restarts.
+
+    Every proxy has a score, the time of its last success and its failure streak. The score
+    decays towards 0 with `half_life`, so a bad proxy gets another chance after a while.
+    Records are packed into a redis hash (14 bytes per proxy), loaded in bulk by `load` and
+    written back in batches by `flush`, which the owner also calls on close.
+    """
+
+    def __init__(self, redis_db, key='proxy@reputation', half_life=3600, ban_score=-5, max_fail_streak=10,
+                 flush_interval=5):
+        """
+        :param redis_db: redis connection
+        :param key: redis hash storing the records
+        :param half_life: seconds in which a score decays by half
+        :param ban_score: proxies whose decayed score is lower than this are bad
+        :param max_fail_streak: proxies failed more than this in a row (within `half_life`) are bad
+        :param flush_interval: seconds between two writes to redis
+        """
+        self.redis = redis_db
+        self.key = key
+        self.half_life = half_life
+        self.ban_score = ban_score
+        self.max_fail_streak = max_fail_streak
+        self.flush_interval = flush_interval
+        self.records = {}
+        self.dirty = set()
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+
+    def load(self):
+        """load all records from redis, merging them with the local ones"""
+        records = {}
+        for proxy, value in self.redis.hscan_iter(self.key, count=10000):
+            records[proxy.decode()] = RECORD.unpack(value)
+        with self.lock:
+            for proxy, record in records.items():
+                if proxy not in self.dirty or record[1] > self.records[proxy][1]:
+                    self.records[proxy] = record
+        return len(records)
+
+    def flush(self):
+        with self.lock:
+            dirty = {p: RECORD.pack(*self.records[p]) for p in self.dirty}
+            self.dirty = set()
+            self.last_flush = time.time()
+        if len(dirty) > 0:
+            self.redis.hset(self.key, mapping=dirty)
+
+    def score(self, proxy, now=None):
+        record = self.records.get(proxy)
+        if record is None:
+            return 0.
+        now = now or time.time()
+        return record[0] * 0.5 ** (max(now - record[1], 0) / self.half_life)
+
+    def fail_streak(self, proxy):
+        record = self.records.get(proxy)
+        return 0 if record is None else record[3]
+
+    def is_bad(self, proxy, now=None):
+        record = self.records.get(proxy)
+        if record is None:
+            return False
+        now = now or time.time()
+        if record[3] > self.max_fail_streak and now - record[1] < self.half_life:
+            return True
+        return self.score(proxy, now) < self.ban_score
+
+    def feedback(self, proxy, level=0):
+        """
+        :param proxy: proxy
+        :param level: same as `ProxyPool.feedback_proxy`, 0: success, 1: request error, 2: proxy error,
+            negative levels leave the reputation unchanged
+        """
+        if level < 0:
+            return
+        now = time.time()
+        with self.lock:
+            score = self.score(proxy, now)
+            _, _, last_success, streak = self.records.get(proxy, (0., 0, 0, 0))
+            if level == 0:
+                score, last_success, streak = score + 1, int(now), 0
+            elif level == 1:
+                # request errors lower the score, but only proxy errors get it banned
+                score = max(score - 0.5, min(score, self.ban_score))
+            else:
+                score, streak = score - 1, min(streak + 1, 0xffff)
+            self.records[proxy] = (score, int(now), last_success, streak)
+            self.dirty.add(proxy)
+        if now - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def reset(self):
+        with self.lock:
+            self.records = {}
+            self.dirty = set()
+        self.redis.delete(self.key)
@@ -0,0 +1,78 @@
+import random
+import threading
+import time
+
+import requests
+
+from .page import ACCEPT_ENCODING
+
+
+class ProxySessions:
+    """
+    Hand out a (session, proxy, headers) triple for each request of `Crawler.scrape`.
+    The default takes a new proxy and user agent for every request and never reuses connections.
+    """
+
+    def __init__(self, q_proxy, q_proxy_feedback, user_agents):
+        self.q_proxy = q_proxy
+        self.q_proxy_feedback = q_proxy_feedback
+        self.user_agents = user_agents
+
+    def acquire(self, host):
+        """
+        :param host: target host of the request
+        :return: session (or `requests` itself), proxy, headers
+        """
+        return requests, self.q_proxy.get(), {'User-Agent': random.choice(self.user_agents),
+                                              'Accept-Encoding': ACCEPT_ENCODING}
+
+    def feedback(self, host, proxy, level=0):
+        """
+        :param level: same as `ProxyPool.feedback_proxy`, -1 if the proxy worked but the target host failed
+        """
+        self.q_proxy_feedback.put((proxy, level))
+
+
+class StickyProxySessions(ProxySessions):
+    """
+    Each fetch thread binds to one proxy and one `requests.Session` per host, so keep-alive connections
+    and cookies are reused. The binding rotates after `max_requests` requests, `max_seconds` seconds
+    or any failure. The proxy is only given back to the `ProxyPool` when its binding is released.
+    """
+
+    def __init__(self, q_proxy, q_proxy_feedback, user_agents, max_requests=100, max_seconds=300):
+        super().__init__(q_proxy, q_proxy_feedback, user_agents)
+        self.max_requests = max_requests
+        self.max_seconds = max_seconds
+        self.local = threading.local()
+
+    def _bindings(self):
+        if not hasattr(self.local, 'bindings'):
+            self.local.bindings = {}
+        return self.local.bindings
+
+    def acquire(self, host):
+        bindings = self._bindings()
+        binding = bindings.get(host)
+        now = time.time()
+        if binding is not None and (binding['requests'] >= self.max_requests or
+                                    now - binding['since'] > self.max_seconds):
+            self.release(host)
+            binding = None
+        if binding is None:
+            session = requests.Session()
+            session.headers['User-Agent'] = random.choice(self.user_agents)
+            session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+            binding = bindings[host] = {'session': session, 'proxy': self.q_proxy.get(), 'since': now, 'requests': 0}
+        binding['requests'] += 1
+        return binding['session'], binding['proxy'], None
+
+    def feedback(self, host, proxy, level=0):
+        if level > 0:
+            self.release(host, level)
+
+    def release(self, host, level=0):
+        binding = self._bindings().pop(host, None)
+        if binding is not None:
+            binding['session'].close()
+            super().feedback(host, binding['proxy'], level)
@@ -0,0 +1,65 @@
+import threading
+import time
+
+# GCRA, granting up to ARGV[3] requests at once. The redis server clock is used so that all machines agree.
+# KEYS: theoretical arrival time (microseconds)
+# ARGV: emission interval (us), burst tolerance (us), requested
+# return: {granted, microseconds to wait before retrying}
+GCRA_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000000 + tonumber(t[2])
+local interval, tolerance = tonumber(ARGV[1]), tonumber(ARGV[2])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or '0'), now)
+local allowed = math.floor((now + tolerance - tat) / interval) + 1
+if allowed <= 0 then
+    return {0, tat - tolerance - now}
+end
+local granted = math.min(tonumber(ARGV[3]), allowed)
+tat = tat + granted * interval
+redis.call('SET', KEYS[1], string.format('%d', tat), 'PX', math.ceil((tat - now) / 1000) + 1000)
+return {granted, 0}
+"""
+
+
+class DistributedRateLimiter:
+    """
+    A qps budget shared by all processes and machines running the same task.
+
+    Tokens are granted by a GCRA script in redis in small batches, so most `acquire` calls don't
+    touch redis. A batch is at most `batch_sec` seconds worth of budget. Tokens of a batch are
+    already charged to the shared budget, so they are kept until they are used.
+    """
+
+    def __init__(self, redis_db, key, qps, burst_sec=1., batch_sec=0.05):
+        """
+        :param key: redis key of the limiter, shared by all workers of the task
+        :param qps: requests per second over the whole cluster
+        :param burst_sec: seconds worth of budget which may be spent at once
+        :param batch_sec: seconds worth of budget granted per round trip
+        """
+        self.redis = redis_db
+        self.key = key
+        self.qps = qps
+        self.interval = int(1e6 / qps)
+        self.tolerance = int(burst_sec * 1e6)
+        self.batch = max(1, int(qps * batch_sec))
+        self.tokens = 0
+        self.lock = threading.Lock()
+        self._script = self.redis.register_script(GCRA_SCRIPT)
+
+    def acquire(self):
+        """
+        Block until a request is allowed.
+        :return: seconds waited
+        """
+        start = time.time()
+        with self.lock:
+            while True:
+                if self.tokens > 0:
+                    self.tokens -= 1
+                    return time.time() - start
+                granted, wait = self._script(keys=[self.key], args=[self.interval, self.tolerance, self.batch])
+                if granted > 0:
+                    self.tokens = granted
+                else:
+                    time.sleep(wait / 1e6)
@@ -0,0 +1,118 @@
+import collections
+import json
+import os
+import time
+from multiprocessing import Pool
+from queue import Queue
+
+from .response_store import ResponseArchive, ResponseStore
+
+# state of a reparse worker process, set by `init_worker`
+worker = {}
+
+
+def init_worker(crawler_cls, runtime_context, args):
+    worker['crawler'] = crawler_cls.offline(os.getpid(), runtime_context, [Queue()], Queue(), args)
+    worker['stores'] = {}
+
+
+def parse_batch(batch):
+    """
+    :param batch: path of a store, its entries to parse
+    :return: results added by `parse`, stats
+    """
+    path, entries = batch
+    crawler = worker['crawler']
+    if path not in worker['stores']:
+        worker['stores'][path] = ResponseStore(path)
+    store = worker['stores'][path]
+    stats = collections.Counter()
+    for meta, body_hash in entries:
+        page = store.page(meta, body_hash)
+        if page is None:
+            stats['missing'] += 1
+            continue
+        try:
+            soup = crawler.make_soup(page.url, page)
+            start = time.time()
+            crawler.parse(crawler.shared_context, soup, page.url)
+            stats['parse_time(s)'] += time.time() - start
+            stats['success'] += 1
+        except Exception as e:
+            stats['error'] += 1
+            crawler.log("Error occurs when parsing the content: {} ({})".format(str(e), page.url), 'ERR')
+    results = []
+    while not crawler.q_results[0].empty():
+        results.append(crawler.q_results[0].get())
+    while not crawler.q_stats.empty():
+        stats.update(crawler.q_stats.get())
+    return results, stats
+
+
+class Reparser:
+    """
+    Parse the pages of a `ResponseStore` again, e.g. after fixing a bug of `parse`.
+    """
+
+    def __init__(self, crawler_cls, response_store, processes=None, args=None, batch_size=200):
+        """
+        :param crawler_cls: crawler class
+        :param response_store: directory of the stores
+        :param processes: number of parsing processes, the number of cores by default
+        :param args: args of `prepare`, also available in the offline crawlers as `self.args`. `reparse`
+            is set to True, e.g. for `prepare` to set up fresh outputs.
+        :param batch_size: pages sent to a process at once
+        """
+        self.crawler_cls = crawler_cls
+        self.response_store = response_store
+        self.processes = processes or os.cpu_count()
+        self.args = dict(args or {}, reparse=True)
+        self.batch_size = batch_size
+
+    def batches(self, archive):
+        for store in archive.stores:
+            batch = []
+            for entry in store.entries():
+                batch.append(entry)
+                if len(batch) >= self.batch_size:
+                    yield store.path, batch
+                    batch = []
+            if len(batch) > 0:
+                yield store.path, batch
+
+    def run(self):
+        context, runtime_context = {}, {}
+        self.crawler_cls.prepare(context, runtime_context, self.args)
+        archive = ResponseArchive(self.response_store)
+        total = len(archive)
+        self.log("Reparse {} pages with {} processes.".format(total, self.processes))
+
+        stats = collections.Counter()
+        start = last_report = time.time()
+        with Pool(self.processes, init_worker, (self.crawler_cls, runtime_context, self.args)) as pool:
+            for results, batch_stats in pool.imap_unordered(parse_batch, self.batches(archive)):
+                for result in results:
+                    self.crawler_cls.collect_results(context, result)
+                stats.update(batch_stats)
+                if time.time() - last_report > 5:
+                    self.report(stats, total, time.time() - start)
+                    last_report = time.time()
+        archive.close()
+        for sink in context.get('sinks', {}).values():
+            sink.close()
+        self.report(stats, total, time.time() - start)
+        return stats
+
+    def report(self, stats, total, time_escape):
+        pages = stats['success'] + stats['error'] + stats['missing']
+        report = dict(stats)
+        report.update({
+            'time_escape(s)': int(time_escape),
+            'progress': '{}/{}'.format(pages, total),
+            'speed (pages/sec)': round(pages / time_escape, 2),
+            'speed (pages/sec/core)': round(pages / time_escape / self.processes, 2),
+        })
+        print(json.dumps(report))
+
+    def log(self, msg, level='INFO'):
+        print("| {} <Reparser>: {}".format(level, msg))
@@ -0,0 +1,276 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from requests.structures import CaseInsensitiveDict
+
+from .page import Page
+
+
+def digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class MmapHashTable:
+    """
+    Open addressing hash table of fixed size slots in a mmap-ed file, keyed by 16-byte hashes.
+    Lookups are O(1) and the table is usable right after `open`, without loading anything.
+    """
+    HEADER = struct.Struct('<4sIQQ')  # magic, slot size, capacity, count
+    MAGIC = b'MHT1'
+    EMPTY = bytes(16)
+
+    def __init__(self, path, value_format, capacity=1 << 16, max_load=0.7):
+        """
+        :param path: file of the table, created if it doesn't exist
+        :param value_format: struct format of the values, e.g. 'IQ'
+        :param capacity: initial number of slots, a power of 2
+        :param max_load: the table doubles when it is fuller than this
+        """
+        self.path = path
+        self.value_format = value_format
+        self.slot = struct.Struct('<16s' + value_format)
+        self.max_load = max_load
+        if not os.path.exists(path):
+            self._create(path, capacity)
+        self._open()
+
+    def _create(self, path, capacity):
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.slot.size, capacity, 0))
+            f.truncate(self.HEADER.size + capacity * self.slot.size)
+
+    def _open(self):
+        self.file = open(self.path, 'r+b')
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        magic, slot_size, self.capacity, self.count = self.HEADER.unpack_from(self.mm, 0)
+        if magic != self.MAGIC or slot_size != self.slot.size:
+            raise ValueError('{} is not a hash table of {} byte slots'.format(self.path, self.slot.size))
+
+    def _find(self, key):
+        """
+        :return: offset of the slot of the key, or of the empty slot where it would be
+        """
+        mask = self.capacity - 1
+        i = int.from_bytes(key[:8], 'little') & mask
+        while True:
+            offset = self.HEADER.size + i * self.slot.size
+            k = self.mm[offset:offset + 16]
+            if k == key or k == self.EMPTY:
+                return offset, k == key
+            i = (i + 1) & mask
+
+    def get(self, key):
+        offset, found = self._find(key)
+        return self.slot.unpack_from(self.mm, offset)[1:] if found else None
+
+    def put(self, key, *value):
+        offset, found = self._find(key)
+        self.slot.pack_into(self.mm, offset, key, *value)
+        if not found:
+            self.count += 1
+            self.HEADER.pack_into(self.mm, 0, self.MAGIC, self.slot.size, self.capacity, self.count)
+            if self.count > self.capacity * self.max_load:
+                self._grow()
+
+    def _grow(self):
+        tmp = self.path + '.tmp'
+        self._create(tmp, self.capacity * 2)
+        new = MmapHashTable(tmp, self.value_format)
+        for key, *value in self.items():
+            new.put(key, *value)
+        new.close()
+        self.close()
+        os.replace(tmp, self.path)
+        self._open()
+
+    def items(self):
+        for i in range(self.capacity):
+            record = self.slot.unpack_from(self.mm, self.HEADER.size + i * self.slot.size)
+            if record[0] != self.EMPTY:
+                yield record
+
+    def __len__(self):
+        return self.count
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+
+class ResponseStore:
+    """
+    Append-only store of fetched pages, so they can be parsed again without downloading them.
+
+    Bodies are compressed and written once per content hash into segment files of `segment_size`.
+    Every put appends the url and metadata to a journal. Two mmap-ed hash tables index the content
+    hash to its place in the segments, and the url to its latest content hash and journal entry.
+
+    A store has a single writer. Crawler processes write to their own sub directories, which are
+    read together by `ResponseArchive`.
+    """
+    SEGMENT = 'segment-{:05d}.dat'
+
+    def __init__(self, path, segment_size=256 * 1024 * 1024, compress_level=1, flush_interval=5):
+        """
+        :param path: directory of the store
+        :param segment_size: a new segment file is started after this many bytes
+        :param compress_level: zlib level of the bodies
+        :param flush_interval: seconds between two flushes to disk
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.segment_size = segment_size
+        self.compress_level = compress_level
+        self.flush_interval = flush_interval
+        # content hash -> segment, offset, compressed size, size
+        self.bodies = MmapHashTable(os.path.join(path, 'bodies.idx'), 'IQII')
+        # url hash -> content hash, fetched at, journal offset
+        self.urls = MmapHashTable(os.path.join(path, 'urls.idx'), '16sIQ')
+        self.journal = open(os.path.join(path, 'journal.jsonl'), 'ab')
+        self.segment_id = max([int(f[8:13]) for f in os.listdir(path) if f.startswith('segment-')], default=0)
+        self.segment = open(os.path.join(path, self.SEGMENT.format(self.segment_id)), 'ab')
+        self.readers = {}
+        self.journal_reader = None
+        self.last_flush = time.time()
+
+    def put(self, url, page):
+        """
+        :param url: cleaned url of the page
+        :param page: `Page`
+        :return: True if the body is new to the store
+        """
+        body_hash = digest(page.content)
+        new = self.bodies.get(body_hash) is None
+        if new:
+            if self.segment.tell() > self.segment_size:
+                self.segment.close()
+                self.segment_id += 1
+                self.segment = open(os.path.join(self.path, self.SEGMENT.format(self.segment_id)), 'ab')
+            data = zlib.compress(page.content, self.compress_level)
+            offset = self.segment.tell()
+            self.segment.write(data)
+            # the index is written to the mmap at once, so the body must reach the file first
+            self.segment.flush()
+            self.bodies.put(body_hash, self.segment_id, offset, len(data), len(page.content))
+
+        now = int(time.time())
+        offset = self.journal.tell()
+        self.journal.write(json.dumps({
+            'url': url,
+            'status_code': page.status_code,
+            'content_type': page.headers.get('Content-Type'),
+            'encoding': page.encoding,
+            'fetched_at': now,
+        }).encode() + b'\n')
+        self.journal.flush()
+        self.urls.put(digest(url.encode()), body_hash, now, offset)
+        if now - self.last_flush > self.flush_interval:
+            self.flush()
+        return new
+
+    def get(self, url):
+        """
+        :return: latest `Page` of the url, None if it isn't stored
+        """
+        entry = self.urls.get(digest(url.encode()))
+        if entry is None:
+            return None
+        body_hash, _, offset = entry
+        if self.journal_reader is None:
+            self.journal_reader = open(self.journal.name, 'rb')
+        self.journal_reader.seek(offset)
+        meta = json.loads(self.journal_reader.readline())
+        return self.page(meta, body_hash)
+
+    def page(self, meta, body_hash):
+        """
+        :return: `Page`, None if its body was lost, e.g. the writer was killed before a flush
+        """
+        location = self.bodies.get(body_hash)
+        if location is None:
+            return None
+        segment_id, offset, size, _ = location
+        if segment_id not in self.readers:
+            self.readers[segment_id] = open(os.path.join(self.path, self.SEGMENT.format(segment_id)), 'rb')
+        try:
+            content = zlib.decompress(os.pread(self.readers[segment_id].fileno(), size, offset))
+        except zlib.error:
+            return None
+        headers = CaseInsensitiveDict({'Content-Type': meta['content_type']} if meta['content_type'] else {})
+        return Page(meta['url'], meta['status_code'], headers, content, meta['encoding'], wire_size=size)
+
+    def entries(self):
+        """
+        Iterate over the journal entry and content hash of the latest page of every url, in the order
+        they were fetched. Pass them to `page` to read the pages.
+        """
+        self.flush()
+        with open(self.journal.name, 'rb') as f:
+            offset = 0
+            for line in f:
+                meta = json.loads(line)
+                entry = self.urls.get(digest(meta['url'].encode()))
+                if entry is not None and entry[2] == offset:
+                    yield meta, entry[0]
+                offset += len(line)
+
+    def __iter__(self):
+        for meta, body_hash in self.entries():
+            page = self.page(meta, body_hash)
+            if page is not None:
+                yield page
+
+    def __len__(self):
+        return len(self.urls)
+
+    def flush(self):
+        # data first, so the index never points to bytes which aren't written
+        self.segment.flush()
+        self.journal.flush()
+        self.bodies.flush()
+        self.urls.flush()
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush()
+        for f in list(self.readers.values()) + [self.segment, self.journal, self.journal_reader]:
+            if f is not None:
+                f.close()
+        self.bodies.close()
+        self.urls.close()
+
+
+class ResponseArchive:
+    """
+    Read the stores written by all crawler processes under `path`.
+    """
+
+    def __init__(self, path):
+        self.stores = [ResponseStore(os.path.join(path, d)) for d in sorted(os.listdir(path))
+                       if os.path.isdir(os.path.join(path, d))]
+
+    def get(self, url):
+        for store in self.stores:
+            page = store.get(url)
+            if page is not None:
+                return page
+        return None
+
+    def __iter__(self):
+        for store in self.stores:
+            yield from store
+
+    def __len__(self):
+        return sum(len(store) for store in self.stores)
+
+    def close(self):
+        for store in self.stores:
+            store.close()
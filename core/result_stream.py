@@ -0,0 +1,94 @@
+import pickle
+
+import redis
+
+
+class ResultStream:
+    """
+    Durable results of a task in redis streams, one stream per collector shard.
+
+    Crawlers append the results of a batch of pages with `append`, in the same transaction which
+    marks the pages done, so a page is never done without its results. Collectors read them with
+    a consumer group and acknowledge them once they are checkpointed, so results delivered but not
+    acknowledged when a collector dies are delivered again when it restarts.
+    """
+    GROUP = 'collectors'
+
+    def __init__(self, redis_db, task_name, shards):
+        """
+        :param task_name: the streams are `<task_name>_results:<shard>`
+        :param shards: number of collectors, at least 1
+        """
+        self.redis = redis_db
+        self.keys = ['{}_results:{}'.format(task_name, i) for i in range(shards)]
+
+    def append(self, pipe, shard, results):
+        """
+        Append a list of results to the stream of a shard, as one entry.
+        :param pipe: redis pipeline, executed by the caller
+        """
+        pipe.xadd(self.keys[shard], {b'results': pickle.dumps(results, pickle.HIGHEST_PROTOCOL)})
+
+    def backlog(self, shard):
+        """
+        :return: entries of a shard not acknowledged yet
+        """
+        return self.redis.xlen(self.keys[shard])
+
+    def delete(self):
+        self.redis.delete(*self.keys)
+
+
+class ResultStreamReader:
+    """
+    Read the results of one shard as its collector. Entries delivered before a restart but never
+    acknowledged are read first.
+    """
+
+    def __init__(self, stream, shard, count=100, block=500):
+        """
+        :param count: max entries returned by a `read`
+        :param block: milliseconds a `read` waits for new entries
+        """
+        self.stream = stream
+        self.key = stream.keys[shard]
+        self.consumer = 'collector-{}'.format(shard)
+        self.count = count
+        self.block = block
+        try:
+            stream.redis.xgroup_create(self.key, ResultStream.GROUP, id='0', mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        # '0' reads the pending entries of this consumer from the start, '>' the new ones
+        self.last_id = '0'
+
+    def read(self):
+        """
+        :return: list of (entry id, list of results)
+        """
+        entries = []
+        if self.last_id != '>':
+            entries = self._read(self.last_id, None)
+            self.last_id = entries[-1][0] if entries else '>'
+        if self.last_id == '>':
+            # once the pending entries are exhausted, an empty read means no new entries either
+            entries = self._read('>', self.block)
+        # the fields of an entry deleted while pending are None
+        return [(entry_id, pickle.loads(fields[b'results']) if fields else [])
+                for entry_id, fields in entries]
+
+    def _read(self, last_id, block):
+        reply = self.stream.redis.xreadgroup(ResultStream.GROUP, self.consumer, {self.key: last_id},
+                                             count=self.count, block=block)
+        return reply[0][1] if reply else []
+
+    def ack(self, entry_ids):
+        """
+        Acknowledge and delete entries, call it once their results are durable.
+        """
+        if len(entry_ids) > 0:
+            pipe = self.stream.redis.pipeline()
+            pipe.xack(self.key, ResultStream.GROUP, *entry_ids)
+            pipe.xdel(self.key, *entry_ids)
+            pipe.execute()
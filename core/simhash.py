@@ -0,0 +1,125 @@
+import collections
+import hashlib
+import re
+
+# markup removed before the text is shingled
+TAGS = re.compile(rb'<script.*?</script>|<style.*?</style>|<!--.*?-->|<[^>]*>', re.S | re.I)
+# runs of bytes other than ascii spaces and punctuation, so it works on any ascii compatible encoding
+WORDS = re.compile(rb'[^\x00-\x2f\x3a-\x40\x5b-\x60\x7b-\x7f]+')
+LINKS = re.compile(rb'href\s*=\s*["\']?([^"\'\s>]+)', re.I)
+
+
+def shingles(content, features='text', size=3):
+    """
+    :param content: html bytes, not decoded
+    :param features: 'text' for shingles of `size` words of the text, 'links' for the hrefs
+    :return: list of features
+    """
+    if features == 'links':
+        return LINKS.findall(content)
+    words = WORDS.findall(TAGS.sub(b' ', content))
+    if len(words) <= size:
+        return [b' '.join(words)] if words else []
+    return [b' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def simhash(features, bits=64):
+    """
+    :return: fingerprint whose bits are the majority of the bits of the feature hashes, so similar
+        feature sets have fingerprints differing by a few bits. None without features.
+    """
+    if len(features) == 0:
+        return None
+    fmt = '0{}b'.format(bits)
+    hashes = [format(int.from_bytes(hashlib.blake2b(f, digest_size=bits // 8).digest(), 'little'), fmt)
+              for f in features]
+    # count the ones of each bit position in C instead of shifting every hash 64 times
+    half = len(hashes) / 2
+    return int(''.join('1' if column.count('1') > half else '0' for column in zip(*hashes)), 2)
+
+
+def distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class SimHashIndex:
+    """
+    Find fingerprints within `max_distance` bits of a fingerprint. The fingerprints are split into
+    `max_distance + 1` bands, and two fingerprints that close share at least one band, so only the
+    fingerprints of the same band buckets are compared. The oldest fingerprints are dropped beyond
+    `capacity`.
+    """
+
+    def __init__(self, max_distance=3, bits=64, capacity=1000000):
+        self.max_distance = max_distance
+        self.bits = bits
+        self.capacity = capacity
+        bands = max_distance + 1
+        width = bits // bands
+        # (shift, mask) of every band, the last one takes the remaining bits
+        self.bands = [(i * width, (1 << (width if i < bands - 1 else bits - i * width)) - 1) for i in range(bands)]
+        self.tables = [collections.defaultdict(list) for _ in self.bands]
+        self.order = collections.deque()
+
+    def keys(self, fp):
+        return [(fp >> shift) & mask for shift, mask in self.bands]
+
+    def near(self, fp):
+        """
+        :return: a fingerprint within `max_distance` bits, None if there is none
+        """
+        for table, key in zip(self.tables, self.keys(fp)):
+            for other in table.get(key, ()):
+                if distance(fp, other) <= self.max_distance:
+                    return other
+        return None
+
+    def add(self, fp):
+        for table, key in zip(self.tables, self.keys(fp)):
+            table[key].append(fp)
+        self.order.append(fp)
+        if len(self.order) > self.capacity:
+            old = self.order.popleft()
+            for table, key in zip(self.tables, self.keys(old)):
+                bucket = table[key]
+                bucket.remove(old)
+                if len(bucket) == 0:
+                    del table[key]
+
+    def __len__(self):
+        return len(self.order)
+
+
+class NearDuplicates:
+    """
+    Detect pages whose content is nearly the same as a page seen before, e.g. the same entry under
+    different urls, before they are parsed. Every crawler process keeps its own index.
+    """
+
+    def __init__(self, max_distance=3, features='text', shingle_size=3, capacity=1000000, skip='parse'):
+        """
+        :param max_distance: max different bits of the 64-bit fingerprints of near duplicates,
+            i.e. a similarity of at least `1 - max_distance / 64`
+        :param features: 'text' to compare the shingled text of the pages, 'links' their links
+        :param shingle_size: words of a text shingle
+        :param capacity: fingerprints kept in the index
+        :param skip: 'parse' to skip parsing near duplicates, 'links' to parse them without adding their urls
+        """
+        if skip not in ('parse', 'links'):
+            raise ValueError('Unknown skip: {}'.format(skip))
+        self.features = features
+        self.shingle_size = shingle_size
+        self.skip = skip
+        self.index = SimHashIndex(max_distance, capacity=capacity)
+
+    def seen(self, content):
+        """
+        :return: True if a near duplicate of the content was seen, otherwise the content is indexed
+        """
+        fp = simhash(shingles(content, self.features, self.shingle_size))
+        if fp is None:
+            return False
+        if self.index.near(fp) is not None:
+            return True
+        self.index.add(fp)
+        return False
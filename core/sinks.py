@@ -0,0 +1,367 @@
+import csv
+import io
+import json
+import os
+import re
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+PART = re.compile(r'part-\d{5}\.parquet$')
+
+
+def sink_files(path):
+    """
+    :return: the existing files written by a `Sink` of `path`, rotated or not, with any compression,
+        and its checkpoint
+    """
+    directory, name = os.path.split(path)
+    if not os.path.isdir(directory or '.'):
+        return []
+    stem, ext = os.path.splitext(name)
+    suffixes = '|'.join(re.escape(s) for s in SUFFIXES.values() if s)
+    pattern = re.compile(r'({}|{}\.\d{{5}}{})({})?$|{}\.checkpoint$'.format(
+        re.escape(name), re.escape(stem), re.escape(ext), suffixes, re.escape(name)))
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory or '.') if pattern.match(f))
+
+
+class Sink:
+    """
+    Buffered output file of `collect_results`, optionally compressed and rotated.
+
+    Records are encoded into a buffer and written in batches. Every `checkpoint_interval` seconds the
+    compressed stream is ended (gzip member or zstd frame), the file is fsync-ed and its size is
+    recorded in `<path>.checkpoint`. When the sink is opened again, the file is truncated to the
+    recorded size, so the output resumes from the last checkpoint without a broken tail.
+
+    Put sinks in `context['sinks']` in `prepare`, so the scheduler checkpoints them while idle and
+    closes them at the end.
+    """
+    # a record never spans lines, so an uncompressed file is valid up to its last complete line
+    line_records = True
+
+    def __init__(self, path, compression=None, level=3, buffer_size=1024 * 1024, rotate_size=None,
+                 rotate_interval=None, checkpoint_interval=30, overwrite=False, on_checkpoint=None):
+        """
+        :param path: output file. With rotation, `<stem>.<index><ext>` files are written instead.
+        :param compression: None, 'gzip' or 'zstd'. `.gz`/`.zst` is appended to the file names.
+        :param level: compression level
+        :param buffer_size: bytes buffered before a write
+        :param rotate_size: bytes of a file before the next one is started, None to never rotate by size
+        :param rotate_interval: seconds of a file before the next one is started, None to never rotate by time
+        :param checkpoint_interval: seconds between two checkpoints
+        :param overwrite: start from scratch instead of resuming from the checkpoint
+        :param on_checkpoint: called after every checkpoint, e.g. to commit state kept along the output
+        """
+        if compression not in SUFFIXES:
+            raise ValueError('Unknown compression: {}'.format(compression))
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstd compression requires `pip install zstandard`')
+        self.path = path
+        self.compression = compression
+        self.level = level
+        self.buffer_size = buffer_size
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.on_checkpoint = on_checkpoint
+        self.checkpoint_path = path + '.checkpoint'
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.buffered = 0
+        # records in the file which are not checkpointed yet
+        self.pending = 0
+        self.records = 0
+        self.index = 0
+        self.file = None
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        offset = None
+        if not overwrite and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding='utf-8') as f:
+                state = json.load(f)
+            self.index, offset, self.records = state['index'], state['offset'], state['records']
+        self.open(offset, overwrite)
+
+    @property
+    def file_name(self):
+        if self.rotate_size is None and self.rotate_interval is None:
+            name = self.path
+        else:
+            stem, ext = os.path.splitext(self.path)
+            name = '{}.{:05d}{}'.format(stem, self.index, ext)
+        return name + SUFFIXES[self.compression]
+
+    def open(self, offset=None, overwrite=False):
+        """
+        :param offset: truncate the file to this size, e.g. the checkpointed size
+        """
+        self.file = open(self.file_name, 'wb' if overwrite else 'ab')
+        if offset is not None and self.file.tell() > offset:
+            offset = self.resume_offset(offset)
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        self.opened_at = self.last_checkpoint = time.time()
+        self.compressor = self.new_compressor()
+        if self.file.tell() == 0:
+            self.buffer.append(self.header())
+            self.buffered += len(self.buffer[-1])
+
+    def resume_offset(self, offset):
+        """
+        :param offset: checkpointed size of the current file
+        :return: size the file is truncated to when resuming. A plain file keeps the complete lines
+            written after the checkpoint, a compressed one can't be read past it. With `on_checkpoint`,
+            the state committed along the output is rolled back to the checkpoint, so is the output.
+        """
+        if self.compression is not None or not self.line_records or self.on_checkpoint is not None:
+            return offset
+        with open(self.file_name, 'rb') as f:
+            f.seek(offset)
+            tail = f.read()
+        end = tail.rfind(b'\n') + 1
+        self.records += tail.count(b'\n', 0, end)
+        return offset + end
+
+    def new_compressor(self):
+        if self.compression == 'gzip':
+            return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level).compressobj()
+        return None
+
+    def header(self):
+        """
+        :return: bytes written at the beginning of every file
+        """
+        return b''
+
+    def encode(self, record):
+        """
+        :return: bytes of a record
+        """
+        raise NotImplementedError
+
+    def write(self, record):
+        data = self.encode(record)
+        with self.lock:
+            self.buffer.append(data)
+            self.buffered += len(data)
+            self.pending += 1
+            if self.buffered >= self.buffer_size:
+                self._flush()
+            self._tick()
+
+    def tick(self):
+        """
+        Checkpoint or rotate if it's time, called by the scheduler while no result comes.
+        """
+        with self.lock:
+            self._tick()
+
+    def checkpoint(self):
+        """
+        Make the records written so far durable now.
+        """
+        with self.lock:
+            self._checkpoint()
+
+    def _tick(self):
+        now = time.time()
+        if (self.rotate_size is not None and self.file.tell() > self.rotate_size) or \
+                (self.rotate_interval is not None and now - self.opened_at > self.rotate_interval):
+            self._rotate()
+        elif now - self.last_checkpoint > self.checkpoint_interval:
+            self._checkpoint()
+
+    def _flush(self):
+        data = b''.join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.file.write(data)
+
+    def _checkpoint(self):
+        self._flush()
+        if self.compressor is not None:
+            # end the gzip member / zstd frame, the file is valid up to here
+            self.file.write(self.compressor.flush())
+            self.compressor = self.new_compressor()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records += self.pending
+        self.pending = 0
+        tmp = self.checkpoint_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'file': self.file_name, 'index': self.index, 'offset': self.file.tell(),
+                       'records': self.records}, f)
+        os.replace(tmp, self.checkpoint_path)
+        self.last_checkpoint = time.time()
+        if self.on_checkpoint is not None:
+            self.on_checkpoint()
+
+    def _rotate(self):
+        self._checkpoint()
+        self.file.close()
+        self.index += 1
+        self.open(overwrite=True)
+        self._checkpoint()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self._checkpoint()
+                self.file.close()
+                self.file = None
+
+
+class LineSink(Sink):
+    """
+    Write strings as lines.
+    """
+
+    def encode(self, record):
+        return (record if record.endswith('\n') else record + '\n').encode('utf-8')
+
+
+class JsonlSink(Sink):
+    """
+    Write records as JSON lines.
+    """
+
+    def encode(self, record):
+        return (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+class CsvSink(Sink):
+    """
+    Write records (dicts or sequences in the order of `fields`) as CSV rows, with a header in every file.
+    """
+    # quoted fields may contain line breaks
+    line_records = False
+
+    def __init__(self, path, fields, **kwargs):
+        self.fields = fields
+        super().__init__(path, **kwargs)
+
+    def header(self):
+        return self.encode(self.fields)
+
+    def encode(self, record):
+        if isinstance(record, dict):
+            record = [record.get(f, '') for f in self.fields]
+        buf = io.StringIO()
+        csv.writer(buf).writerow(record)
+        return buf.getvalue().encode('utf-8')
+
+
+class ParquetSink:
+    """
+    Write dict records to a Parquet dataset, i.e. a directory of `part-<index>.parquet` files.
+    Rows are accumulated per column and written as a row group every `row_group_size` records,
+    so at most one row group is held in memory.
+
+    A Parquet file is only readable after its footer is written when it is closed. So the current
+    file is closed every `checkpoint_interval` seconds with the buffered rows, or after `rotate_rows`
+    rows, and a crash loses at most the rows since then. `checkpoint` closes it at once. A restarted
+    sink writes new parts.
+    """
+
+    def __init__(self, directory, schema, row_group_size=100000, compression='zstd', rotate_rows=None,
+                 checkpoint_interval=300, on_checkpoint=None):
+        """
+        :param directory: directory of the dataset, read it with `pyarrow.parquet.read_table(directory)`
+        :param schema: `pyarrow.schema` of the records, e.g. `pyarrow.schema([('word', pyarrow.string())])`
+        :param row_group_size: rows of a row group
+        :param compression: Parquet compression codec, e.g. 'zstd', 'snappy', 'gzip' or 'none'
+        :param rotate_rows: rows of a file before the next one is started, None to never rotate
+        :param checkpoint_interval: seconds before the rows written are closed into a file, None to never
+            close files by time
+        :param on_checkpoint: called after every file is closed, when all the rows written are durable
+        """
+        if pyarrow is None:
+            raise ImportError('ParquetSink requires `pip install pyarrow`')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.rotate_rows = rotate_rows
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.time()
+        self.on_checkpoint = on_checkpoint
+        self.lock = threading.Lock()
+        self.columns = {name: [] for name in schema.names}
+        self.rows = 0
+        self.file_rows = 0
+        # after the last part, even if some parts before it were deleted
+        self.index = max([int(f[5:10]) for f in os.listdir(directory) if PART.match(f)], default=-1) + 1
+        self.writer = None
+
+    def write(self, record):
+        with self.lock:
+            for name, column in self.columns.items():
+                column.append(record.get(name))
+            self.rows += 1
+            if self.rows >= self.row_group_size:
+                self._flush()
+            self._tick()
+
+    def _flush(self):
+        if self.rows == 0:
+            return
+        if self.writer is None:
+            path = os.path.join(self.directory, 'part-{:05d}.parquet'.format(self.index))
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression=self.compression)
+            self.index += 1
+        batch = pyarrow.RecordBatch.from_pydict(self.columns, schema=self.schema)
+        self.writer.write_batch(batch, row_group_size=self.rows)
+        self.columns = {name: [] for name in self.schema.names}
+        self.file_rows += self.rows
+        self.rows = 0
+        if self.rotate_rows is not None and self.file_rows >= self.rotate_rows:
+            self._close_file()
+
+    def _close_file(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.file_rows = 0
+        self.last_checkpoint = time.time()
+        if self.on_checkpoint is not None:
+            self.on_checkpoint()
+
+    def tick(self):
+        with self.lock:
+            self._tick()
+
+    def _tick(self):
+        if self.rows == 0 and self.writer is None:
+            # nothing to lose, count the interval from the next row
+            self.last_checkpoint = time.time()
+        elif self.checkpoint_interval is not None and time.time() - self.last_checkpoint > self.checkpoint_interval:
+            self._flush()
+            self._close_file()
+
+    def checkpoint(self):
+        with self.lock:
+            self._flush()
+            self._close_file()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self._close_file()
@@ -0,0 +1,222 @@
+import base64
+import datetime
+import gzip
+import hashlib
+import os
+import queue
+import threading
+import uuid
+import zlib
+from urllib.parse import urlsplit
+
+from .utils import start_thread
+
+# response headers which don't match the stored body, which is decoded
+DECODED_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length'}
+
+
+def record_id():
+    return '<urn:uuid:{}>'.format(uuid.uuid4())
+
+
+def warc_date():
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def sha1_digest(*parts):
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(part)
+    return 'sha1:' + base64.b32encode(h.digest()).decode()
+
+
+def http_headers(start_line, headers):
+    lines = [start_line] + ['{}: {}'.format(k, v) for k, v in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8', errors='replace')
+
+
+class WarcWriter:
+    """
+    Write WARC 1.0 files of request and response records. Every record is a gzip member of its own,
+    so a file can be read from any record, and is readable up to its last record if the writer dies.
+    A new file is started when the current one is larger than `max_size`.
+
+    The stored response body is decoded, so its `Content-Encoding` and `Transfer-Encoding` headers
+    are dropped and `Content-Length` is the decoded size.
+    """
+
+    def __init__(self, directory, prefix, max_size=1024 * 1024 * 1024, compress=True):
+        """
+        :param directory: directory of the WARC files
+        :param prefix: prefix of the file names, e.g. the task name and the rank
+        :param max_size: bytes of a file before the next one is started
+        :param compress: write .warc.gz files
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.max_size = max_size
+        self.compress = compress
+        self.serial = 0
+        self.file = None
+
+    def open(self):
+        name = '{}-{}-{:05d}.warc{}'.format(self.prefix, datetime.datetime.now().strftime('%Y%m%d%H%M%S'),
+                                           self.serial, '.gz' if self.compress else '')
+        self.serial += 1
+        self.file = open(os.path.join(self.directory, name), 'wb')
+        info = 'software: easy-crawler\r\nformat: WARC File Format 1.0\r\n'.encode()
+        self.write_record([('WARC-Type', 'warcinfo'), ('WARC-Filename', name),
+                           ('Content-Type', 'application/warc-fields')], [info])
+
+    def write_record(self, headers, blocks, rid=None):
+        """
+        :param headers: WARC headers, without `WARC-Record-ID`, `WARC-Date` and `Content-Length`
+        :param blocks: bytes-like parts of the record block, written without being joined
+        :param rid: WARC-Record-ID, a new one by default
+        """
+        length = sum(len(b) for b in blocks)
+        headers = [('WARC-Record-ID', rid or record_id()), ('WARC-Date', warc_date())] + headers
+        parts = [http_headers('WARC/1.0', headers + [('Content-Length', length)])] + list(blocks) + [b'\r\n\r\n']
+        if self.compress:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            for part in parts:
+                self.file.write(compressor.compress(part))
+            self.file.write(compressor.flush())
+        else:
+            for part in parts:
+                self.file.write(part)
+
+    def write(self, page):
+        """
+        Write the request and the response of a `Page`.
+        """
+        if self.file is None or self.file.tell() > self.max_size:
+            self.close()
+            self.open()
+        url = page.url
+        response_id = record_id()
+
+        if page.request_headers is not None:
+            split = urlsplit(url)
+            path = split.path or '/'
+            if split.query:
+                path += '?' + split.query
+            request = http_headers('GET {} HTTP/1.1'.format(path),
+                                   [('Host', split.netloc)] + list(page.request_headers.items()))
+            self.write_record([('WARC-Type', 'request'), ('WARC-Target-URI', url),
+                               ('WARC-Concurrent-To', response_id),
+                               ('Content-Type', 'application/http; msgtype=request')], [request])
+
+        headers = [(k, v) for k, v in page.headers.items() if k.lower() not in DECODED_HEADERS]
+        head = http_headers('HTTP/1.1 {} {}'.format(page.status_code, page.reason),
+                            headers + [('Content-Length', len(page.content))])
+        self.write_record([('WARC-Type', 'response'), ('WARC-Target-URI', url),
+                           ('WARC-Payload-Digest', sha1_digest(page.content)),
+                           ('Content-Type', 'application/http; msgtype=response')],
+                          [head, memoryview(page.content)], response_id)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class AsyncWarcWriter:
+    """
+    Write pages in a dedicated thread, so archiving doesn't slow down fetching. Pages are queued by
+    reference and written in batches. `write` blocks when `max_queue` pages are waiting.
+    """
+
+    def __init__(self, writer, max_queue=1000, batch_size=64):
+        self.writer = writer
+        self.queue = queue.Queue(max_queue)
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        start_thread(self.run)
+
+    def write(self, page):
+        self.queue.put(page)
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self.lock:
+                for page in batch:
+                    try:
+                        self.writer.write(page)
+                    except Exception as e:
+                        self.log("Failed to archive {}: {}".format(page.url, e), 'ERR')
+                self.writer.flush()
+            for _ in batch:
+                self.queue.task_done()
+
+    def close(self):
+        self.queue.join()
+        with self.lock:
+            self.writer.close()
+
+    def log(self, msg, level='INFO'):
+        print("| {} <WarcWriter>: {}".format(level, msg))
+
+
+class WarcRecord:
+    __slots__ = ['type', 'headers', 'content']
+
+    def __init__(self, type, headers, content):
+        """
+        :param type: WARC-Type
+        :param headers: WARC headers
+        :param content: record block
+        """
+        self.type = type
+        self.headers = headers
+        self.content = content
+
+    def http(self):
+        """
+        :return: start line, headers and body of a request or response record
+        """
+        head, _, body = self.content.partition(b'\r\n\r\n')
+        lines = head.decode('utf-8', errors='replace').split('\r\n')
+        headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+        return lines[0], headers, body
+
+
+def read_warc(path):
+    """
+    Iterate over the records of a WARC file lazily, one record in memory at a time. A file whose
+    writer died is read up to its last complete record.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        try:
+            while True:
+                line = f.readline()
+                if line == b'':
+                    return
+                if line.strip() == b'':
+                    continue
+                headers = {}
+                for line in iter(f.readline, b'\r\n'):
+                    if line == b'':
+                        return
+                    k, _, v = line.decode('utf-8').partition(':')
+                    headers[k] = v.strip()
+                length = int(headers['Content-Length'])
+                content = f.read(length)
+                if len(content) < length:
+                    return
+                yield WarcRecord(headers.get('WARC-Type'), headers, content)
+        except EOFError:
+            # the last gzip member is truncated
+            return
@@ -5,9 +5,11 @@ import random
 import re
 import string
 
-import time
 import yaml
 from core.crawler import Crawler
+from core.dedup import FingerprintSet
+from core.response_store import digest
+from core.sinks import SUFFIXES, LineSink, ParquetSink, sink_files
 
 
 class DictCrawler(Crawler):
@@ -24,22 +26,28 @@ class DictCrawler(Crawler):
         src = args['src']
         tgt = args['tgt']
         output_dir = args['output_dir']
-        fn, dict_fn, phrase_fn = DictCrawler.make_fn(src, tgt)
+        if args.get('reparse', False) and not args.get('restart', False):
+            # the lines in the outputs and their `.seen` fingerprints would make every parsed line a duplicate
+            raise ValueError('Reparse rebuilds the outputs, pass restart=True to back up the current ones.')
         if args.get('restart', False):
-            try:
-                os.rename(output_dir + '/' + phrase_fn,
-                          output_dir + '/' + phrase_fn + str(datetime.datetime.now().timestamp()) + ".bak")
-                os.rename(output_dir + '/' + dict_fn,
-                          output_dir + '/' + dict_fn + str(datetime.datetime.now().timestamp()) + ".bak")
-            except:
-                pass
+            fn, dict_fn, phrase_fn = DictCrawler.make_fn(src, tgt)
+            for kind in ['dict', 'phrase']:
+                if args.get('output_format', 'text') == 'parquet':
+                    names = [output_dir + '/' + DictCrawler.output_name(args, kind)]
+                else:
+                    # every rotated part and the checkpoint too, or they would be mixed with the new output
+                    names = sink_files(output_dir + '/' + (dict_fn if kind == 'dict' else phrase_fn))
+                for name in names:
+                    try:
+                        os.rename(name, name + str(datetime.datetime.now().timestamp()) + ".bak")
+                    except:
+                        pass
+                for path in [DictCrawler.seen_path(args, kind), DictCrawler.seen_path(args, kind) + '.undo']:
+                    if os.path.exists(path):
+                        os.remove(path)
         os.makedirs(output_dir, exist_ok=True)
-        context['files'] = {
-            dict_fn: open(output_dir + "/" + dict_fn, 'a', encoding='utf-8'),
-            phrase_fn: open(output_dir + "/" + phrase_fn, 'a', encoding='utf-8')
-        }
-
-        context['unique_phrases'] = set()
+        if args.get('collectors', 0) == 0:
+            DictCrawler.open_outputs(context, args, ['dict', 'phrase'])
 
         base = '/%s/%s/' % (src, tgt)
         start_list = [base] + [base + str(i) for i in range(0, 10)] + [base + i for i in string.ascii_lowercase]
@@ -70,21 +78,21 @@ class DictCrawler(Crawler):
         for u in new_urls:
             self.add_job(u, front=True)
 
-        fn, dict_fn, phrase_fn = self.make_fn(src_lang, tgt_lang)
-
         src_word = soup.select("#phraseHeaderId span")
         if len(src_word) > 0:
             src_word = src_word[0].text.strip()
-            tgt_words = '|'.join([p.text.strip() for p in soup.select(".text-info strong")])
-            if tgt_words != "":
-                self.add_result((dict_fn, "%s |||| %s\n" % (src_word, tgt_words)))
+            tgt_words = [p.text.strip() for p in soup.select(".text-info strong")]
+            if '|'.join(tgt_words) != "":
+                self.add_result(('dict', {'src_lang': src_lang, 'tgt_lang': tgt_lang, 'word': src_word,
+                                          'translations': tgt_words}))
 
         phr_rows = soup.select('#translationExamples .tableRow')
         if len(phr_rows) > 0:
             for row in phr_rows:
                 src_phr = row.select('div')[0].select('span span')[0].text.strip()
                 tgt_phr = row.select('div')[1].select('span span')[0].text.strip()
-                self.add_result((phrase_fn, "%s |||| %s\n" % (src_phr, tgt_phr)))
+                self.add_result(('phrase', {'src_lang': src_lang, 'tgt_lang': tgt_lang, 'src': src_phr,
+                                            'tgt': tgt_phr}))
                 if runtime_context['seed_num'] > 0:
                     runtime_context['seed_num'] -= 1
 
@@ -95,12 +103,75 @@ class DictCrawler(Crawler):
                         seed = "%s/%s/%s" % (src_lang, tgt_lang, c)
                         self.add_job(seed)
 
+    @staticmethod
+    def output_name(args, kind):
+        fn, dict_fn, phrase_fn = DictCrawler.make_fn(args['src'], args['tgt'])
+        if args.get('output_format', 'text') == 'parquet':
+            return fn + '_' + kind
+        return (dict_fn if kind == 'dict' else phrase_fn) + SUFFIXES[args.get('compression', None)]
+
+    @staticmethod
+    def seen_path(args, kind):
+        # fingerprints of the written lines, kept across restarts
+        return "%s/%s.%s.seen" % (args['output_dir'], DictCrawler.make_fn(args['src'], args['tgt'])[0], kind)
+
+    @staticmethod
+    def open_outputs(context, args, kinds):
+        output_dir = args['output_dir']
+        fn, dict_fn, phrase_fn = DictCrawler.make_fn(args['src'], args['tgt'])
+        context['sinks'] = {}
+        # the fingerprints are committed with the output they deduplicate, and rolled back with it
+        # after a crash, so the lines lost since the last checkpoint aren't taken as duplicates
+        context['unique_phrases'] = {kind: FingerprintSet(DictCrawler.seen_path(args, kind), undo_log=True)
+                                     for kind in kinds}
+        if args.get('output_format', 'text') == 'parquet':
+            import pyarrow as pa
+            schemas = {
+                'dict': pa.schema([('src_lang', pa.string()), ('tgt_lang', pa.string()), ('word', pa.string()),
+                                   ('translations', pa.list_(pa.string()))]),
+                'phrase': pa.schema([('src_lang', pa.string()), ('tgt_lang', pa.string()), ('src', pa.string()),
+                                     ('tgt', pa.string())]),
+            }
+            for kind in kinds:
+                context['sinks'][kind] = ParquetSink(output_dir + "/" + DictCrawler.output_name(args, kind),
+                                                     schemas[kind], row_group_size=args.get('row_group_size', 100000),
+                                                     compression=args.get('parquet_compression', 'zstd'),
+                                                     on_checkpoint=context['unique_phrases'][kind].checkpoint)
+        else:
+            for kind in kinds:
+                context['sinks'][kind] = LineSink(output_dir + "/" + (dict_fn if kind == 'dict' else phrase_fn),
+                                                  compression=args.get('compression', None),
+                                                  rotate_size=args.get('rotate_size', None),
+                                                  overwrite=args.get('restart', False),
+                                                  on_checkpoint=context['unique_phrases'][kind].checkpoint)
+
+    @staticmethod
+    def shard_key(result):
+        # dict and phrase results are written to different files
+        return 0 if result[0] == 'dict' else 1
+
+    @staticmethod
+    def prepare_collector(context, args, shard, shards):
+        DictCrawler.open_outputs(context, args, [k for k in ['dict', 'phrase']
+                                                 if DictCrawler.shard_key((k,)) % shards == shard])
+
+    @staticmethod
+    def collector_stats(context):
+        return {'unique phrases': sum(len(s) for s in context['unique_phrases'].values())}
+
     @staticmethod
     def collect_results(context, result):
-        file = context['files'][result[0]]
-        if result[1] not in context['unique_phrases']:
-            file.write(result[1])
-            context['unique_phrases'].add(result[1])
+        kind, record = result
+        line = DictCrawler.format_line(kind, record)
+        if context['unique_phrases'][kind].add(line):
+            sink = context['sinks'][kind]
+            sink.write(line if isinstance(sink, LineSink) else record)
+
+    @staticmethod
+    def format_line(kind, record):
+        if kind == 'dict':
+            return "%s |||| %s\n" % (record['word'], '|'.join(record['translations']))
+        return "%s |||| %s\n" % (record['src'], record['tgt'])
 
     @staticmethod
     def make_fn(src, tgt):
@@ -109,11 +180,19 @@ class DictCrawler(Crawler):
 
     @staticmethod
     def monitor(context, time_escape, last_stats):
+        if 'collectors' in context:
+            unique = sum(c.get('unique phrases', 0) for c in context['collectors'].values())
+        else:
+            unique = DictCrawler.collector_stats(context)['unique phrases']
         return {
-                   'unique phrases': len(context['unique_phrases']),
+                   'unique phrases': unique,
                    'real time speed (phrases/sec)':
-                       round((len(context['unique_phrases']) - last_stats.get('unique phrases', 0)) / time_escape, 2)
-               }, len(context['unique_phrases']) == last_stats.get('unique phrases', 0)
+                       round((unique - last_stats.get('unique phrases', 0)) / time_escape, 2)
+               }, unique == last_stats.get('unique phrases', 0)
+
+    def memo_key(self, url, page):
+        # the results carry the language pair of the url, and the pagination links are relative to its path
+        return digest(self.clean_url(url).split('?')[0].encode() + b' ' + page.content)
 
     def _get_lang(self, url):
         url = self.clean_url(url)
@@ -136,9 +215,9 @@ class DictCrawler(Crawler):
         if res.status_code not in [500, 502]:
             return 1
         else:
-            self.log("{} got in {}. Sleep 60s.".format(res.status_code, res.url), "WARN")
-            time.sleep(60)
-            return 0
+            # give up now, the url will be retried later with backoff
+            self.log("{} got in {}. Retry later.".format(res.status_code, res.url), "WARN")
+            return 10
 
 
 if __name__ == "__main__":
@@ -167,6 +246,9 @@ if __name__ == "__main__":
                 tgt=tgt,
                 seed_list=seed_list,
                 seed_num=10000,
+                output_format=config.get('output_format', 'text'),
+                compression=config.get('compression', None),
+                rotate_size=config.get('rotate_size', None),
             )
 
 
@@ -2,6 +2,8 @@ import os
 import re
 from bs4 import BeautifulSoup
 from core.crawler import Crawler
+from core.response_store import digest
+from core.sinks import CsvSink
 
 
 class GlosbeStatsCrawler(Crawler):
@@ -29,24 +31,41 @@ class GlosbeStatsCrawler(Crawler):
                 if lng1 != lng2:
                     urls.append("/%s/%s" % (lng1, lng2))
 
-        if os.path.exists('outputs/stats.csv') and not args.get('restart', False):
-            context['file'] = open('outputs/stats.csv', 'a', encoding='utf-8')
-        else:
-            context['file'] = open('outputs/stats.csv', 'w', encoding='utf-8')
-            context['file'].write("src,tgt,#dict,#phrase\n")
+        if not os.path.exists('outputs/stats.csv'):
             args['restart'] = True
+        if args.get('collectors', 0) == 0:
+            GlosbeStatsCrawler.open_outputs(context, args)
         return urls
 
+    @staticmethod
+    def open_outputs(context, args):
+        context['sinks'] = {
+            'stats': CsvSink('outputs/stats.csv', ['src', 'tgt', '#dict', '#phrase'], overwrite=args.get('restart', False))
+        }
+
+    @staticmethod
+    def shard_key(result):
+        # a single output file, written by the first collector
+        return 0
+
+    @staticmethod
+    def prepare_collector(context, args, shard, shards):
+        if shard == 0:
+            GlosbeStatsCrawler.open_outputs(context, args)
+
     def parse(self, runtime_context, soup, url):
         src_lang, tgt_lang, langs = self._get_lang(url)
         stats = soup.select(".dictionaryWelcomePage p")[4].text.strip()
         stats = re.findall("[\d,]+", stats)
-        self.add_result(
-            "%s,%s,%s,%s\n" % (src_lang, tgt_lang, stats[0].replace(",", ""), stats[1].replace(",", "")))
+        self.add_result((src_lang, tgt_lang, stats[0].replace(",", ""), stats[1].replace(",", "")))
 
     @staticmethod
     def collect_results(context, result):
-        context['file'].write(result)
+        context['sinks']['stats'].write(result)
+
+    def memo_key(self, url, page):
+        # the results carry the language pair of the url
+        return digest(self._get_lang(url)[2].encode() + b' ' + page.content)
 
     def clean_url(self, url):
         return self._clean_url(url)
@@ -0,0 +1,67 @@
+import collections
+import threading
+import time
+from queue import Empty
+
+from core.proxy_broker import ProxyBrokerClient
+from core.proxy_pool import ProxyPool, register_proxy_pool
+from core.utils import start_thread
+
+
+@register_proxy_pool("broker")
+class BrokerProxyPool(ProxyPool):
+    """
+    Lease proxies from a shared proxy broker. Start it first:
+    `export PYTHONPATH=. && python -m core.proxy_broker --proxy_pool mixed`
+
+    Leases are held from `get_proxy` until the feedback of the proxy, including while the proxy
+    waits in the proxy queue of the scheduler. So only `broker_prefetch` proxies are queued, and
+    held leases are renewed until they are released.
+    """
+
+    def __init__(self, redis_db, args=None):
+        super().__init__(redis_db, args)
+        self.client = ProxyBrokerClient(redis_db, args.get('broker', 'proxy_broker'),
+                                        client_id="%s@%s" % (args['task_name'], id(self)))
+        self.leases = collections.defaultdict(collections.deque)
+        self.lock = threading.Lock()
+        self.prefetch = args.get('broker_prefetch', 20)
+        start_thread(self.renew_leases)
+
+    def collect_proxies(self):
+        pass
+
+    def shuffle_proxies(self):
+        pass
+
+    def get_proxy(self, timeout=5):
+        """
+        :raise Empty: if the broker has no proxy for this client within `timeout` seconds
+        """
+        deadline = time.time() + timeout
+        lease = self.client.acquire()
+        while lease is None:
+            if time.time() > deadline:
+                raise Empty
+            time.sleep(0.2)
+            lease = self.client.acquire()
+        proxy = self.client.proxy_of(lease)
+        with self.lock:
+            self.leases[proxy].append(lease)
+        return proxy
+
+    def feedback_proxy(self, proxy, level=0):
+        with self.lock:
+            leases = self.leases.get(proxy)
+            lease = leases.popleft() if leases else None
+            if leases is not None and len(leases) == 0:
+                del self.leases[proxy]
+        if lease is not None:
+            self.client.release(lease, level)
+
+    def renew_leases(self):
+        while True:
+            time.sleep(self.client.lease_ttl / 3)
+            with self.lock:
+                leases = [lease for queue in self.leases.values() for lease in queue]
+            self.client.renew(leases)
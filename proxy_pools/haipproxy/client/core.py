@@ -1,4 +1,5 @@
 import time
+import uuid
 
 
 def decode_all(res):
@@ -6,10 +7,66 @@ def decode_all(res):
     return list(map(bytes.decode, res))
 
 
+# KEYS: score queue, ttl queue, speed queue, shared result cache, client snapshot
+# ARGV: lowest score, ttl start time, longest response time (ms), min pool size, cache ttl (ms), snapshot ttl (s)
+# return: {added, removed, full}, `full` is 1 when the client snapshot was missing and `added` is the whole set
+AVAILABLE_PROXIES_SCRIPT = """
+local function sadd_all(key, list)
+    for i = 1, #list, 5000 do
+        redis.call('SADD', key, unpack(list, i, math.min(i + 4999, #list)))
+    end
+end
+
+if redis.call('EXISTS', KEYS[4]) == 0 then
+    local scored_list = redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[1], '+inf')
+    local ttl_list = redis.call('ZRANGEBYSCORE', KEYS[2], ARGV[2], '+inf')
+    local speed_list = redis.call('ZRANGEBYSCORE', KEYS[3], 0, ARGV[3])
+    local min_size = 2 * tonumber(ARGV[4])
+    local scored, ttl = {}, {}
+    for _, p in ipairs(scored_list) do scored[p] = true end
+    for _, p in ipairs(ttl_list) do ttl[p] = true end
+
+    local result = {}
+    for _, p in ipairs(speed_list) do
+        if scored[p] and ttl[p] then table.insert(result, p) end
+    end
+    if #result < min_size then
+        result = {}
+        for _, p in ipairs(speed_list) do
+            if ttl[p] then table.insert(result, p) end
+        end
+    end
+    if #result < min_size then
+        result = ttl_list
+        for _, p in ipairs(scored_list) do
+            if not ttl[p] then table.insert(result, p) end
+        end
+    end
+    if #result > 0 then
+        sadd_all(KEYS[4], result)
+        redis.call('PEXPIRE', KEYS[4], ARGV[5])
+    end
+end
+
+local full = redis.call('EXISTS', KEYS[5]) == 0 and 1 or 0
+local added = redis.call('SDIFF', KEYS[4], KEYS[5])
+local removed = redis.call('SDIFF', KEYS[5], KEYS[4])
+if #added > 0 or #removed > 0 then
+    redis.call('SUNIONSTORE', KEYS[5], KEYS[4])
+end
+redis.call('EXPIRE', KEYS[5], ARGV[6])
+return {added, removed, full}
+"""
+
+
 class IPFetcherMixin:
     def __init__(self, score_queue, ttl_queue, speed_queue,
                  longest_response_time, lowest_score, ttl_validated_resource,
-                 min_pool_size):
+                 min_pool_size, cache_ttl=1, snapshot_ttl=60):
+        """
+        :param cache_ttl: seconds the server side intersection is cached and shared by all clients
+        :param snapshot_ttl: seconds the server keeps the snapshot of this client after its last query
+        """
         self.score_queue = score_queue
         self.ttl_queue = ttl_queue
         self.speed_queue = speed_queue
@@ -17,22 +74,37 @@ class IPFetcherMixin:
         self.lowest_score = lowest_score
         self.ttl_validated_resource = ttl_validated_resource
         self.min_pool_size = min_pool_size
+        self.cache_ttl = cache_ttl
+        self.snapshot_ttl = snapshot_ttl
+        self.cache_key = 'haipproxy:available:{}:{}:{}:{}:{}'.format(
+            speed_queue, lowest_score, longest_response_time, ttl_validated_resource, min_pool_size)
+        self.snapshot_key = 'haipproxy:client:' + uuid.uuid4().hex
+        self.available_proxies = set()
+        self._script = None
 
     def get_available_proxies(self, conn):
         """core algrithm to get proxies from redis"""
+        self.get_available_proxies_delta(conn)
+        return list(self.available_proxies)
+
+    def get_available_proxies_delta(self, conn):
+        """
+        Run the intersection on the redis server and only transfer the proxies which are
+        added or removed since last call. `self.available_proxies` is kept up to date.
+        :return: added proxies, removed proxies
+        """
+        if self._script is None:
+            self._script = conn.register_script(AVAILABLE_PROXIES_SCRIPT)
         start_time = int(time.time()) - self.ttl_validated_resource * 60
-        pipe = conn.pipeline(False)
-        pipe.zrevrangebyscore(self.score_queue, '+inf', self.lowest_score)
-        pipe.zrevrangebyscore(self.ttl_queue, '+inf', start_time)
-        pipe.zrangebyscore(self.speed_queue, 0, 1000 * self.longest_response_time)
-        scored_proxies, ttl_proxies, speed_proxies = pipe.execute()
-        scored_proxies, ttl_proxies, speed_proxies = set(scored_proxies), set(ttl_proxies), set(speed_proxies)
-
-        proxies = scored_proxies & ttl_proxies & speed_proxies
-        if not proxies or len(proxies) < self.min_pool_size * 2:
-            proxies = ttl_proxies & speed_proxies
-        if not proxies or len(proxies) < self.min_pool_size * 2:
-            proxies = ttl_proxies | scored_proxies
-        proxies = decode_all(proxies)
-
-        return proxies
+        added, removed, full = self._script(
+            keys=[self.score_queue, self.ttl_queue, self.speed_queue, self.cache_key, self.snapshot_key],
+            args=[self.lowest_score, start_time, 1000 * self.longest_response_time,
+                  self.min_pool_size, int(self.cache_ttl * 1000), self.snapshot_ttl])
+        added, removed = decode_all(added), decode_all(removed)
+        if full:
+            removed = list(self.available_proxies.difference(added))
+            self.available_proxies = set(added)
+        else:
+            self.available_proxies.difference_update(removed)
+            self.available_proxies.update(added)
+        return added, removed
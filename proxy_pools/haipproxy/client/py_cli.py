@@ -1,8 +1,11 @@
 """
 python client for haipproxy
 """
+import itertools
 import time
 import threading
+from collections import deque
+
 from ..config.rules import (
     SCORE_MAPS, TTL_MAPS,
     SPEED_MAPS)
@@ -12,9 +15,75 @@ from ..config.settings import (
     DATA_ALL)
 from .core import IPFetcherMixin
 
-__all__ = ['ProxyFetcher']
+__all__ = ['ProxyFetcher', 'ProxyRing']
+
+
+class ProxyRing:
+    """
+    FIFO ring of unique proxies.
+
+    Rotation, membership tests and removal are all O(1): removed proxies are only
+    dropped from the index and their stale queue entries are skipped lazily.
+    Every mutation should be done while holding `lock`.
+    """
+
+    def __init__(self, maxlen=None):
+        self.maxlen = maxlen
+        self.lock = threading.RLock()
+        self._queue = deque()  # (proxy, token)
+        self._index = {}  # proxy -> token of its live queue entry
+        self._token = itertools.count()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, proxy):
+        return proxy in self._index
+
+    def __iter__(self):
+        return (p for p, token in list(self._queue) if self._index.get(p) == token)
+
+    def add(self, proxy):
+        """append a proxy to the tail, return False if it is a duplicate or the ring is full"""
+        if proxy in self._index or (self.maxlen is not None and len(self._index) >= self.maxlen):
+            return False
+        token = next(self._token)
+        self._index[proxy] = token
+        self._queue.append((proxy, token))
+        return True
+
+    def extend(self, proxies):
+        """:return: number of new proxies"""
+        return sum(self.add(p) for p in proxies)
+
+    def discard(self, proxy):
+        if self._index.pop(proxy, None) is not None:
+            self._compact()
+
+    def first(self):
+        """the head proxy, or None if the ring is empty"""
+        queue = self._queue
+        while queue and self._index.get(queue[0][0]) != queue[0][1]:
+            queue.popleft()
+        return queue[0][0] if queue else None
+
+    def last(self):
+        queue = self._queue
+        while queue and self._index.get(queue[-1][0]) != queue[-1][1]:
+            queue.pop()
+        return queue[-1][0] if queue else None
+
+    def rotate(self):
+        """move the head proxy to the tail and return it"""
+        proxy = self.first()
+        if proxy is not None:
+            self._queue.append(self._queue.popleft())
+        return proxy
 
-lock = threading.RLock()
+    def _compact(self):
+        # drop stale entries once they outnumber live ones, so the queue stays O(len(self))
+        if len(self._queue) > 2 * len(self._index) + 64:
+            self._queue = deque((p, t) for p, t in self._queue if self._index.get(p) == t)
 
 
 class Strategy:
@@ -25,7 +94,7 @@ class Strategy:
 
     def get_proxies_by_stragery(self, pool):
         """
-        :param pool: pool is a list, which is mutable
+        :param pool: pool is a ProxyRing, which is mutable
         :return:
         """
         raise NotImplementedError
@@ -47,19 +116,13 @@ class RobinStrategy(Strategy):
         self.strategy = 'robin'
 
     def get_proxies_by_stragery(self, pool):
-        if not pool:
-            return None
-
-        proxy = pool.pop(0)
-        pool.append(proxy)
-        return proxy
+        with pool.lock:
+            return pool.rotate()
 
     def process_feedback(self, pool, res, proxy, **kwargs):
         if res == 'failure':
-            if pool[-1] == proxy:
-                with lock:
-                    if pool[-1] == proxy:
-                        pool.pop()
+            with pool.lock:
+                pool.discard(proxy)
         return
 
 
@@ -68,22 +131,21 @@ class GreedyStrategy(Strategy):
         self.strategy = 'greedy'
 
     def get_proxies_by_stragery(self, pool):
-        if not pool:
-            return None
-        return pool[0]
+        with pool.lock:
+            return pool.first()
 
     def process_feedback(self, pool, res, proxy, **kwargs):
-        if res == 'failure':
-            if pool[0] == proxy:
-                with lock:
-                    if pool[0] == proxy:
-                        pool.pop(0)
-            return
-        expected_time = kwargs.get('expected')
-        real_time = kwargs.get('real')
-        if expected_time * 1000 < real_time:
-            pool.pop(0)
-            pool.append(proxy)
+        with pool.lock:
+            if pool.first() != proxy:
+                # someone else has already given feedback on this proxy
+                return
+            if res == 'failure':
+                pool.discard(proxy)
+                return
+            expected_time = kwargs.get('expected')
+            real_time = kwargs.get('real')
+            if real_time is not None and expected_time * 1000 < real_time:
+                pool.rotate()
 
 
 class ProxyFetcher(IPFetcherMixin):
@@ -91,7 +153,7 @@ class ProxyFetcher(IPFetcherMixin):
                  score_map=SCORE_MAPS, ttl_map=TTL_MAPS, speed_map=SPEED_MAPS,
                  longest_response_time=LONGEST_RESPONSE_TIME, lowest_score=LOWEST_SCORE,
                  ttl_validated_resource=TTL_VALIDATED_RESOURCE, min_pool_size=LOWEST_TOTAL_PROXIES,
-                 all_data=DATA_ALL, redis_conn=None):
+                 max_pool_size=None, all_data=DATA_ALL, redis_conn=None):
         """
         :param usage: one of SCORE_MAPS's keys, such as https
         :param strategy: the load balance of proxy ip, the value is
@@ -103,6 +165,7 @@ class ProxyFetcher(IPFetcherMixin):
         :param speed_map: speed map of your project, default value is SPEED_MAPS in haipproxy.config.settings
         :param ttl_validated_resource: time of latest validated proxies
         :param min_pool_size: min pool size of self.pool
+        :param max_pool_size: max pool size of self.pool, default is 4 * min_pool_size
         :param all_data: all proxies are stored in this set
         :param redis_conn: redis connetion args, it's a dict, whose keys include host, port, db and password
         """
@@ -116,8 +179,10 @@ class ProxyFetcher(IPFetcherMixin):
         super().__init__(score_queue, ttl_queue, speed_queue, longest_response_time,
                          lowest_score, ttl_validated_resource, min_pool_size)
         self.strategy = strategy
-        # pool is a FIFO queue
-        self.pool = list()
+        # pool is a FIFO queue without duplicates
+        self.pool = ProxyRing(max_pool_size or 4 * min_pool_size)
+        # serializes the delta fetches, which keep `available_proxies` in step with redis
+        self.fetch_lock = threading.Lock()
         self.min_pool_size = min_pool_size
         self.fast_response = fast_response
         self.all_data = all_data
@@ -140,12 +205,16 @@ class ProxyFetcher(IPFetcherMixin):
         return proxy
 
     def get_proxies(self):
-        # the older proxies will not be dropped
-        proxies = self.get_available_proxies(self.conn)
-        # client_logger.info('{} proxies have been fetched'.format(len(proxies)))
-        # print('{} proxies have been fetched'.format(len(proxies)))
-        self.pool.extend(proxies)
-        return self.pool
+        # only the proxies added or removed since last call are transferred from redis.
+        # the pool is locked only to apply them, so get_proxy and feedback don't wait for redis
+        with self.fetch_lock:
+            added, removed = self.get_available_proxies_delta(self.conn)
+            with self.pool.lock:
+                for p in removed:
+                    self.pool.discard(p)
+                # proxies dropped by feedback are refilled from the local copy once the pool runs low
+                self.pool.extend(added if len(self.pool) >= self.min_pool_size else self.available_proxies)
+                return list(self.pool)
 
     def proxy_feedback(self, res, proxy, response_time=None):
         """
@@ -0,0 +1,33 @@
+import unittest
+
+from core.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.b = CircuitBreaker(window=10, min_samples=5, failure_ratio=0.5, open_seconds=1, probe_interval=0.5)
+
+    def test_trip_and_recover(self):
+        for _ in range(4):
+            self.assertFalse(self.b.record(False, now=100))
+        self.assertTrue(self.b.record(False, now=100))
+        self.assertEqual(self.b.state, OPEN)
+        self.assertAlmostEqual(self.b.wait_time(now=100.5), 0.5)
+
+        self.assertEqual(self.b.wait_time(now=101), 0)
+        self.assertEqual(self.b.state, HALF_OPEN)
+        self.assertAlmostEqual(self.b.wait_time(now=101.2), 0.3)
+        self.b.record(True, now=101.3)
+        self.assertEqual(self.b.state, CLOSED)
+
+    def test_failed_probe_backs_off(self):
+        for _ in range(5):
+            self.b.record(False, now=100)
+        self.b.wait_time(now=101)
+        self.assertTrue(self.b.record(False, now=101.1))
+        self.assertEqual(self.b.state, OPEN)
+        self.assertAlmostEqual(self.b.wait_time(now=101.1), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
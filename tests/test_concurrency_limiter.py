@@ -0,0 +1,57 @@
+import threading
+import unittest
+
+from core.concurrency_limiter import AdaptiveConcurrencyLimiter
+
+
+class TestAdaptiveConcurrencyLimiter(unittest.TestCase):
+    @staticmethod
+    def round(limiter, rtt, dropped=False):
+        # fill the limit, then release every request with the given latency
+        starts = [limiter.acquire() for _ in range(int(limiter.limit))]
+        for start in starts:
+            limiter.release(start - rtt, dropped=dropped)
+
+    def test_grow_while_stable(self):
+        limiter = AdaptiveConcurrencyLimiter(100, initial_limit=10)
+        for _ in range(20):
+            self.round(limiter, 0.1)
+        self.assertEqual(limiter.limit, 100)
+
+    def test_shrink_on_latency(self):
+        limiter = AdaptiveConcurrencyLimiter(100)
+        for _ in range(20):
+            self.round(limiter, 0.1)
+        for _ in range(5):
+            self.round(limiter, 1)
+        self.assertLess(limiter.limit, 50)
+
+    def test_shrink_on_drops(self):
+        limiter = AdaptiveConcurrencyLimiter(100, initial_limit=50, smoothing=1)
+        limiter.release(limiter.acquire(), dropped=True)
+        self.assertAlmostEqual(limiter.limit, 45)
+        # failures unrelated to the target host leave it unchanged
+        limiter.release(limiter.acquire(), sample=False)
+        self.assertAlmostEqual(limiter.limit, 45)
+
+    def test_app_limited(self):
+        limiter = AdaptiveConcurrencyLimiter(100, initial_limit=50)
+        limiter.release(limiter.acquire() - 0.1)
+        for _ in range(20):
+            limiter.release(limiter.acquire() - 1)
+        self.assertEqual(limiter.limit, 50)
+
+    def test_block_at_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(1)
+        start = limiter.acquire()
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: limiter.acquire() and acquired.set())
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release(start, sample=False)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+
+from core.dedup import FingerprintSet
+
+
+class TestFingerprintSet(unittest.TestCase):
+    def test_add(self):
+        seen = FingerprintSet(capacity=8)
+        self.assertEqual([seen.add(str(i % 50)) for i in range(100)], [True] * 50 + [False] * 50)
+        self.assertEqual(len(seen), 50)
+        self.assertIn('1', seen)
+        self.assertNotIn('50', seen)
+
+    def test_persist(self):
+        path = os.path.join(tempfile.mkdtemp(), 'seen')
+        seen = FingerprintSet(path, fingerprint_size=16, capacity=8)
+        for i in range(100):
+            seen.add('line %d' % i)
+        seen.close()
+        seen = FingerprintSet(path, fingerprint_size=16)
+        self.assertEqual(len(seen), 100)
+        self.assertFalse(seen.add('line 99'))
+        self.assertTrue(seen.add('line 100'))
+        seen.close()
+
+    def test_rollback(self):
+        path = os.path.join(tempfile.mkdtemp(), 'seen')
+        seen = FingerprintSet(path, capacity=8, undo_log=True)
+        for i in range(100):
+            seen.add('line %d' % i)
+        seen.checkpoint()
+        for i in range(100, 200):
+            seen.add('line %d' % i)
+        # crash without closing, the fingerprints after the checkpoint are removed on open
+        seen = FingerprintSet(path, undo_log=True)
+        self.assertEqual(len(seen), 100)
+        self.assertIn('line 99', seen)
+        self.assertTrue(all(seen.add('line %d' % i) for i in range(100, 200)))
+        seen.close()
@@ -0,0 +1,64 @@
+import time
+import unittest
+from queue import Queue
+from unittest import mock
+
+import fakeredis
+
+from core.crawler import Crawler
+
+
+class MockCrawler(Crawler):
+    @property
+    def base_url(self):
+        return 'https://www.mock.com'
+
+    def parse(self, runtime_context, soup, url):
+        pass
+
+
+class TestDelayedJobs(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        self.q_log = Queue()
+        with mock.patch('redis.StrictRedis', return_value=self.redis):
+            self.crawler = MockCrawler('mock', [], [Queue()], Queue(), self.q_log, Queue(), Queue(), 0, 1, False, {},
+                                       {'retry_base_delay': 10, 'retry_max_delay': 60, 'max_retry': 3})
+
+    def delays(self):
+        now = time.time()
+        return [(job.decode(), score - now) for job, score in self.redis.zrange('mock_delayed', 0, -1, withscores=True)]
+
+    def test_backoff(self):
+        self.crawler.delay_job('/a', 1)
+        self.crawler.delay_job('/b', 3)
+        self.crawler.delay_job('/c', 10)
+        (a, delay_a), (b, delay_b), (c, delay_c) = sorted(self.delays())
+        self.assertEqual((a, b, c), ("('/a', 1)", "('/b', 3)", "('/c', 10)"))
+        # base * 2 ** (retry - 1), capped and jittered by 0.5 - 1.5
+        self.assertTrue(5 <= delay_a <= 15)
+        self.assertTrue(20 <= delay_b <= 60)
+        self.assertTrue(30 <= delay_c <= 90)
+
+    def test_promote(self):
+        self.redis.lpush('mock_todo', '/queued')
+        self.redis.zadd('mock_delayed', {"('/due', 1)": time.time() - 1, "('/later', 1)": time.time() + 60})
+        self.assertEqual(self.crawler._promote(keys=['mock_delayed', 'mock_todo'], args=[time.time(), 10]), 1)
+        self.assertEqual([j.decode() for j in self.redis.zrange('mock_delayed', 0, -1)], ["('/later', 1)"])
+        # due jobs go to the tail of the todo list, with their retry count
+        self.assertEqual(self.crawler.pop_job(), ('/queued', 0))
+        self.assertEqual(self.crawler.pop_job(), ('/due', 1))
+
+    def test_failed_job(self):
+        self.crawler.scrap_done(None, ('/a', 0))
+        self.assertEqual([job for job, _ in self.delays()], ["('/a', 1)"])
+        self.crawler.crawled.add('/b')
+        self.crawler.scrap_done(None, ('/b', 3))
+        # out of retries
+        self.assertEqual(len(self.delays()), 1)
+        self.assertNotIn('/b', self.crawler.crawled)
+        self.assertEqual(self.redis.scard('mock_doing'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
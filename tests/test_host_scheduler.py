@@ -0,0 +1,29 @@
+import time
+import unittest
+
+from core.host_scheduler import HostScheduler
+
+
+class TestHostScheduler(unittest.TestCase):
+    def test_throttled_host_does_not_block_others(self):
+        h = HostScheduler({'slow.com': {'rate': 10, 'burst': 1}})
+        for i in range(3):
+            h.put('slow.com', i)
+            h.put('fast.com', i)
+        t = time.time()
+        jobs = [h.get()[:2] for _ in range(4)]
+        self.assertLess(time.time() - t, 0.05)
+        self.assertEqual([j for j in jobs if j[0] == 'fast.com'], [('fast.com', 0), ('fast.com', 1), ('fast.com', 2)])
+        self.assertEqual(h.get()[:2], ('slow.com', 1))
+        self.assertGreater(time.time() - t, 0.08)
+
+    def test_max_parked(self):
+        h = HostScheduler(max_parked=1)
+        self.assertTrue(h.put('a.com', 0))
+        self.assertFalse(h.put('a.com', 1))
+        self.assertTrue(h.put('b.com', 0))
+        self.assertEqual(h.qsize(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
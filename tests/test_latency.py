@@ -0,0 +1,32 @@
+import random
+import unittest
+
+from core.latency import AdaptiveTimeouts
+
+
+class TestAdaptiveTimeouts(unittest.TestCase):
+    def test_timeouts_of_dead_proxies(self):
+        timeouts = AdaptiveTimeouts(floor=0)
+        rand = random.Random(0)
+        for i in range(5000):
+            proxy = 'proxy%d' % (i % 100)
+            if rand.random() < 0.05:
+                timeouts.record_timeout('a.com', proxy)
+            else:
+                timeouts.record('a.com', proxy, rand.uniform(0.3, 1.5))
+        # near 1.2 * the healthy p99, not up to the ceiling
+        self.assertLess(timeouts.timeout('a.com', 'proxy0'), 2)
+        self.assertLess(timeouts.timeout('a.com', 'new proxy'), 2)
+
+    def test_slow_host(self):
+        timeouts = AdaptiveTimeouts(floor=0)
+        for _ in range(100):
+            timeouts.record('a.com', None, 1)
+        self.assertAlmostEqual(timeouts.timeout('a.com', None), 1.2, delta=0.1)
+        for _ in range(200):
+            timeouts.record_timeout('a.com', None)
+        self.assertAlmostEqual(timeouts.timeout('a.com', None), 2.4, delta=0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import datetime
+import unittest
+
+from requests.structures import CaseInsensitiveDict
+
+from core.page import CharsetDetector, Page, PageAborted, read_page, sniff_charset
+
+
+class FakeResponse:
+    def __init__(self, body, headers):
+        self.url = 'http://example.com'
+        self.status_code = 200
+        self.headers = CaseInsensitiveDict(headers)
+        self.encoding = 'utf-8'
+        self.elapsed = datetime.timedelta(seconds=0.1)
+        self.body = body
+        self.closed = False
+        self.raw = None
+        self.reason = 'OK'
+        self.request = type('Request', (), {'headers': {'User-Agent': 'test'}})()
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class TestPage(unittest.TestCase):
+    def test_read(self):
+        res = FakeResponse('héllo'.encode(), {'Content-Type': 'text/html; charset=utf-8'})
+        page = read_page(res, content_types=['text/html'])
+        self.assertEqual(page.text, 'héllo')
+        self.assertTrue(res.closed)
+
+    def test_abort(self):
+        res = FakeResponse(b'x' * 100, {'Content-Type': 'application/pdf'})
+        with self.assertRaises(PageAborted) as cm:
+            read_page(res, content_types=['text/html'])
+        self.assertFalse(cm.exception.retry)
+        self.assertTrue(res.closed)
+
+        res = FakeResponse(b'x' * 100, {})
+        with self.assertRaises(PageAborted):
+            read_page(res, max_size=50, chunk_size=10)
+
+    def test_content_length(self):
+        for length in ['10, 10', 'abc', '']:
+            page = read_page(FakeResponse(b'x' * 10, {'Content-Length': length}), max_size=50)
+            self.assertEqual(page.content, b'x' * 10)
+        with self.assertRaises(PageAborted):
+            read_page(FakeResponse(b'x' * 10, {'Content-Length': '100, 100'}), max_size=50)
+
+    def test_charset(self):
+        self.assertEqual(sniff_charset(b'<html><meta charset="GBK">'), 'gbk')
+        self.assertEqual(sniff_charset(b'<meta http-equiv="Content-Type" content="text/html; charset=Shift_JIS">'),
+                         'shift_jis')
+        self.assertEqual(sniff_charset(b'<?xml version="1.0" encoding="latin-1"?>'), 'iso8859-1')
+        self.assertIsNone(sniff_charset(b'<html>' + b' ' * 5000 + b'<meta charset="gbk">'))
+
+        detector = CharsetDetector()
+        body = '中文内容'.encode('gbk') * 50
+        self.assertEqual(detector.encoding('a', Page('', 200, {}, body, 'utf-8')), ('utf-8', 'header'))
+        encoding, source = detector.encoding('a', Page('', 200, {}, body))
+        self.assertEqual(source, 'detect')
+        self.assertEqual(detector.encoding('a', Page('', 200, {}, b'abc')), (encoding, 'cache'))
+
+    def test_wire_size(self):
+        res = FakeResponse(b'x' * 100, {'Content-Encoding': 'gzip'})
+        res.raw = type('Raw', (), {'tell': lambda self: 30})()
+        page = read_page(res)
+        self.assertEqual((page.wire_size, len(page.content)), (30, 100))
+        self.assertIn('content-encoding', page.headers)
@@ -0,0 +1,17 @@
+import unittest
+
+from core.parse_memo import ParseMemo
+
+
+class TestParseMemo(unittest.TestCase):
+    def test_lru(self):
+        memo = ParseMemo(max_size=2)
+        self.assertIsNone(memo.get(b'a'))
+        memo.put(b'a', ['result'], [('/next', 0, True)])
+        memo.put(b'b', [], [])
+        self.assertEqual(memo.get(b'a'), (['result'], [('/next', 0, True)]))
+        # b is the least recently used
+        memo.put(b'c', [], [])
+        self.assertIsNone(memo.get(b'b'))
+        self.assertIsNotNone(memo.get(b'a'))
+        self.assertEqual(memo.report(), {'hits': 2, 'redis_hits': 0, 'misses': 2, 'hit_rate': 0.5, 'size': 2})
@@ -0,0 +1,47 @@
+import unittest
+
+import fakeredis
+
+import proxy_pools  # noqa: F401, registers the proxy pools
+from core.proxy_broker import ProxyBroker, ProxyBrokerClient
+
+
+class TestProxyBroker(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        self.broker = ProxyBroker('fake', max_concurrency=2, redis_db=self.redis)
+        self.client = ProxyBrokerClient(self.redis, client_id='a')
+
+    def acquire_all(self):
+        leases = []
+        lease = self.client.acquire()
+        while lease is not None:
+            leases.append(lease)
+            lease = self.client.acquire()
+        return leases
+
+    def test_max_concurrency(self):
+        self.broker.add_proxies(['http://p1', 'http://p2'])
+        self.broker.update_capacity()
+        leases = self.acquire_all()
+        self.assertEqual(sorted(ProxyBrokerClient.proxy_of(lease) for lease in leases),
+                         ['http://p1', 'http://p1', 'http://p2', 'http://p2'])
+        for lease in leases:
+            self.assertEqual(self.client.release(lease, 0), 1)
+        self.assertEqual(self.redis.llen(self.broker.keys.free), 4)
+
+    def test_collected_again_while_leased(self):
+        self.broker.add_proxies(['http://p1'])
+        self.broker.update_capacity()
+        held = self.client.acquire()
+        self.broker.remove_proxies({'http://p1'})
+        self.broker.add_proxies(['http://p1'])
+        self.broker.update_capacity()
+        # the lease held before the proxy was retired still counts
+        self.assertEqual(self.redis.llen(self.broker.keys.free), 1)
+        self.client.release(held)
+        self.assertEqual(self.redis.lrange(self.broker.keys.free, 0, -1), [b'http://p1', b'http://p1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
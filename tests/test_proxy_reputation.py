@@ -0,0 +1,64 @@
+import unittest
+
+import fakeredis
+
+import proxy_pools  # noqa: F401, registers the proxy pools
+from core.proxy_pool import PROXY_POOL_REGISTRY
+from core.proxy_reputation import ProxyReputation
+
+
+class TestProxyReputation(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis()
+
+    def test_request_errors_dont_ban(self):
+        reputation = ProxyReputation(self.redis)
+        for _ in range(30):
+            reputation.feedback('http://p1', 1)
+        self.assertFalse(reputation.is_bad('http://p1'))
+        for _ in range(3):
+            reputation.feedback('http://p1', 2)
+        self.assertTrue(reputation.is_bad('http://p1'))
+
+    def test_proxy_errors_ban(self):
+        reputation = ProxyReputation(self.redis, max_fail_streak=3)
+        for _ in range(3):
+            reputation.feedback('http://p1', 2)
+            reputation.feedback('http://p1', -1)
+        self.assertFalse(reputation.is_bad('http://p1'))
+        reputation.feedback('http://p1', 2)
+        self.assertTrue(reputation.is_bad('http://p1'))
+        reputation.feedback('http://p1', 0)
+        self.assertEqual(reputation.fail_streak('http://p1'), 0)
+        self.assertAlmostEqual(reputation.score('http://p1'), -3, places=2)
+
+    def test_decay(self):
+        reputation = ProxyReputation(self.redis, half_life=100)
+        for _ in range(8):
+            reputation.feedback('http://p1', 2)
+        now = reputation.records['http://p1'][1]
+        self.assertTrue(reputation.is_bad('http://p1', now))
+        self.assertAlmostEqual(reputation.score('http://p1', now + 100), -4, delta=0.1)
+        self.assertFalse(reputation.is_bad('http://p1', now + 100))
+
+    def test_flush_and_load(self):
+        reputation = ProxyReputation(self.redis, flush_interval=60)
+        reputation.feedback('http://p1', 0)
+        # not written before the flush interval
+        self.assertEqual(ProxyReputation(self.redis).load(), 0)
+        reputation.flush()
+        other = ProxyReputation(self.redis)
+        self.assertEqual(other.load(), 1)
+        self.assertAlmostEqual(other.score('http://p1'), 1, places=2)
+
+    def test_flush_on_close(self):
+        pool = PROXY_POOL_REGISTRY['fake'](self.redis, {'task_name': 'test'})
+        pool.feedback_proxy('http://p1', 2)
+        pool.close()
+        other = ProxyReputation(self.redis)
+        self.assertEqual(other.load(), 1)
+        self.assertEqual(other.fail_streak('http://p1'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
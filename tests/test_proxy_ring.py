@@ -0,0 +1,38 @@
+import unittest
+
+from proxy_pools.haipproxy.client.py_cli import GreedyStrategy, ProxyRing, RobinStrategy
+
+
+class TestProxyRing(unittest.TestCase):
+    def setUp(self):
+        self.pool = ProxyRing(maxlen=4)
+        self.pool.extend(['a', 'b', 'c'])
+
+    def test_dedup_and_bound(self):
+        self.assertEqual(self.pool.extend(['a', 'd', 'e']), 1)
+        self.assertEqual(list(self.pool), ['a', 'b', 'c', 'd'])
+
+    def test_rotate_and_discard(self):
+        self.assertEqual(self.pool.rotate(), 'a')
+        self.pool.discard('b')
+        self.assertEqual(self.pool.first(), 'c')
+        self.pool.add('b')
+        self.assertEqual(list(self.pool), ['c', 'a', 'b'])
+        self.assertEqual(len(self.pool), 3)
+
+    def test_strategies(self):
+        robin = RobinStrategy()
+        self.assertEqual([robin.get_proxies_by_stragery(self.pool) for _ in range(4)], ['a', 'b', 'c', 'a'])
+        robin.process_feedback(self.pool, 'failure', 'a')
+        self.assertNotIn('a', self.pool)
+
+        greedy = GreedyStrategy()
+        self.assertEqual(greedy.get_proxies_by_stragery(self.pool), 'b')
+        greedy.process_feedback(self.pool, 'success', 'b', real=10000, expected=5)
+        self.assertEqual(greedy.get_proxies_by_stragery(self.pool), 'c')
+        greedy.process_feedback(self.pool, 'failure', 'b')
+        self.assertIn('b', self.pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import threading
+import unittest
+from queue import Queue
+
+from core.proxy_session import StickyProxySessions
+
+
+class TestStickyProxySessions(unittest.TestCase):
+    def setUp(self):
+        self.q_proxy = Queue()
+        for i in range(10):
+            self.q_proxy.put('http://p%d' % i)
+        self.q_feedback = Queue()
+        self.sessions = StickyProxySessions(self.q_proxy, self.q_feedback, ['agent'], max_requests=3)
+
+    def test_bind_per_host(self):
+        session, proxy, _ = self.sessions.acquire('a.com')
+        self.sessions.feedback('a.com', proxy, 0)
+        self.assertEqual(self.sessions.acquire('a.com')[:2], (session, proxy))
+        other_session, other_proxy, _ = self.sessions.acquire('b.com')
+        self.assertNotEqual(other_proxy, proxy)
+        self.assertIsNot(other_session, session)
+        self.assertEqual(session.headers['User-Agent'], 'agent')
+        # proxies are only given back when released
+        self.assertTrue(self.q_feedback.empty())
+
+    def test_bind_per_thread(self):
+        proxy = self.sessions.acquire('a.com')[1]
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(self.sessions.acquire('a.com')[1]))
+        thread.start()
+        thread.join()
+        self.assertNotEqual(acquired[0], proxy)
+
+    def test_rotate(self):
+        proxy = self.sessions.acquire('a.com')[1]
+        for _ in range(2):
+            self.assertEqual(self.sessions.acquire('a.com')[1], proxy)
+        # after max_requests
+        self.assertNotEqual(self.sessions.acquire('a.com')[1], proxy)
+        self.assertEqual(self.q_feedback.get_nowait(), (proxy, 0))
+        # after max_seconds
+        proxy = self.sessions.acquire('a.com')[1]
+        self.sessions._bindings()['a.com']['since'] -= 301
+        self.assertNotEqual(self.sessions.acquire('a.com')[1], proxy)
+        self.assertEqual(self.q_feedback.get_nowait(), (proxy, 0))
+
+    def test_release_on_failure(self):
+        proxy = self.sessions.acquire('a.com')[1]
+        self.sessions.feedback('a.com', proxy, 2)
+        self.assertEqual(self.q_feedback.get_nowait(), (proxy, 2))
+        self.assertNotEqual(self.sessions.acquire('a.com')[1], proxy)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import time
+import unittest
+
+import fakeredis
+
+from core.rate_limiter import DistributedRateLimiter
+
+
+class TestDistributedRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis()
+
+    def test_shared_rate(self):
+        limiters = [DistributedRateLimiter(self.redis, 'rate', qps=100, burst_sec=0.05) for _ in range(2)]
+        start = time.time()
+        for i in range(40):
+            limiters[i % 2].acquire()
+        # 40 requests at 100 qps, minus the burst
+        self.assertGreater(time.time() - start, 0.25)
+        self.assertLess(time.time() - start, 1)
+
+    def test_burst(self):
+        limiter = DistributedRateLimiter(self.redis, 'rate', qps=10, burst_sec=1)
+        start = time.time()
+        for _ in range(10):
+            limiter.acquire()
+        self.assertLess(time.time() - start, 0.1)
+
+    def test_keep_granted_tokens(self):
+        limiter = DistributedRateLimiter(self.redis, 'rate', qps=1000, burst_sec=1, batch_sec=0.05)
+        calls = []
+        script = limiter._script
+        limiter._script = lambda **kwargs: calls.append(1) or script(**kwargs)
+        limiter.acquire()
+        self.assertEqual((len(calls), limiter.tokens), (1, 49))
+        time.sleep(0.1)
+        # the tokens are charged already, they are used instead of asking for more
+        for _ in range(49):
+            limiter.acquire()
+        self.assertEqual(len(calls), 1)
+        limiter.acquire()
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import os
+import tempfile
+import unittest
+
+from core.page import Page
+from core.response_store import ResponseStore
+from crawlers.glosbe.dict_crawler import DictCrawler
+
+PAGE = ('<html><div id="phraseHeaderId"><span>hello</span></div>'
+        '<div class="text-info"><strong>bonjour</strong></div></html>').encode()
+
+
+class TestReparser(unittest.TestCase):
+    def test_reparse(self):
+        directory = tempfile.mkdtemp()
+        store = ResponseStore(os.path.join(directory, 'store', '0'))
+        for url in ['/en/fr/hello', '/en/fr/hello?page=2']:
+            store.put(url, Page(url, 200, {'Content-Type': 'text/html'}, PAGE, 'utf-8'))
+        store.close()
+        args = {'src': 'en', 'tgt': 'fr', 'output_dir': os.path.join(directory, 'out'), 'seed_list': None,
+                'seed_num': 0}
+        with self.assertRaises(ValueError):
+            DictCrawler.reparse(os.path.join(directory, 'store'), processes=1, **args)
+
+        # twice, the second one starts from scratch again
+        for _ in range(2):
+            stats = DictCrawler.reparse(os.path.join(directory, 'store'), processes=1, restart=True, **args)
+            self.assertEqual(stats['success'], 2)
+            with open(os.path.join(directory, 'out', 'en_fr.dict'), encoding='utf-8') as f:
+                self.assertEqual(f.read(), 'hello |||| bonjour\n')
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from core.page import Page
+from core.response_store import MmapHashTable, ResponseArchive, ResponseStore
+
+
+class TestResponseStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def test_hash_table(self):
+        table = MmapHashTable(os.path.join(self.dir, 't.idx'), 'Q', capacity=8)
+        keys = [os.urandom(16) for _ in range(100)]
+        for i, key in enumerate(keys):
+            table.put(key, i)
+        table.close()
+        table = MmapHashTable(os.path.join(self.dir, 't.idx'), 'Q')
+        self.assertEqual(len(table), 100)
+        self.assertEqual([table.get(key)[0] for key in keys], list(range(100)))
+        self.assertIsNone(table.get(os.urandom(16)))
+
+    def test_store(self):
+        store = ResponseStore(os.path.join(self.dir, '0'), segment_size=100)
+        body = b'<html>same</html>' * 10
+        self.assertTrue(store.put('/a', Page('', 200, {'Content-Type': 'text/html'}, body, 'utf-8')))
+        self.assertFalse(store.put('/b', Page('', 200, {}, body)))
+        store.put('/a', Page('', 200, {}, b'new'))
+        self.assertEqual(store.get('/b').content, body)
+        self.assertIsNone(store.get('/c'))
+        store.close()
+
+        archive = ResponseArchive(self.dir)
+        self.assertEqual(len(archive), 2)
+        self.assertEqual([(p.url, p.content) for p in archive], [('/b', body), ('/a', b'new')])
+        archive.close()
+
+    def test_killed_writer(self):
+        path = os.path.join(self.dir, '0')
+        store = ResponseStore(path, flush_interval=3600)
+        store.put('/a', Page('', 200, {}, b'body'))
+        # killed before a flush, nothing is closed
+        killed = store
+        store = ResponseStore(path)
+        self.assertEqual(store.get('/a').content, b'body')
+        self.assertFalse(store.put('/b', Page('', 200, {}, b'body')))
+        self.assertEqual(store.get('/b').content, b'body')
+        store.close()
@@ -0,0 +1,79 @@
+import unittest
+from unittest import mock
+
+import fakeredis
+
+from core.crawler_scheduler import CrawlerScheduler
+from core.result_stream import ResultStream, ResultStreamReader
+
+
+class MockCrawler:
+    @staticmethod
+    def collect_results(context, result):
+        context['collected'].append(result)
+
+    @staticmethod
+    def checkpoint(context):
+        context['checkpointed'] = list(context['collected'])
+
+    @staticmethod
+    def collector_stats(context):
+        return {}
+
+
+class TestResultStream(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        self.stream = ResultStream(self.redis, 'task', shards=2)
+
+    def append(self, shard, results):
+        pipe = self.redis.pipeline()
+        self.stream.append(pipe, shard, results)
+        pipe.sadd('task_done', 'url')
+        pipe.execute()
+
+    def test_read_and_ack(self):
+        reader = ResultStreamReader(self.stream, 0, block=10)
+        self.append(0, ['a', 'b'])
+        self.append(1, ['c'])
+        self.append(0, [('d', 1)])
+        entries = reader.read()
+        self.assertEqual([results for _, results in entries], [['a', 'b'], [('d', 1)]])
+        self.assertEqual(reader.read(), [])
+        self.assertEqual(self.stream.backlog(0), 2)
+        reader.ack([entry_id for entry_id, _ in entries])
+        self.assertEqual(self.stream.backlog(0), 0)
+        self.assertEqual(self.stream.backlog(1), 1)
+
+    def test_redeliver_after_restart(self):
+        reader = ResultStreamReader(self.stream, 0, block=10)
+        for i in range(3):
+            self.append(0, [i])
+        entries = reader.read()
+        reader.ack([entries[0][0]])
+        # the collector dies before the other entries are checkpointed
+        reader = ResultStreamReader(self.stream, 0, block=10)
+        self.append(0, [3])
+        self.assertEqual([results for _, results in reader.read()], [[1], [2]])
+        self.assertEqual([results for _, results in reader.read()], [[3]])
+
+    def test_delete(self):
+        self.append(0, ['a'])
+        self.append(1, ['b'])
+        self.stream.delete()
+        self.assertEqual((self.stream.backlog(0), self.stream.backlog(1)), (0, 0))
+
+    def test_consume_results(self):
+        for i in range(3):
+            self.append(0, [i])
+        context = {'collected': []}
+        runtime_context = {'terminate': True}
+        with mock.patch('redis.StrictRedis', return_value=self.redis):
+            CrawlerScheduler.consume_results(MockCrawler, context, runtime_context, {'task_name': 'task'}, 0, 2)
+        # drained, checkpointed and acknowledged before returning
+        self.assertEqual(context['checkpointed'], [0, 1, 2])
+        self.assertEqual(self.stream.backlog(0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from core.simhash import NearDuplicates, SimHashIndex, distance, shingles, simhash
+
+PAGE = (b'<html><head><style>p {color: red}</style></head><body><h1>%s</h1><p>'
+        + b' '.join(b'word%d' % i for i in range(200)) + b'</p><a href="/en/fr/%s">next</a></body></html>')
+
+
+class TestSimHash(unittest.TestCase):
+    def test_shingles(self):
+        self.assertEqual(shingles(b'<p>a b</p><script>x y</script> c d', size=3), [b'a b c', b'b c d'])
+        self.assertEqual(shingles(b'<a href="/x">x</a><a href=\'/y\'>', 'links'), [b'/x', b'/y'])
+        self.assertEqual(shingles(b'<p></p>'), [])
+
+    def test_distance(self):
+        page = simhash(shingles(PAGE % (b'hello', b'a')))
+        self.assertLessEqual(distance(page, simhash(shingles(PAGE % (b'world', b'b')))), 3)
+        other = simhash(shingles(b' '.join(b'other%d' % i for i in range(200))))
+        self.assertGreater(distance(page, other), 10)
+
+    def test_index(self):
+        index = SimHashIndex(max_distance=3, capacity=2)
+        index.add(0b1111)
+        self.assertEqual(index.near(0b0111 | 1 << 40), 0b1111)
+        self.assertIsNone(index.near(0b1111 << 20 | 1))
+        index.add(1 << 63)
+        index.add(1 << 62)
+        self.assertEqual(len(index), 2)
+        self.assertIsNone(index.near(0b1111))
+
+    def test_near_duplicates(self):
+        near_duplicates = NearDuplicates()
+        self.assertFalse(near_duplicates.seen(PAGE % (b'hello', b'a')))
+        self.assertTrue(near_duplicates.seen(PAGE % (b'world', b'b')))
+        self.assertFalse(near_duplicates.seen(b'<p>nothing alike</p>'))
+        self.assertFalse(near_duplicates.seen(b''))
@@ -0,0 +1,150 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from core.dedup import FingerprintSet
+from core.sinks import CsvSink, JsonlSink, LineSink, ParquetSink, pyarrow, sink_files
+
+
+class TestSinks(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def test_resume_from_checkpoint(self):
+        path = os.path.join(self.dir, 'a.txt')
+        sink = LineSink(path, compression='gzip', buffer_size=10)
+        for i in range(100):
+            sink.write('line %d' % i)
+        sink.close()
+        # a crash after the checkpoint leaves a broken tail
+        with open(path + '.gz', 'ab') as f:
+            f.write(b'garbage')
+
+        sink = LineSink(path, compression='gzip')
+        sink.write('line 100')
+        sink.close()
+        with gzip.open(path + '.gz', 'rt') as f:
+            self.assertEqual(f.read().splitlines(), ['line %d' % i for i in range(101)])
+        with open(path + '.checkpoint') as f:
+            self.assertEqual(json.load(f)['records'], 101)
+
+    def test_resume_plain(self):
+        path = os.path.join(self.dir, 'a.txt')
+        sink = LineSink(path, buffer_size=1)
+        sink.write('line 0')
+        sink.checkpoint()
+        sink.write('line 1')
+        sink.file.flush()
+        killed = sink
+        # a broken last line after the complete ones written since the checkpoint
+        with open(path, 'ab') as f:
+            f.write(b'li')
+        sink = LineSink(path)
+        sink.write('line 2')
+        sink.close()
+        with open(path) as f:
+            self.assertEqual(f.read().splitlines(), ['line 0', 'line 1', 'line 2'])
+        self.assertEqual(sink.records, 3)
+
+    def test_sink_files(self):
+        path = os.path.join(self.dir, 'a.dict')
+        for name in ['a.dict', 'a.00000.dict.gz', 'a.00001.dict.gz', 'a.dict.checkpoint', 'a.00000.dict.gz1.bak',
+                     'b.dict', 'a.phr']:
+            open(os.path.join(self.dir, name), 'w').close()
+        self.assertEqual([os.path.basename(f) for f in sink_files(path)],
+                         ['a.00000.dict.gz', 'a.00001.dict.gz', 'a.dict', 'a.dict.checkpoint'])
+
+    def test_on_checkpoint(self):
+        path = os.path.join(self.dir, 'a.txt')
+        seen = FingerprintSet(path + '.seen', undo_log=True)
+        sink = LineSink(path, compression='gzip', buffer_size=1, on_checkpoint=seen.checkpoint)
+        for i in range(20):
+            seen.add(str(i))
+            sink.write('line %d' % i)
+            if i == 9:
+                sink.last_checkpoint = 0
+                sink.tick()
+        # crash after the file got the data: both are rolled back to the checkpoint of the first 10 lines
+        sink.file.flush()
+        crashed = seen, sink  # never closed
+        seen = FingerprintSet(path + '.seen', undo_log=True)
+        sink = LineSink(path, compression='gzip', on_checkpoint=seen.checkpoint)
+        self.assertEqual([seen.add(str(i)) for i in [9, 10]], [False, True])
+        sink.write('line 10')
+        sink.close()
+        with gzip.open(path + '.gz', 'rt') as f:
+            self.assertEqual(f.read().splitlines(), ['line %d' % i for i in range(11)])
+
+    def test_on_checkpoint_plain(self):
+        path = os.path.join(self.dir, 'a.txt')
+        seen = FingerprintSet(path + '.seen', undo_log=True)
+        sink = LineSink(path, buffer_size=1, on_checkpoint=seen.checkpoint)
+        for line in ['a ||| b', 'c ||| d']:
+            seen.add(line)
+            sink.write(line)
+            if line == 'a ||| b':
+                sink.checkpoint()
+        # the complete line after the checkpoint is dropped with its fingerprint
+        sink.file.flush()
+        crashed = seen, sink  # never closed
+        seen = FingerprintSet(path + '.seen', undo_log=True)
+        sink = LineSink(path, on_checkpoint=seen.checkpoint)
+        for line in ['a ||| b', 'c ||| d']:
+            if seen.add(line):
+                sink.write(line)
+        sink.close()
+        with open(path) as f:
+            self.assertEqual(f.read().splitlines(), ['a ||| b', 'c ||| d'])
+        self.assertEqual(sink.records, 2)
+
+    def test_rotate(self):
+        path = os.path.join(self.dir, 'a.csv')
+        sink = CsvSink(path, ['a', 'b'], rotate_size=50, buffer_size=1)
+        for i in range(20):
+            sink.write({'a': i, 'b': 'x,y'})
+        sink.close()
+        files = sorted(f for f in os.listdir(self.dir) if f.endswith('.csv'))
+        self.assertGreater(len(files), 1)
+        rows = []
+        for name in files:
+            with open(os.path.join(self.dir, name)) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(lines[0], 'a,b')
+            rows += lines[1:]
+        self.assertEqual(rows, ['%d,"x,y"' % i for i in range(20)])
+
+    def test_jsonl(self):
+        path = os.path.join(self.dir, 'a.jsonl')
+        sink = JsonlSink(path)
+        sink.write({'word': '中文'})
+        sink.close()
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(json.loads(f.readline()), {'word': '中文'})
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet(self):
+        import pyarrow.parquet
+        schema = pyarrow.schema([('word', pyarrow.string()), ('translations', pyarrow.list_(pyarrow.string()))])
+        sink = ParquetSink(self.dir, schema, row_group_size=10)
+        for i in range(25):
+            sink.write({'word': 'w%d' % i, 'translations': ['t%d' % i]})
+        sink.close()
+        meta = pyarrow.parquet.ParquetFile(os.path.join(self.dir, 'part-00000.parquet')).metadata
+        self.assertEqual(meta.num_row_groups, 3)
+        table = pyarrow.parquet.read_table(self.dir)
+        self.assertEqual(table.column('word').to_pylist(), ['w%d' % i for i in range(25)])
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_tick(self):
+        import pyarrow.parquet
+        schema = pyarrow.schema([('word', pyarrow.string())])
+        # a gap in the parts, e.g. a deleted one
+        open(os.path.join(self.dir, 'part-00001.parquet'), 'wb').close()
+        sink = ParquetSink(self.dir, schema, checkpoint_interval=0)
+        sink.write({'word': 'a'})
+        sink.tick()
+        table = pyarrow.parquet.read_table(os.path.join(self.dir, 'part-00002.parquet'))
+        self.assertEqual(table.column('word').to_pylist(), ['a'])
+        sink.close()
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+
+from requests.structures import CaseInsensitiveDict
+
+from core.page import Page
+from core.warc import AsyncWarcWriter, WarcWriter, read_warc
+
+
+class TestWarc(unittest.TestCase):
+    def test_write_read(self):
+        directory = tempfile.mkdtemp()
+        writer = WarcWriter(directory, 'test', max_size=1)
+        body = b'<html>' + os.urandom(600) + b'</html>'
+        headers = CaseInsensitiveDict({'Content-Type': 'text/html', 'Content-Encoding': 'gzip'})
+        for i in range(3):
+            writer.write(Page('http://example.com/a?b=%d' % i, 200, headers, body, reason='OK',
+                              request_headers={'User-Agent': 'test'}))
+        writer.close()
+
+        files = sorted(os.listdir(directory))
+        self.assertEqual(len(files), 3)
+        records = [r for f in files for r in read_warc(os.path.join(directory, f))]
+        self.assertEqual([r.type for r in records],
+                         ['warcinfo', 'request', 'response'] * 3)
+        self.assertEqual(records[1].headers['WARC-Concurrent-To'], records[2].headers['WARC-Record-ID'])
+        self.assertEqual(records[1].http()[0], 'GET /a?b=0 HTTP/1.1')
+        status, response_headers, content = records[2].http()
+        self.assertEqual(status, 'HTTP/1.1 200 OK')
+        self.assertNotIn('Content-Encoding', response_headers)
+        self.assertEqual(content, body)
+
+    def test_read_truncated(self):
+        for compress in [True, False]:
+            directory = tempfile.mkdtemp()
+            writer = WarcWriter(directory, 'test', compress=compress)
+            for i in range(2):
+                writer.write(Page('http://example.com/%d' % i, 200, CaseInsensitiveDict({'Content-Type': 'text/html'}),
+                                  b'<html>%d</html>' % i, reason='OK'))
+            writer.close()
+            path = os.path.join(directory, os.listdir(directory)[0])
+            # the writer died in the middle of the last record
+            with open(path, 'r+b') as f:
+                f.truncate(os.path.getsize(path) - 40)
+            records = list(read_warc(path))
+            self.assertEqual([r.type for r in records], ['warcinfo', 'response'])
+            self.assertEqual(records[1].http()[2], b'<html>0</html>')
+
+    def test_async_writer(self):
+        directory = tempfile.mkdtemp()
+        writer = AsyncWarcWriter(WarcWriter(directory, 'test'), batch_size=4)
+        for i in range(10):
+            writer.write(Page('http://example.com/%d' % i, 200, CaseInsensitiveDict(), b'%d' % i, reason='OK'))
+        writer.close()
+        records = [r for f in sorted(os.listdir(directory)) for r in read_warc(os.path.join(directory, f))]
+        self.assertEqual([r.headers['WARC-Target-URI'] for r in records if r.type == 'response'],
+                         ['http://example.com/%d' % i for i in range(10)])